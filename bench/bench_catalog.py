@@ -0,0 +1,119 @@
+#!/usr/local/bin/python3
+"""
+Compare speed of the search with the basic catalog of segments, with
+segments.EXTENDED, with another catalog and with other builds of the
+solver.
+
+A build given by --against is a directory with the solver built in place,
+e.g. of the commit before the catalog:
+  git worktree add ../before <commit> && cd ../before &&
+  python3 setup.py build_ext --inplace
+Every search runs in a new process in the directory of its build.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segments
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the directory of a build, prints the number of states and the
+# best time. The material is the basic one, with a catalog its other
+# counters are given as NAME=N. Builds before the catalog are measured
+# only with the basic pieces.
+MEASURE = '''
+import sys, time
+import dynamic, solver
+material = solver.Material(*map(int, sys.argv[1:6]))
+kwargs = {}
+if sys.argv[7]:
+    import segments
+    kwargs['catalog'] = segments.load(sys.argv[7])
+    material = solver.catalog_material(
+        kwargs['catalog'], material, sys.argv[8:])
+best = None
+for _ in range(int(sys.argv[6])):
+    start = time.perf_counter()
+    search = dynamic.Search(material, **kwargs)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+print(len(search), best)
+'''
+
+# Other materials of the extended search by default, none of them, so
+# that it measures the generic search of the basic material in half units.
+# The default material with one short piece takes about 3.4 GB, with
+# two of them or a crossing it doesn't fit into 6 GB.
+EXTENDED = ('short=0', 'short_turns=0', 'crossings=0')
+
+
+def measure(directory, material, repeat, catalog=None, counts=()):
+    """Return states and the best time of the search in the build."""
+    output = subprocess.run(
+        [sys.executable, '-c', MEASURE] + [str(x) for x in material] +
+        [str(repeat), catalog or ''] + list(counts),
+        cwd=directory, check=True, stdout=subprocess.PIPE,
+        universal_newlines=True).stdout
+    states, elapsed = output.split()
+    return int(states), float(elapsed)
+
+
+def _write_catalog(catalog, directory):
+    filename = os.path.join(directory, 'catalog.json')
+    with open(filename, 'w') as f:
+        json.dump(segments.to_json(catalog), f)
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--turns', type=int, default=16, help='number of turn segments')
+    parser.add_argument(
+        '--straight', type=int, default=6, help='number of straight segments')
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='best of the number of runs')
+    parser.add_argument(
+        '--catalog', default=None,
+        help='JSON file with a catalog to compare too')
+    parser.add_argument(
+        '--count', dest='counts', metavar='NAME=N', action='append',
+        default=[], help='number of pieces of a material of the catalog')
+    parser.add_argument(
+        '--extended', metavar='NAME=N', action='append', default=None,
+        help='number of pieces of the other materials of segments.EXTENDED, '
+             'by default %s' % ' '.join(EXTENDED))
+    parser.add_argument(
+        '--against', metavar='DIR', action='append', default=[],
+        help='directory with another build of the solver')
+    args = parser.parse_args()
+    # given counts override the defaults, the last count of a name wins
+    extended = list(EXTENDED) + (args.extended or [])
+    material = (args.straight, args.turns, 2, 2, 4)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [(directory, directory, None, ()) for directory in args.against]
+        runs.append(('basic', ROOT, None, ()))
+        runs.append(('extended', ROOT,
+                     _write_catalog(segments.EXTENDED, tmp), extended))
+        if args.catalog:
+            runs.append((args.catalog, ROOT, os.path.abspath(args.catalog),
+                         args.counts))
+        for name, directory, catalog, counts in runs:
+            states, elapsed = measure(
+                directory, material, args.repeat, catalog, counts)
+            print('%-24s %10d states %8.3fs %10.0f states/s' % (
+                name, states, elapsed, states / elapsed))
+
+
+if __name__ == '__main__':
+    main()
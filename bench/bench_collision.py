@@ -0,0 +1,98 @@
+#!/usr/local/bin/python3
+"""
+Compare collision checking time of the x sweep and of the grid index
+against the length of the track.
+"""
+
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import collision
+import track
+
+
+def sweep_intersections(track):
+    # x sweep which tests a new segment against all opened ones
+    segments = collections.defaultdict(list)
+    for height, line, bounds in collision._segment_lines(track):
+        segments[height].append((line, bounds))
+    n = len(track.path)
+    for lines in segments.values():
+        events = []
+        for line, bounds in lines:
+            events.append((bounds[0], 0, line, bounds))
+            events.append((bounds[1], 1, line, bounds))
+        events.sort(key=lambda event: event[:2])
+        opened = {}
+        for _, etype, line, bounds in events:
+            if etype == 0:
+                for line2, bounds2 in opened.items():
+                    if bounds[3] < bounds2[2] or bounds2[3] < bounds[2]:
+                        continue
+                    if (line2.id != line.id and
+                            not collision.adjacent(line2.id, line.id, n) and
+                            collision.line_intersection(line, line2)):
+                        return True
+                opened[line] = bounds
+            else:
+                del opened[line]
+    return False
+
+
+def random_track(length, rng):
+    # Random walk which doesn't cross itself, it needn't be closed.
+    while True:
+        path = ''
+        for _ in range(length):
+            for _ in range(20):
+                p = path + rng.choice('SSRL')
+                if not collision.path_intersections(track.Track(p)):
+                    path = p
+                    break
+            else:
+                break
+        if len(path) == length:
+            return path
+
+
+METHODS = [
+    ('sweep', sweep_intersections),
+    ('grid', collision.path_intersections),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--count', type=int, default=20, help='number of tracks per length')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    print('%6s' % 'length' + ''.join('%12s' % name for name, _ in METHODS))
+    for length in range(20, 201, 20):
+        tracks = [track.Track(random_track(length, rng))
+                  for _ in range(args.count)]
+        for t in tracks:
+            # geometry is not a part of the measurement
+            t.pos, t.lattice, t.level
+        line = '%6d' % length
+        expected = None
+        for name, method in METHODS:
+            start = time.perf_counter()
+            result = [method(t) for t in tracks]
+            elapsed = time.perf_counter() - start
+            if expected is None:
+                expected = result
+            assert result == expected, name
+            line += '%10.2fms' % (1000 * elapsed / len(tracks))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
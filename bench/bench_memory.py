@@ -0,0 +1,99 @@
+#!/usr/local/bin/python3
+"""
+Measure peak RSS and time of a whole solver.py run in this build and in
+other builds, and report the reduction of peak RSS against them.
+
+A build given by --against is a directory with the solver built in place,
+e.g. of the commit before the packed states:
+  git worktree add ../before <commit> && cd ../before &&
+  python3 setup.py build_ext --inplace
+Every run is a new process in the directory of its build, with an empty
+cache of tracks. The reduction is compared with --target and reported as
+met or missed. If the other build was killed, e.g. by running out of
+memory, its peak RSS is only a lower bound and so is the reduction.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(directory, args, cache):
+    """Return the exit status, peak RSS in MB and time of solver.py."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, 'solver.py'] + args, cwd=directory,
+        stdout=subprocess.DEVNULL,
+        env=dict(os.environ, LILLABO_CACHE=cache))
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    rss = usage.ru_maxrss
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return status, rss / float(1 << 20), elapsed
+
+
+def _status(status):
+    if os.WIFSIGNALED(status):
+        return 'killed by signal %d' % os.WTERMSIG(status)
+    return 'exit status %d' % os.WEXITSTATUS(status)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--turns', type=int, default=16, help='number of turn segments')
+    parser.add_argument(
+        '--straight', type=int, default=6, help='number of straight segments')
+    parser.add_argument(
+        '--ups', type=int, default=2, help='number of uphill segments')
+    parser.add_argument(
+        '--downs', type=int, default=2, help='number of downhill segments')
+    parser.add_argument(
+        '--pillars', type=int, default=4, help='number of pillars')
+    parser.add_argument(
+        '--target', type=float, default=4.0,
+        help='requested reduction of peak RSS against the other builds')
+    parser.add_argument(
+        '--against', metavar='DIR', action='append', default=[],
+        help='directory with another build of the solver')
+    args = parser.parse_args()
+    solver_args = [
+        '--turns=%d' % args.turns, '--straight=%d' % args.straight,
+        '--ups=%d' % args.ups, '--downs=%d' % args.downs,
+        '--pillars=%d' % args.pillars]
+
+    results = []
+    for directory in args.against + [ROOT]:
+        with tempfile.TemporaryDirectory() as cache:
+            status, rss, elapsed = measure(directory, solver_args, cache)
+        print('%-24s %8.0f MB %8.1fs  %s' % (
+            directory, rss, elapsed, _status(status)))
+        results.append((directory, status, rss))
+
+    _, status, rss = results.pop()
+    for directory, other_status, other_rss in results:
+        if status:
+            print('%s: no reduction, the run of this build failed' % directory)
+            continue
+        reduction = other_rss / rss
+        if other_status:
+            # the other run needed more than it got before it was stopped
+            print('%s: peak RSS reduced at least %.2f times, target %.2f %s' % (
+                directory, reduction, args.target,
+                'met' if reduction >= args.target else 'not shown'))
+        else:
+            print('%s: peak RSS reduced %.2f times, target %.2f %s' % (
+                directory, reduction, args.target,
+                'met' if reduction >= args.target else 'missed'))
+
+
+if __name__ == '__main__':
+    main()
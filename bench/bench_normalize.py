@@ -0,0 +1,57 @@
+#!/usr/local/bin/python3
+"""
+Compare speed of path normalization on paths found by the solver.
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dynamic
+import solver
+import track
+
+
+def normalize_brute_force(paths):
+    return [min(track.all_symetries(p)) for p in paths]
+
+
+def normalize_python(paths):
+    return [track.canonical_path(p) for p in paths]
+
+
+METHODS = [
+    ('min(all_symetries)', normalize_brute_force),
+    ('track.canonical_path', normalize_python),
+    ('dynamic.canonical_paths', dynamic.canonical_paths),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--count', type=int, default=10**6, help='number of paths')
+    args = parser.parse_args()
+    material = solver.Material(
+        straight=4, turns=12, ups=2, downs=2, pillars=4)
+    paths = list(itertools.islice(
+        itertools.cycle(dynamic.find_all_paths(material)), args.count))
+
+    expected = None
+    for name, normalize in METHODS:
+        start = time.perf_counter()
+        result = normalize(paths)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = result
+        assert result == expected, name
+        print('%-24s %8.3fs %10.0f paths/s' % (
+            name, elapsed, len(paths) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
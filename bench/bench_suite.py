@@ -0,0 +1,213 @@
+#!/usr/local/bin/python3
+"""
+Measure every stage of the solver pipeline on a ladder of materials.
+
+Wall time, peak RSS, states visited, tracks simplified and paths produced
+are written as JSON with --output. With --baseline the run is compared to
+a stored one and the exit status is 1 if a stage got slower or bigger than
+the threshold or if it produced a different number of states, tracks or
+paths.
+"""
+
+import argparse
+import collections
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import collision
+import dynamic
+import simplify
+import solver
+import track
+
+
+LADDER = collections.OrderedDict([
+    ('t8', solver.Material(straight=2, turns=8, ups=2, downs=2, pillars=2)),
+    ('t10', solver.Material(straight=2, turns=10, ups=2, downs=2, pillars=3)),
+    ('default', solver.Material(straight=4, turns=12, ups=2, downs=2, pillars=4)),
+    ('t14', solver.Material(straight=4, turns=14, ups=2, downs=2, pillars=4)),
+    ('t16', solver.Material(straight=4, turns=16, ups=2, downs=2, pillars=4)),
+])
+
+# stages faster than this are not compared, their time is mostly noise
+MIN_TIME = 0.05
+
+# peak RSS is compared only if it grew by more than this many kB
+MIN_RSS = 4096
+
+
+def _reset_peak_rss():
+    # Linux resets the high water mark of the process on writing 5, other
+    # systems report the peak of the whole run.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss():
+    # in kB
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _forward(material, data):
+    data['search'] = dynamic.Search(material)
+    return {'states': len(data['search'])}
+
+
+def _backward(material, data):
+    data['paths'] = list(data.pop('search').iter_paths(canonical=True))
+    return {'paths': len(data['paths'])}
+
+
+def _normalize(material, data):
+    data['paths'] = solver.normalize_paths(data['paths'])
+    return {'paths': len(data['paths'])}
+
+
+def _validate(material, data):
+    data['tracks'] = track.valid_tracks(
+        data.pop('paths'), material, check_collisions=False)
+    return {'paths': len(data['tracks'])}
+
+
+def _collision(material, data):
+    data['tracks'] = [
+        t for t in data['tracks'] if not collision.path_intersections(t)]
+    return {'paths': len(data['tracks'])}
+
+
+def _simplify(material, data):
+    codes = dict.fromkeys(
+        simplify.encode(t.path) for t in data.pop('tracks'))
+    index = simplify.simplify_index(codes)
+    data['paths'] = [
+        simplify.decode(c) for c in simplify.reduce_tracks(codes, index)]
+    return {'tracks': len(codes), 'paths': len(data['paths'])}
+
+
+def _render(material, data):
+    size = sum(len(track.Track(p).to_svg()) for p in data.pop('paths'))
+    return {'bytes': size}
+
+
+STAGES = [
+    ('forward', _forward),
+    ('backward', _backward),
+    ('normalize', _normalize),
+    ('validate', _validate),
+    ('collision', _collision),
+    ('simplify', _simplify),
+    ('render', _render),
+]
+
+
+def run(material):
+    """Return measurements of the stages on the material."""
+    data = {}
+    result = collections.OrderedDict()
+    for name, stage in STAGES:
+        _reset_peak_rss()
+        start = time.perf_counter()
+        counts = stage(material, data)
+        elapsed = time.perf_counter() - start
+        result[name] = dict(counts, time=elapsed, peak_rss=_peak_rss())
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Return messages about stages which regressed against the baseline."""
+    messages = []
+    for material, stages in results.items():
+        for name, new in stages.items():
+            old = baseline.get(material, {}).get(name)
+            if old is None:
+                continue
+            label = '%s %s' % (material, name)
+            for key in ('states', 'tracks', 'paths', 'bytes'):
+                if key in new and key in old and new[key] != old[key]:
+                    messages.append('%s: %s %d, baseline %d' % (
+                        label, key, new[key], old[key]))
+            if (max(new['time'], old['time']) >= MIN_TIME and
+                    new['time'] > old['time'] * (1 + threshold)):
+                messages.append('%s: %.3fs, baseline %.3fs' % (
+                    label, new['time'], old['time']))
+            if (new['peak_rss'] - old['peak_rss'] > MIN_RSS and
+                    new['peak_rss'] > old['peak_rss'] * (1 + threshold)):
+                messages.append('%s: peak RSS %d kB, baseline %d kB' % (
+                    label, new['peak_rss'], old['peak_rss']))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--up-to', dest='up_to', choices=list(LADDER), default='t14',
+        help='largest material of the ladder')
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='keep the fastest of the number of runs')
+    parser.add_argument(
+        '--output', metavar='FILE', help='write the results as JSON')
+    parser.add_argument(
+        '--baseline', metavar='FILE', help='compare to results of a run')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='relative growth of time or peak RSS reported as a regression')
+    args = parser.parse_args()
+    names = list(LADDER)
+    names = names[:names.index(args.up_to) + 1]
+
+    results = collections.OrderedDict()
+    print('%-8s %-10s %9s %10s %10s %10s %10s' % (
+        'material', 'stage', 'time', 'peak RSS', 'states', 'tracks', 'paths'))
+    for material in names:
+        best = None
+        for _ in range(args.repeat):
+            result = run(LADDER[material])
+            if best is None:
+                best = result
+            for name, stage in result.items():
+                best[name]['time'] = min(best[name]['time'], stage['time'])
+        results[material] = best
+        for name, stage in best.items():
+            print('%-8s %-10s %8.3fs %7d kB %10s %10s %10s' % (
+                material, name, stage['time'], stage['peak_rss'],
+                stage.get('states', ''), stage.get('tracks', ''),
+                stage.get('paths', '')))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'materials': {m: LADDER[m]._asdict() for m in names},
+                'results': results,
+            }, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        messages = compare(results, baseline, args.threshold)
+        for message in messages:
+            print('REGRESSION', message)
+        if messages:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/local/bin/python3
+"""
+Compare speed of track validation on paths found by the solver.
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dynamic
+import solver
+import track
+
+
+def validate_one_by_one(paths, material):
+    return [p for p in paths if track.Track(p).is_valid(material)]
+
+
+def validate_batch(paths, material):
+    return [t.path for t in track.valid_tracks(paths, material)]
+
+
+def geometry_one_by_one(paths, material):
+    return [track.Track(p).pos[-1] for p in paths]
+
+
+def geometry_batch(paths, material):
+    return [tuple(p) for p in track.batch_geometry(paths).pos[:, -1].tolist()]
+
+
+METHODS = [
+    ('Track.pos', geometry_one_by_one),
+    ('track.batch_geometry', geometry_batch),
+    ('Track.is_valid', validate_one_by_one),
+    ('track.valid_tracks', validate_batch),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--count', type=int, default=10**6, help='number of paths')
+    args = parser.parse_args()
+    material = solver.Material(
+        straight=4, turns=12, ups=2, downs=2, pillars=4)
+    paths = list(itertools.islice(
+        itertools.cycle(dynamic.find_all_paths(material)), args.count))
+
+    expected = {}
+    for name, method in METHODS:
+        start = time.perf_counter()
+        result = method(paths, material)
+        elapsed = time.perf_counter() - start
+        key = method.__name__.split('_')[0]
+        expected.setdefault(key, result)
+        assert result == expected[key], name
+        print('%-24s %8.3fs %10.0f paths/s' % (
+            name, elapsed, len(paths) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
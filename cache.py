@@ -0,0 +1,245 @@
+"""
+Cache of found tracks on disk.
+
+Every material has its own file named by a hash of the material, of the
+solver sources, of the built search module and of the catalog of segments,
+so results of an older solver are never read. A file
+starts with a header followed by paths packed to 3 bits per segment, or
+to 4 bits for catalogs of more than 7 segments, every path is padded to
+the length of the longest one. Segments are coded by their index in the
+catalog. The least recently used files are removed when the cache grows
+over its size limit.
+"""
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+import tempfile
+import warnings
+
+import numpy as np
+
+import dynamic
+import segments
+
+
+CACHE_DIR = os.environ.get(
+    'LILLABO_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'lillabo'))
+
+# bytes, the least recently used files are removed above it, a file of
+# tracks larger than it is not stored, given in MB by LILLABO_CACHE_SIZE
+MAX_SIZE = int(os.environ.get('LILLABO_CACHE_SIZE', 64)) << 20
+
+# files which change the found tracks besides the built search module,
+# which is compiled from dynamic.pyx and the headers
+SOURCES = ('segments.py', 'collision.py', 'solver.py', 'track.py')
+
+MAGIC = b'LTC1'
+# magic, number of paths, length of the longest path
+HEADER = struct.Struct('<4sII')
+
+# paths packed at once when they are stored
+BLOCK_SIZE = 1 << 16
+
+# code which pads shorter paths of catalogs of at most 7 segments, codes of
+# larger catalogs take 4 bits and are padded by 15
+PAD = 7
+
+_version = None
+_tables = {}
+
+
+def _code_tables(catalog=None):
+    # codes of bytes, bytes of codes and bits of a code, the most
+    # significant first, for the catalog
+    if catalog is None:
+        catalog = segments.BASIC
+    names = ''.join(s.name for s in catalog.segments)
+    if names not in _tables:
+        bits = 3 if len(names) <= PAD else 4
+        pad = (1 << bits) - 1
+        symbols = names.ljust(pad, '?') + '-'
+        # bytes which are no segment of the catalog get the code after pad
+        codes = np.full(256, pad + 1, dtype=np.uint8)
+        for code, symbol in enumerate(symbols):
+            if symbol != '?':
+                codes[ord(symbol)] = code
+        _tables[names] = codes, np.frombuffer(
+            symbols.encode('ascii'), dtype=np.uint8), np.array(
+                [1 << i for i in reversed(range(bits))], dtype=np.uint8)
+    return _tables[names]
+
+
+def solver_version():
+    """Hash of the solver sources and of the built search module.
+
+    A missing source raises FileNotFoundError, the version couldn't tell
+    a changed solver apart.
+    """
+    global _version
+    if _version is None:
+        digest = hashlib.sha1(MAGIC)
+        directory = os.path.dirname(os.path.abspath(__file__))
+        paths = [os.path.join(directory, name) for name in SOURCES]
+        for path in paths + [dynamic.__file__]:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _version = digest.hexdigest()
+    return _version
+
+
+def cache_file(material, directory=CACHE_DIR, catalog=None):
+    if catalog is None:
+        catalog = segments.BASIC
+    key = '%s %r %r' % (solver_version(), tuple(material), catalog)
+    name = hashlib.sha1(key.encode('ascii')).hexdigest()
+    return os.path.join(directory, name + '.tracks')
+
+
+def _pack(paths, length, catalog=None):
+    # rows of paths padded to length, packed to 3 or 4 bits per segment
+    to_codes, to_bytes, weights = _code_tables(catalog)
+    data = ''.join(p.ljust(length, '-') for p in paths).encode('ascii')
+    codes = to_codes[np.frombuffer(data, dtype=np.uint8)]
+    if (codes >= len(to_bytes)).any():
+        raise ValueError('Paths have segments which are not in the catalog.')
+    bits = (codes[:, None] & weights) != 0
+    return np.packbits(
+        bits.reshape(len(paths), len(weights) * length), axis=1).tobytes()
+
+
+def encode_paths(paths, catalog=None):
+    """Pack paths to 3 or 4 bits per segment.
+
+    Raise ValueError if a path has a segment which is not in the catalog.
+    """
+    length = max(map(len, paths), default=0)
+    return HEADER.pack(MAGIC, len(paths), length) + _pack(
+        paths, length, catalog)
+
+
+def decode_paths(buffer, catalog=None):
+    magic, count, length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError('Not a file with cached tracks.')
+    if not length:
+        return [''] * count
+    _, to_bytes, weights = _code_tables(catalog)
+    width = len(weights)
+    row = (width * length + 7) // 8
+    packed = np.frombuffer(
+        buffer, dtype=np.uint8, count=count * row, offset=HEADER.size)
+    bits = np.unpackbits(packed.reshape(count, row), axis=1)
+    codes = bits[:, :width * length].reshape(count, length, width) @ weights
+    data = to_bytes[codes].tobytes().decode('ascii')
+    return [
+        data[i:i + length].rstrip('-')
+        for i in range(0, count * length, length)]
+
+
+def load(material, directory=CACHE_DIR, catalog=None):
+    """Return cached paths of the material or None."""
+    filename = cache_file(material, directory, catalog)
+    try:
+        with open(filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                paths = decode_paths(data, catalog)
+        # modification time orders the files for eviction
+        os.utime(filename)
+    except (OSError, ValueError, struct.error):
+        return None
+    return paths
+
+
+def store(material, paths, directory=CACHE_DIR, max_size=MAX_SIZE,
+          catalog=None):
+    writer = Writer(material, directory, max_size, catalog)
+    for path in paths:
+        writer.add(path)
+    return writer.close()
+
+
+class Writer:
+    """Stores paths of the material in the cache as they are added.
+
+    The paths are spooled to a temporary file and packed block by block
+    when the writer is closed, so that they aren't kept in memory. close()
+    raises ValueError if a path has a segment which is not in the catalog.
+    Paths which would take more than max_size bytes are not stored, it
+    warns about them and returns False.
+    """
+
+    def __init__(self, material, directory=CACHE_DIR, max_size=MAX_SIZE,
+                 catalog=None):
+        os.makedirs(directory, exist_ok=True)
+        self.filename = cache_file(material, directory, catalog)
+        self.directory = directory
+        self.max_size = max_size
+        self.catalog = catalog
+        self.count = 0
+        self.length = 0
+        self._spool = tempfile.TemporaryFile('w+', dir=directory)
+
+    def add(self, path):
+        self._spool.write(path + '\n')
+        self.count += 1
+        self.length = max(self.length, len(path))
+
+    def size(self):
+        """Bytes of the file of the paths added so far."""
+        _, _, weights = _code_tables(self.catalog)
+        return HEADER.size + self.count * (
+            (len(weights) * self.length + 7) // 8)
+
+    def close(self):
+        if self.size() > self.max_size:
+            self._spool.close()
+            warnings.warn(
+                'Tracks take %.1f MB, more than the cache size of %.1f MB, '
+                'they are not cached.' % (
+                    self.size() / 2.0**20, self.max_size / 2.0**20))
+            return False
+        self._spool.seek(0)
+        # the file is renamed when complete, so readers never see a part of it
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, self.count, self.length))
+                while True:
+                    block = [p.rstrip('\n') for p in
+                             itertools.islice(self._spool, BLOCK_SIZE)]
+                    if not block:
+                        break
+                    f.write(_pack(block, self.length, self.catalog))
+            os.replace(tmp, self.filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        finally:
+            self._spool.close()
+        evict(self.directory, self.max_size)
+        return True
+
+
+def evict(directory=CACHE_DIR, max_size=MAX_SIZE):
+    """Remove the least recently used files above max_size bytes."""
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.tracks'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # removed by another process storing at the same time
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
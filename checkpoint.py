@@ -0,0 +1,134 @@
+"""
+Checkpoints of a long search.
+
+The file starts with a header with the material and the version of the
+solver and of the catalog of segments and continues with
+records appended as the search goes on, so writing a checkpoint never
+rewrites what is already written. Every record starts with its kind and
+the size of its data:
+  L - keys of a layer of the forward search, 64-bit in native byte order
+  P - tracks found from one closed state, packed as in the cache
+A record cut off by an interrupted write is dropped when resuming.
+
+A resumed file is mapped to memory, the layers are views of the map so
+the search reads them without copying the file.
+"""
+import hashlib
+import mmap
+import os
+import struct
+
+import cache
+import segments
+
+
+MAGIC = b'LCP3'
+# magic, the counters of the material padded with zeros, pillars and
+# version
+HEADER = struct.Struct('<4s%di20s' % (segments.MAX_COUNTERS + 1))
+# kind, size of the data
+RECORD = struct.Struct('<cQ')
+
+
+def version(catalog=None):
+    """Hash of the solver version and of the catalog, keys of states and
+    packed paths are read only by the same solver."""
+    if catalog is None:
+        catalog = segments.BASIC
+    key = '%s %r' % (cache.solver_version(), catalog)
+    return hashlib.sha1(key.encode('ascii')).digest()
+
+
+class Checkpoint:
+    """Checkpoint of the search of the material in filename.
+
+    With resume the records of an existing file are read and the search
+    continues after them. Otherwise a new file is started, an existing one
+    is overwritten only with force, else FileExistsError is raised.
+    """
+
+    def __init__(self, filename, material, resume=False, catalog=None,
+                 force=False):
+        # keys of the layers and paths found from the closed states before
+        # resuming, new records are only written
+        self.layers = []
+        self.paths = []
+        self.catalog = catalog
+        self._map = None
+        counts = tuple(material)[:-1]
+        header = HEADER.pack(
+            MAGIC, *counts + (0,) * (segments.MAX_COUNTERS - len(counts)),
+            material.pillars, version(catalog))
+        if resume and os.path.exists(filename):
+            with open(filename, 'r+b') as f:
+                found = f.read(HEADER.size)
+                if found[:-20] != header[:-20]:
+                    raise ValueError(
+                        'Checkpoint %s is not for material %r.' % (
+                            filename, material))
+                if found != header:
+                    raise ValueError(
+                        'Checkpoint %s was written by another version of '
+                        'the solver.' % filename)
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                f.truncate(self._read_records(memoryview(self._map)))
+        else:
+            try:
+                with open(filename, 'wb' if force else 'xb') as f:
+                    f.write(header)
+            except FileExistsError:
+                raise FileExistsError(
+                    'Checkpoint %s exists, use --resume to continue it or '
+                    '--force to start it again.' % filename) from None
+        self.file = open(filename, 'ab')
+
+    def _read_records(self, data):
+        # returns the end of the last complete record
+        pos = HEADER.size
+        while pos + RECORD.size <= len(data):
+            kind, size = RECORD.unpack_from(data, pos)
+            end = pos + RECORD.size + size
+            if end > len(data):
+                break
+            record = data[pos + RECORD.size:end]
+            if kind == b'L':
+                self.layers.append(record)
+            elif kind == b'P':
+                self.paths.append(cache.decode_paths(record, self.catalog))
+                record.release()
+            else:
+                break
+            pos = end
+        data.release()
+        return pos
+
+    def release_layers(self):
+        """Unmap the layers read when resuming, once the search has them."""
+        for layer in self.layers:
+            if layer is not None:
+                layer.release()
+        self.layers = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _append(self, kind, data):
+        self.file.write(RECORD.pack(kind, len(data)))
+        self.file.write(data)
+        self.file.flush()
+
+    def add_layer(self, keys):
+        self._append(b'L', keys)
+
+    def add_paths(self, paths):
+        self._append(b'P', cache.encode_paths(paths, self.catalog))
+
+    def close(self):
+        self.release_layers()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,85 +1,209 @@
 """
 Test if track collides with itself.
+
+Coordinates are exact, every number has the form u + v*sqrt(2) for integers
+u, v and it is stored as the pair (u, v). A point of Track.lattice
+(ax, bx, ay, by) lies at x = ax*sqrt(2)/2 + bx*(1 - sqrt(2)/2) and is
+scaled by 10, so that points dividing segments in fifths stay integral.
+
+The two ways through a crossing piece intersect in its middle, they don't
+collide.
 """
 import collections
 import math
 
 
-LineSegment = collections.namedtuple('LineSegment', 'id start end')
+# crossing is (name of the segment, doubled middle, direction modulo 4)
+# for ways through a crossing, otherwise None
+LineSegment = collections.namedtuple('LineSegment', 'id start end crossing')
+LineSegment.__new__.__defaults__ = (None,)
+
+
+# margin of float bounds of segments, larger than any rounding error
+EPSILON = 1e-6
+
+
+def lattice_point(point):
+    ax, bx, ay, by = point
+    return (10*bx, 5*(ax - bx), 10*by, 5*(ay - by))
 
 
-def point_on_line(start, end, coef):
-    sx, sy = start
-    ex, ey = end
-    c2 = 1.0 - coef
-    return (ex*coef + sx*c2, ey*coef + sy*c2)
+def point_on_line(start, end, fifths):
+    # lattice points are divisible by 5
+    return tuple((s*(5 - fifths) + e*fifths) // 5 for s, e in zip(start, end))
 
 
-def minus(v1, v2):
-    return v1[0]-v2[0], v1[1]-v2[1]
+def sign(u, v):
+    """Sign of u + v*sqrt(2)."""
+    if u >= 0 and v >= 0:
+        return int(u > 0 or v > 0)
+    if u <= 0 and v <= 0:
+        return -1
+    # u and v have opposite signs, compare u^2 with 2*v^2
+    d = u*u - 2*v*v
+    if u < 0:
+        d = -d
+    return (d > 0) - (d < 0)
 
 
 def cross(v1, v2):
-    return v1[0]*v2[1] - v1[1]*v2[0]
+    """Cross product of vectors (xu, xv, yu, yv) as the pair (u, v)."""
+    x1u, x1v, y1u, y1v = v1
+    x2u, x2v, y2u, y2v = v2
+    return (x1u*y2u + 2*x1v*y2v - y1u*x2u - 2*y1v*x2v,
+            x1u*y2v + x1v*y2u - y1u*x2v - y1v*x2u)
 
 
-def almost_zero(n):
-    return math.fabs(n) <= 1e-3
+def _within(n, d, direction):
+    # n / d lies between 0 and 1, direction is the sign of d
+    return (sign(*n) * direction >= 0 and
+            sign(d[0] - n[0], d[1] - n[1]) * direction >= 0)
 
 
 def line_intersection(line1, line2):
-    a = minus(line1.end, line1.start)
-    b = minus(line2.end, line2.start)
-    cd = minus(line2.start, line1.start)
+    s1, e1, s2, e2 = line1.start, line1.end, line2.start, line2.end
+    a = (e1[0] - s1[0], e1[1] - s1[1], e1[2] - s1[2], e1[3] - s1[3])
+    b = (e2[0] - s2[0], e2[1] - s2[1], e2[2] - s2[2], e2[3] - s2[3])
+    cd = (s2[0] - s1[0], s2[1] - s1[1], s2[2] - s1[2], s2[3] - s1[3])
     cab = cross(a, b)
-    if almost_zero(cab):
+    if cab == (0, 0):
         # coincident lines
-        return almost_zero(cd[0]) and almost_zero(cd[1])
-    # solution according to the cramer's rule
-    t = cross(a, cd) / cab
-    s = cross(cd, b) / cab
-    return (0 <= s <= 1.0) and (0 <= t <= 1.0)
+        return cd == (0, 0, 0, 0)
+    # solution according to the cramer's rule, t and s are fractions
+    # over cab which have to lie between 0 and 1
+    direction = sign(*cab)
+    return (_within(cross(cd, b), cab, direction) and
+            _within(cross(cd, a), cab, direction))
 
 
-def path_intersections(track):
-    # TODO: place positions of pillars
-    segments = collections.defaultdict(list)
+def crossed(line1, line2):
+    """The lines are the two ways through one crossing."""
+    c1, c2 = line1.crossing, line2.crossing
+    return (c1 is not None and c2 is not None and c1[:2] == c2[:2] and
+            abs(c1[2] - c2[2]) == 2)
+
+
+def adjacent(i, j, n):
+    """Segments i and j follow each other on the closed path of length n."""
+    return (i - j) % n in (1, n - 1)
+
+
+def _interpolate(start, end, fifths):
+    c = fifths / 5.0
+    return (start[0]*(1.0 - c) + end[0]*c, start[1]*(1.0 - c) + end[1]*c)
+
+
+def _bounds(start, end):
+    # float bounding box with a margin, it can only report false overlaps
+    return (min(start[0], end[0]) - EPSILON, max(start[0], end[0]) + EPSILON,
+            min(start[1], end[1]) - EPSILON, max(start[1], end[1]) + EPSILON)
+
+
+def _segment_lines(track):
+    # (height, line, bounds) of every part of the track
+    pos = track.pos
+    pieces = {s.name: s for s in track.catalog.segments}
     for i, segment in enumerate(track.path):
-        start = track.pos[i]
-        end = track.pos[i+1]
+        start = lattice_point(track.lattice[i])
+        end = lattice_point(track.lattice[i+1])
         height = track.level[i]
-        if segment == 'U':
-            line = LineSegment(i, start, point_on_line(start, end, 0.8))
-            segments[height].append(line)
-            line = LineSegment(i, point_on_line(start, end, 0.2), end)
-            segments[height+1].append(line)
-        elif segment == 'D':
-            line = LineSegment(i, start, point_on_line(start, end, 0.8))
-            segments[height].append(line)
-            line = LineSegment(i, point_on_line(start, end, 0.2), end)
-            segments[height-1].append(line)
+        climb = pieces[segment].climb
+        if climb:
+            line = LineSegment(i, start, point_on_line(start, end, 4))
+            yield height, line, _bounds(pos[i], _interpolate(pos[i], pos[i+1], 4))
+            line = LineSegment(i, point_on_line(start, end, 1), end)
+            yield height + climb, line, _bounds(_interpolate(pos[i], pos[i+1], 1), pos[i+1])
         else:
-            line = LineSegment(i, start, end)
-            segments[height].append(line)
-
-    for lines in segments.values():
-        events = []
-        for line in lines:
-            start = line.start
-            end = line.end
-            if start[0] > end[0]:
-                start, end = end, start
-            events.append((start[0], 0, line))
-            events.append((end[0], 1, line))
-        events.sort()
-        opened = set()
-        for pos, etype, line in events:
-            if etype == 0:
-                for line2 in opened:
-                    if abs(line2.id - line.id) > 1 and line_intersection(line, line2):
-                        return True
-                opened.add(line)
-            else:
-                opened.remove(line)
+            crossing = None
+            if pieces[segment].crossing:
+                middle = tuple(s + e for s, e in zip(start, end))
+                crossing = segment, middle, track.angle[i] % 4
+            line = LineSegment(i, start, end, crossing)
+            yield height, line, _bounds(pos[i], pos[i+1])
+
+
+class SegmentIndex:
+    """Segments at one height hashed by the grid cells their bounds touch.
+
+    Segments are added in the order of the path, each one is tested only
+    against the segments sharing a cell with it.
+    """
+
+    CELL_SIZE = 3.0
+
+    def __init__(self, length=None):
+        # length of the closed path, its first and last segment are adjacent
+        self.length = length
+        self.cells = collections.defaultdict(list)
+
+    def _adjacent(self, i, j):
+        if self.length is None:
+            return abs(i - j) == 1
+        return adjacent(i, j, self.length)
+
+    def _cells(self, bounds):
+        size = self.CELL_SIZE
+        x0, x1 = math.floor(bounds[0] / size), math.floor(bounds[1] / size)
+        y0, y1 = math.floor(bounds[2] / size), math.floor(bounds[3] / size)
+        if x0 == x1 and y0 == y1:
+            return ((x0, y0),)
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def intersects(self, line, bounds, cells=None):
+        """Return True if the line intersects any indexed segment."""
+        cells_map = self.cells
+        for cell in cells or self._cells(bounds):
+            # a pair sharing more cells is tested repeatedly, that is cheaper
+            # than remembering the tested segments
+            for line2, bounds2 in cells_map.get(cell, ()):
+                if (bounds[1] < bounds2[0] or bounds2[1] < bounds[0] or
+                        bounds[3] < bounds2[2] or bounds2[3] < bounds[2]):
+                    continue
+                if (line2.id != line.id and not self._adjacent(line2.id, line.id)
+                        and line_intersection(line, line2)
+                        and not crossed(line, line2)):
+                    return True
+        return False
+
+    def add(self, line, bounds):
+        """Index the line, return True if it intersects an indexed one."""
+        cells = self._cells(bounds)
+        collides = self.intersects(line, bounds, cells)
+        item = (line, bounds)
+        for cell in cells:
+            self.cells[cell].append(item)
+        return collides
+
+
+def path_intersections(track):
+    # TODO: place positions of pillars
+    n = len(track.path)
+    indexes = collections.defaultdict(lambda: SegmentIndex(n))
+    for height, line, bounds in _segment_lines(track):
+        if indexes[height].add(line, bounds):
+            return True
     return False
 
+
+def count_intersections(track):
+    """Return the number of parts of segments crossing an earlier one."""
+    n = len(track.path)
+    indexes = collections.defaultdict(lambda: SegmentIndex(n))
+    return sum(
+        indexes[height].add(line, bounds)
+        for height, line, bounds in _segment_lines(track))
+
+
+def crossing_pairs(track):
+    """Return the number of crossings driven through both ways by the name
+    of their segment."""
+    ways = collections.defaultdict(set)
+    for height, line, _ in _segment_lines(track):
+        if line.crossing is not None:
+            name, middle, direction = line.crossing
+            ways[name, middle, height].add(direction)
+    pairs = collections.Counter()
+    for (name, _, _), directions in ways.items():
+        # a third way through the middle collides with the others
+        pairs[name] += any((d + 2) % 4 in directions for d in directions)
+    return pairs
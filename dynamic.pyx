@@ -1,190 +1,1832 @@
 # distutils: language=c++
+from libc.stdint cimport uint64_t
+from libc.math cimport sqrt
+from libc.string cimport memcmp, memcpy
 from libcpp cimport bool
-from libcpp.unordered_set cimport unordered_set
+from libcpp.algorithm cimport lower_bound, sort
+from libcpp.string cimport string
+from libcpp.utility cimport pair
 from libcpp.vector cimport vector
 from cython.operator cimport dereference
+from cython.parallel cimport parallel, prange
+
+import bisect
+import collections
+import itertools
+import os
+import random
+import tempfile
+
+import segments
+
+cdef extern from "state.hpp" nogil:
+    enum: MAX_COUNTERS
 
-cdef extern from "state.hpp":
     cdef cppclass State:
         State()
-        State(int ax, int bx, int ay, int by, int angle, int level, int straight, int turns, int ups, int downs, int pillars)
-        int ax, bx, ay, by, angle, level, straight, turns, ups, downs, pillars
+        State(int ax, int bx, int ay, int by, int angle, int level)
+        State(int ax, int bx, int ay, int by, int angle, int level, int pillars)
+        State(int ax, int bx, int ay, int by, int angle, int level, int pillars, int up)
+        int ax, bx, ay, by, angle, level, pillars, up
+        int counts[MAX_COUNTERS]
         bool operator==(const State&)
 
+    cdef cppclass StatePacker:
+        StatePacker()
+        StatePacker(int distance, int level, int counters, const int* counts, int pillars, int up)
+        int bits, counters
+        bool contains(const State&)
+        uint64_t pack(const State&)
+        State unpack(uint64_t)
+        uint64_t pack_basic(const State&)
+        State unpack_basic(uint64_t)
+
+cdef extern from "state_set.hpp" nogil:
+    cdef cppclass StateSet:
+        StateSet()
+        bool insert(uint64_t)
+        bool contains(uint64_t)
+        size_t find(uint64_t)
+        size_t size()
+        size_t capacity()
+        uint64_t slot(size_t)
+        void clear()
+    const uint64_t EMPTY "StateSet::EMPTY"
+
+    cdef cppclass ShardedStateSet:
+        ShardedStateSet()
+        @staticmethod
+        int shard_of(uint64_t)
+        StateSet& shard(int)
+        bool insert(uint64_t)
+        bool contains(uint64_t)
+        size_t size()
+        size_t capacity()
+        size_t probes()
+    const int SHARDS "ShardedStateSet::SHARDS"
+
+cdef extern from "layer_file.hpp" nogil:
+    bool write_run(vector[uint64_t]&, const char*)
+    long long merge_runs(const vector[string]&, const char*)
+
+    cdef cppclass KeyReader:
+        KeyReader()
+        bool open(const char*)
+        void close()
+        size_t read(vector[uint64_t]&, size_t)
+
+    cdef cppclass LayerFile:
+        LayerFile()
+        bool open(const char*)
+        size_t size()
+        uint64_t at(size_t)
+        bool contains(uint64_t)
+
+cdef extern from "reach_table.hpp" nogil:
+    cdef cppclass ReachTable:
+        ReachTable()
+        int build(const int*, int, int, int, int, int, int, size_t) except +
+        uint64_t straight_counts(int ax, int bx, int ay, int by, int angle, int turns, int straight)
+        size_t size()
+
+cdef enum:
+    # number of states expanded by one thread between two merges
+    BATCH = 1 << 16
+
+cdef enum:
+    # rules pruning new states, in the order of PRUNE_RULES
+    PRUNE_TURNS, PRUNE_LEVEL, PRUNE_MATERIAL, PRUNE_DISTANCE, PRUNE_REACH
+    # counters of one chunk fill a cache line, so that threads don't
+    # share them
+    PRUNE_STRIDE = 8
+
+cdef enum:
+    # reasons to drop a prefix in the walk back, in the order of WALK_RULES
+    WALK_SYMMETRY, WALK_UNVISITED, WALK_COLLISION
+
+# number of paths to a state which wasn't counted yet
+cdef uint64_t UNCOUNTED = ~(<uint64_t>0)
+
+PRUNE_RULES = ('turns', 'level', 'material', 'distance', 'reach')
+WALK_RULES = ('symmetry', 'unvisited', 'collision')
+
+# Counters of a layer of a search, pruned maps PRUNE_RULES to the number
+# of states cut off by them. Probe length is the mean number of occupied
+# slots passed by an insert into the visited set, it and the load factor
+# are None for states kept in files.
+LayerStats = collections.namedtuple(
+    'LayerStats',
+    'search layer frontier visited generated pruned load_factor probe_length')
+
+# Counters of the walk back so far, prefixes[k] is the number of paths
+# of k + 1 segments from the end which survived, pruned maps WALK_RULES
+# to the number of prefixes dropped by them.
+WalkStats = collections.namedtuple('WalkStats', 'keys paths prefixes pruned')
+
+# number of keys sorted in memory before they are written to disk,
+# when layers of the search are stored in files
+RUN_SIZE = 1 << 24
+
+# entries of the table of positions which can return to the origin,
+# states with more remaining pieces than the table knows aren't pruned by it
+REACH_TABLE_SIZE = 1 << 22
+
+# closed paths in a row which Search.sample_paths rejects before it gives up
+SAMPLE_ATTEMPTS = 1 << 16
+
+
+cdef enum:
+    # limit of segments in a catalog, the same as segments.MAX_SEGMENTS
+    MAX_SEGMENTS = 15
+    # numbers in a row of the neighbours map: shift, change of angle,
+    # change of level and changes of the MAX_COUNTERS material counters
+    ROW = 6 + 8
+    # rows of one angle
+    STRIDE = ROW * MAX_SEGMENTS
+
+cdef enum:
+    # segments of segments.BASIC
+    BASIC_SEGMENTS = 5
+
+cdef enum:
+    # kinds of counters, the same as segments.KIND_*
+    KIND_TURN, KIND_FLAT, KIND_UP, KIND_DOWN
+
+
+cdef struct Tables:
+    # A catalog of segments compiled to the tables used by the search.
+    int segments, counters
+    int forward[8 * STRIDE]
+    int backward[8 * STRIDE]
+    # (a, b) where change in pillars is a*level+b, for every segment after
+    # another segment and after an uphill
+    int pillars[4 * MAX_SEGMENTS]
+    int climbs[MAX_SEGMENTS]
+    # material counter of every segment
+    int counter[MAX_SEGMENTS]
+    bint crossings[MAX_SEGMENTS]
+    # the most one piece of every counter moves a coordinate, turns and
+    # climbs down, see segments.counter_bounds
+    int step[MAX_COUNTERS]
+    int turn[MAX_COUNTERS]
+    int descent[MAX_COUNTERS]
+    int ascent[MAX_COUNTERS]
+    # segments.counter_kinds, the table of positions which can return to
+    # the origin is used only if the counters have kinds
+    int kinds[MAX_COUNTERS]
+    bint reach
+    # the catalog is segments.BASIC, searched by _expand_forward_basic
+    bint basic
+    int max_step
+    char names[MAX_SEGMENTS + 1]
+    char mirrors[256]
+    # segment of a name or -1
+    int index[256]
+
+
+cdef class _Compiled:
+    cdef Tables t
+    cdef readonly object catalog
+    cdef readonly str names
+
+    def __cinit__(self, catalog):
+        cdef int angle, segment, i, n
+        segments.check(catalog)
+        self.catalog = catalog
+        self.names = ''.join(s.name for s in catalog.segments)
+        n = len(catalog.segments)
+        self.t.segments = n
+        self.t.counters = len(catalog.counters)
+        forward = segments.transitions(catalog)
+        backward = segments.transitions(catalog, backward=True)
+        for angle in range(8):
+            for segment in range(n):
+                for i in range(ROW):
+                    self.t.forward[angle*STRIDE + segment*ROW + i] = forward[(angle*n + segment)*ROW + i]
+                    self.t.backward[angle*STRIDE + segment*ROW + i] = backward[(angle*n + segment)*ROW + i]
+        for i, p in enumerate(segments.pillar_changes(catalog)):
+            self.t.pillars[i] = p
+        for i in range(256):
+            self.t.mirrors[i] = i
+            self.t.index[i] = -1
+        for segment, s in enumerate(catalog.segments):
+            self.t.climbs[segment] = s.climb
+            self.t.counter[segment] = catalog.counters.index(s.counter)
+            self.t.crossings[segment] = s.crossing
+            self.t.names[segment] = ord(s.name)
+            self.t.index[ord(s.name)] = segment
+            self.t.mirrors[ord(s.name)] = ord(s.mirror or s.name)
+        self.t.names[n] = 0
+        self.t.max_step = 0
+        for i, bounds in enumerate(segments.counter_bounds(catalog)):
+            self.t.step[i], self.t.turn[i], self.t.ascent[i], self.t.descent[i] = bounds
+            self.t.max_step = max(self.t.max_step, self.t.step[i])
+        kinds = segments.counter_kinds(catalog)
+        self.t.reach = kinds is not None
+        self.t.basic = catalog == segments.BASIC
+        for i, kind in enumerate(kinds or ()):
+            self.t.kinds[i] = kind
+
+
+_COMPILED = {}
+
+
+cdef _Compiled _compile(catalog):
+    # Tables of the catalog, compiled once for every catalog.
+    if catalog is None:
+        catalog = segments.BASIC
+    try:
+        compiled = _COMPILED.get(catalog)
+    except TypeError:
+        # a catalog with lists is compiled every time
+        return _Compiled(catalog)
+    if compiled is None:
+        compiled = _COMPILED[catalog] = _Compiled(catalog)
+    return compiled
+
+
+cdef inline int _pillars_change(Tables* t, int segment, int level, int up) noexcept nogil:
+    return t.pillars[4*segment + 2*up]*level + t.pillars[4*segment + 2*up + 1]
+
+
+cdef inline int _bound(const int* bounds, const int* counts, int n) noexcept nogil:
+    # the most pieces of the counts move by bounds of their counters
+    cdef int i, total = 0
+    for i in range(n):
+        total += bounds[i] * counts[i]
+    return total
+
+
+cdef inline void _kind_sums(Tables* t, const int* counts, int* sums) noexcept nogil:
+    # remaining pieces of every kind of segments.counter_kinds
+    cdef int i
+    sums[0] = sums[1] = sums[2] = sums[3] = 0
+    for i in range(t.counters):
+        sums[t.kinds[i]] += counts[i]
+
+
+cdef int _path_pillars(Tables* t, str path) except -1:
+    # Pillars needed by a whole path which starts at the ground.
+    cdef int pillars = 0, level = 0, up = 0, segment
+    for c in path:
+        segment = t.index[<unsigned char>ord(c)]
+        pillars -= _pillars_change(t, segment, level, up)
+        level += t.climbs[segment]
+        up = t.climbs[segment] > 0
+    return pillars
+
+
+cdef void _fill_neighbours_map(Tables* t, int* neighbours_map, bool backward):
+    # 8 angles * STRIDE
+    if backward:
+        memcpy(neighbours_map, t.backward, sizeof(t.backward))
+    else:
+        memcpy(neighbours_map, t.forward, sizeof(t.forward))
+
+
+cdef void _read_material(Tables* t, catalog, m, int* limits, int* pillars) except *:
+    # Limits of the counters of the search, crossings count twice.
+    cdef int i
+    for i in range(MAX_COUNTERS):
+        limits[i] = 0
+    for i, limit in enumerate(segments.search_limits(catalog, m)):
+        limits[i] = limit
+    pillars[0] = m.pillars
+
+
+cdef State _start_state(Tables* t, const int* limits, int pillars) noexcept:
+    cdef State s = State(0, 0, 0, 0, 0, 0, pillars)
+    cdef int i
+    for i in range(t.counters):
+        s.counts[i] = limits[i]
+    return s
+
 
-STR_SHIFT = (
-    (1, 1, 0, 0),
-    (1, 0, -1, 0),
-    (0, 0, -1, -1),
-    (-1, 0, -1, 0),
-    (-1, -1, 0, 0),
-    (-1, 0, 1, 0),
-    (0, 0, 1, 1),
-    (1, 0, 1, 0),
-)
-
-
-R_SHIFT = (
-    ( 1,  0,  0, -1),
-    ( 0,  1, -1,  0),
-    ( 0, -1, -1,  0),
-    (-1,  0,  0, -1),
-    (-1,  0,  0,  1),
-    ( 0, -1,  1,  0),
-    ( 0,  1,  1,  0),
-    ( 1,  0,  0,  1),
-)
-
-
-# Represents Segment: (a, b) where change in pillars is a*level+b
-cdef int[10] PILLARS = [
-    -1, 0,
-    -2, 0,
-    -1, 1,
-    -1, 0,
-    -1, 0,
-]
-
-
-def _neighbours(angle):
-    return [
-        STR_SHIFT[angle] + ( 0,  0, -1,  0,  0,  0),
-        STR_SHIFT[angle] + ( 0,  1,  0,  0, -1,  0),
-        STR_SHIFT[angle] + ( 0, -1,  0,  0,  0, -1),
-        R_SHIFT[angle]   + ( 1,  0,  0, -1,  0,  0),
-        R_SHIFT[angle-1] + (-1,  0,  0, -1,  0,  0),
-    ]
-
-
-def forward_search(m):
-    cdef unordered_set[State] visited
-    py_visited = set()
-    _forward_search(&visited, m)
-    for s in visited:
-        py_visited.add((s.ax, s.bx, s.ay, s.by, s.angle, s.level, s.straight, s.turns, s.ups, s.downs, s.pillars))
-    return py_visited
-
-cdef void _forward_search(unordered_set[State]* visited, m):
-    cdef int level, pillars, segment
-    cdef int angle, straight, turns, ups, downs
-    cdef int ax, bx, ay, by, bi
-    cdef State ns
-    cdef vector[State] border, new_border;
-    cdef int[400] neighbours_map
-    # 8 * 5 * 10
-    for angle in range(8):
-        for segment, vect in enumerate(_neighbours(angle)):
-            for i, n in enumerate(vect):
-                neighbours_map[angle*50+segment*10+i] = n
+cdef StatePacker _make_packer(Tables* t, const int* limits, int pillars, m) except *:
+    # No coordinate can get further from the origin than the remaining
+    # pieces move it, otherwise the path couldn't return back.
+    cdef int i, up = 0
+    for i in range(t.counters):
+        up |= limits[i] > 0 and t.ascent[i] > 0
+    cdef StatePacker packer = StatePacker(
+        _bound(t.step, limits, t.counters), _bound(t.descent, limits, t.counters),
+        t.counters, limits, pillars, up)
+    if packer.bits > 63:
+        raise ValueError('Material %r is too large for packed states.' % (m,))
+    return packer
+
+
+def _repack(m, state, catalog=None):
+    """Return the state tuple packed for the material and unpacked, and the
+    number of bits of the key. Used by tests."""
+    cdef _Compiled compiled = _compile(catalog)
+    cdef Tables* t = &compiled.t
+    cdef int[MAX_COUNTERS] limits
+    cdef int pillars, i
+    _read_material(t, compiled.catalog, m, limits, &pillars)
+    cdef StatePacker packer = _make_packer(t, limits, pillars, m)
+    cdef State s = State(
+        state[0], state[1], state[2], state[3], state[4], state[5],
+        state[6 + t.counters], state[7 + t.counters])
+    for i in range(t.counters):
+        s.counts[i] = state[6 + i]
+    if not packer.contains(s):
+        raise ValueError('State %r is out of the bounds of the material.' % (state,))
+    s = packer.unpack(packer.pack(s))
+    return _state_tuple(t, s), packer.bits
+
+
+cdef tuple _state_tuple(Tables* t, State& s):
+    cdef int i
+    counts = [s.counts[i] for i in range(t.counters)]
+    return ((s.ax, s.bx, s.ay, s.by, s.angle, s.level) + tuple(counts) +
+            (s.pillars, s.up))
+
+
+def _state_set(keys, queries):
+    """Insert the keys to a StateSet, return which of them were new, which
+    of the queries are found in it and its capacity. Used by tests."""
+    cdef StateSet table
+    new = [table.insert(key) for key in keys]
+    return new, [table.contains(key) for key in queries], table.capacity()
+
+
+cdef inline uint64_t _straight_counts(int straight, int ups, int downs, int level) noexcept nogil:
+    # Numbers of straight, uphill and downhill pieces which get from the
+    # level to the ground, every uphill needs one more downhill.
+    cdef uint64_t mask = 0
+    cdef uint64_t run = ((<uint64_t>2) << straight) - 1
+    cdef int k
+    if not 0 <= level <= downs:
+        return 0
+    for k in range(min(ups, downs - level) + 1):
+        mask |= run << (level + 2*k)
+    return mask
+
+
+cdef inline int _total(Tables* t, const int* counts) noexcept nogil:
+    cdef int i, total = 0
+    for i in range(t.counters):
+        total += counts[i]
+    return total
+
+
+cdef void _build_reach(ReachTable* reach, Tables* t, int* neighbours_map,
+                       const int* limits) noexcept:
+    # The table is left empty, i.e. it doesn't prune, for catalogs whose
+    # counters have no kinds.
+    cdef int[4] sums
+    if not t.reach:
+        return
+    _kind_sums(t, limits, sums)
+    reach.build(neighbours_map, STRIDE, ROW, t.segments, sums[KIND_TURN],
+                sums[KIND_FLAT] + sums[KIND_UP] + sums[KIND_DOWN],
+                t.max_step, REACH_TABLE_SIZE)
+
+
+cdef struct Expansion:
+    StatePacker* packer
+    Tables* tables
+    int* neighbours_map
+    # positions which can return to the origin
+    ReachTable* reach
+    # limits of the counters of the whole track and its pillars
+    int material[MAX_COUNTERS]
+    int pillars
+    # pieces of every counter which the search leaves unused, the heads
+    # of iter_paths_mitm leave the larger half of them
+    int floors[MAX_COUNTERS]
+
+
+ctypedef void (*expand_t)(
+    Expansion* e, uint64_t key, vector[uint64_t]* shards,
+    uint64_t* pruned) noexcept nogil
+
+
+cdef void _expand_forward(
+        Expansion* e, uint64_t key, vector[uint64_t]* shards,
+        uint64_t* pruned) noexcept nogil:
+    cdef Tables* t = e.tables
+    cdef int n = t.counters
+    cdef int segment, bi, c, kind
+    cdef int* neighbours_map = e.neighbours_map
+    cdef State a = e.packer.unpack(key)
+    cdef State ns = a
+    # A segment takes one piece of its counter, so the bounds of the new
+    # states are those of a less the bounds of that counter.
+    cdef int turn = _bound(t.turn, a.counts, n)
+    cdef int descent = _bound(t.descent, a.counts, n)
+    cdef int step = _bound(t.step, a.counts, n)
+    cdef int[4] sums
+    # counted locally, so that the compiler keeps them in registers
+    cdef uint64_t[PRUNE_STRIDE] counts = [0, 0, 0, 0, 0, 0, 0, 0]
+    if t.reach:
+        _kind_sums(t, a.counts, sums)
+    for segment in range(t.segments):
+        bi = a.angle*STRIDE + segment*ROW
+        c = t.counter[segment]
+        ns.pillars = a.pillars + _pillars_change(t, segment, a.level, a.up)
+        ns.ax = a.ax + neighbours_map[bi+0]
+        ns.bx = a.bx + neighbours_map[bi+1]
+        ns.ay = a.ay + neighbours_map[bi+2]
+        ns.by = a.by + neighbours_map[bi+3]
+        ns.angle = (a.angle + neighbours_map[bi+4]) % 8
+        ns.level = a.level + neighbours_map[bi+5]
+        ns.up = t.climbs[segment] > 0
+        if min(ns.angle, 8 - ns.angle) > turn - t.turn[c]:
+            # It's not possible to turn back
+            # with the current number of turns.
+            counts[PRUNE_TURNS] += 1
+            continue
+        if not (0 <= ns.level <= descent - t.descent[c]):
+            counts[PRUNE_LEVEL] += 1
+            continue
+        if a.counts[c] <= e.floors[c] or ns.pillars < 0:
+            counts[PRUNE_MATERIAL] += 1
+            continue
+        if max(abs(ns.ax), abs(ns.bx), abs(ns.ay), abs(ns.by)) > step - t.step[c]:
+            # It's not possible to return back
+            # with the current number of segments.
+            counts[PRUNE_DISTANCE] += 1
+            continue
+        if t.reach:
+            kind = t.kinds[c]
+            sums[kind] -= 1
+            if not (e.reach.straight_counts(
+                        ns.ax, ns.bx, ns.ay, ns.by, ns.angle, sums[KIND_TURN],
+                        sums[KIND_FLAT] + sums[KIND_UP] + sums[KIND_DOWN]) &
+                    _straight_counts(sums[KIND_FLAT], sums[KIND_UP],
+                                     sums[KIND_DOWN], ns.level)):
+                # No remaining pieces lead back to the origin.
+                sums[kind] += 1
+                counts[PRUNE_REACH] += 1
+                continue
+            sums[kind] += 1
+        ns.counts[c] = a.counts[c] - 1
+        key = e.packer.pack(ns)
+        ns.counts[c] = a.counts[c]
+        shards[ShardedStateSet.shard_of(key)].push_back(key)
+    for segment in range(PRUNE_STRIDE):
+        pruned[segment] += counts[segment]
+
+
+cdef void _expand_forward_basic(
+        Expansion* e, uint64_t key, vector[uint64_t]* shards,
+        uint64_t* pruned) noexcept nogil:
+    # _expand_forward for the counters of segments.BASIC: straight, turns,
+    # ups and downs, every piece moves by one step and a turn by one angle.
+    cdef Tables* t = e.tables
+    cdef int segment, bi
+    cdef int* neighbours_map = e.neighbours_map
+    cdef State a = e.packer.unpack_basic(key)
+    cdef State ns = a
+    # counted locally, so that the compiler keeps them in registers
+    cdef uint64_t[PRUNE_STRIDE] counts = [0, 0, 0, 0, 0, 0, 0, 0]
+    for segment in range(BASIC_SEGMENTS):
+        bi = a.angle*STRIDE + segment*ROW
+        ns.pillars = a.pillars + _pillars_change(t, segment, a.level, a.up)
+        ns.ax = a.ax + neighbours_map[bi+0]
+        ns.bx = a.bx + neighbours_map[bi+1]
+        ns.ay = a.ay + neighbours_map[bi+2]
+        ns.by = a.by + neighbours_map[bi+3]
+        ns.angle = (a.angle + neighbours_map[bi+4]) % 8
+        ns.level = a.level + neighbours_map[bi+5]
+        ns.counts[0] = a.counts[0] + neighbours_map[bi+6]
+        ns.counts[1] = a.counts[1] + neighbours_map[bi+7]
+        ns.counts[2] = a.counts[2] + neighbours_map[bi+8]
+        ns.counts[3] = a.counts[3] + neighbours_map[bi+9]
+        ns.up = t.climbs[segment] > 0
+        if ns.counts[1] < ns.angle < 8 - ns.counts[1]:
+            # It's not possible to turn back
+            # with the current number of turns.
+            counts[PRUNE_TURNS] += 1
+            continue
+        if not (0 <= ns.level <= ns.counts[3]):
+            counts[PRUNE_LEVEL] += 1
+            continue
+        if (ns.counts[0] < e.floors[0] or ns.counts[1] < e.floors[1] or
+                ns.counts[2] < e.floors[2] or ns.counts[3] < e.floors[3] or
+                ns.pillars < 0):
+            counts[PRUNE_MATERIAL] += 1
+            continue
+        if max(abs(ns.ax), abs(ns.bx), abs(ns.ay), abs(ns.by)) > (
+                ns.counts[0] + ns.counts[1] + ns.counts[2] + ns.counts[3]):
+            # It's not possible to return back
+            # with the current number of segments.
+            counts[PRUNE_DISTANCE] += 1
+            continue
+        if not (e.reach.straight_counts(
+                    ns.ax, ns.bx, ns.ay, ns.by, ns.angle, ns.counts[1],
+                    ns.counts[0] + ns.counts[2] + ns.counts[3]) &
+                _straight_counts(ns.counts[0], ns.counts[2], ns.counts[3],
+                                 ns.level)):
+            # No remaining pieces lead back to the origin.
+            counts[PRUNE_REACH] += 1
+            continue
+        key = e.packer.pack_basic(ns)
+        shards[ShardedStateSet.shard_of(key)].push_back(key)
+    for segment in range(PRUNE_STRIDE):
+        pruned[segment] += counts[segment]
+
+
+cdef void _expand_batch(Expansion* e, expand_t expand, const uint64_t* keys,
+                        size_t n, int jobs, vector[vector[uint64_t]]& buckets,
+                        vector[uint64_t]& pruned):
+    # Keys are split into chunks expanded in parallel, the new states of
+    # chunk c are sorted to buckets[c*SHARDS:(c+1)*SHARDS] by their shard
+    # and the states it pruned are counted in pruned[c*PRUNE_STRIDE:].
+    cdef int chunks = buckets.size() // SHARDS, c
+    cdef size_t j
+    with nogil, parallel(num_threads=jobs):
+        for c in prange(chunks, schedule='dynamic'):
+            for j in range(n * c // chunks, n * (c + 1) // chunks):
+                expand(e, keys[j], &buckets[c * SHARDS], &pruned[c * PRUNE_STRIDE])
+
+
+cdef dict _pruned_counts(vector[uint64_t]& pruned):
+    # Sums the counters of the chunks and resets them.
+    cdef size_t i
+    counts = dict.fromkeys(PRUNE_RULES, 0)
+    for i in range(pruned.size()):
+        if i % PRUNE_STRIDE < len(PRUNE_RULES):
+            counts[PRUNE_RULES[i % PRUNE_STRIDE]] += pruned[i]
+            pruned[i] = 0
+    return counts
+
+
+cdef void _search_layers(ShardedStateSet* visited, Expansion* e, expand_t expand,
+                         uint64_t start, int depth, int jobs,
+                         list layers=None, on_layer=None, list stats=None,
+                         on_stats=None, str search='forward') except *:
+    """Expand depth layers of states reachable from start.
+
+    layers are keys of the layers expanded by an earlier search in
+    buffers, the search continues after them. Every layer is replaced by
+    None once its keys are inserted, so its buffer can be released.
+    on_layer is called with the keys of every new layer. LayerStats of
+    every new layer are appended to stats and passed to on_stats.
+
+    Every layer is split into chunks expanded in parallel. New states are
+    sorted into shards of the visited set, so every shard can be merged
+    by a single thread. The order of the states in a shard doesn't depend
+    on the number of jobs, so the result is the same for any number of
+    them.
+
+    All states in a layer have used the same number of pieces, so they
+    can't be found again in later layers.
+    """
+    cdef vector[uint64_t] border, new_border, pruned
+    cdef vector[vector[uint64_t]] buckets, fresh
+    cdef size_t n, start_index, batch = BATCH * jobs, j, generated, probes
+    cdef int chunks = 4 * jobs, c, shard
+    cdef uint64_t key
+    cdef const unsigned char[::1] data
+    cdef Py_ssize_t i
+    buckets.resize(chunks * SHARDS)
+    pruned.resize(chunks * PRUNE_STRIDE)
+    fresh.resize(SHARDS)
+
+    border.push_back(start)
+    for i in range(len(layers or ())):
+        data = layers[i]
+        n = data.shape[0] // sizeof(uint64_t)
+        border.resize(n)
+        if n:
+            memcpy(border.data(), &data[0], n * sizeof(uint64_t))
+        # the layer is copied, let the caller release its buffer
+        data = None
+        layers[i] = None
+        for j in range(n):
+            visited.insert(border[j])
+    for layer in range(len(layers or ()) + 1, depth + 1):
+        generated = 0
+        probes = visited.probes()
+        for start_index in range(0, border.size(), batch):
+            n = min(batch, border.size() - start_index)
+            _expand_batch(e, expand, border.data() + start_index, n, jobs,
+                          buckets, pruned)
+            for j in range(buckets.size()):
+                generated += buckets[j].size()
+            with nogil, parallel(num_threads=jobs):
+                for shard in prange(SHARDS, schedule='dynamic'):
+                    for c in range(chunks):
+                        for j in range(buckets[c * SHARDS + shard].size()):
+                            key = buckets[c * SHARDS + shard][j]
+                            if visited.shard(shard).insert(key):
+                                fresh[shard].push_back(key)
+                        buckets[c * SHARDS + shard].clear()
+        new_border.clear()
+        for shard in range(SHARDS):
+            new_border.insert(new_border.end(), fresh[shard].begin(), fresh[shard].end())
+            fresh[shard].clear()
+        border.swap(new_border)
+        if on_layer is not None:
+            on_layer((<char*>border.data())[:border.size() * sizeof(uint64_t)])
+        if stats is not None or on_stats is not None:
+            layer_stats = LayerStats(
+                search, layer, border.size(), visited.size(), generated,
+                _pruned_counts(pruned), visited.size() / visited.capacity(),
+                (visited.probes() - probes) / generated if generated else 0.0)
+            if stats is not None:
+                stats.append(layer_stats)
+            if on_stats is not None:
+                on_stats(layer_stats)
+
+
+def _layer_path(directory, int layer):
+    return os.path.join(directory, 'layer-%03d.keys' % layer).encode()
+
+
+cdef void _search_layers_external(
+        str directory, Expansion* e, expand_t expand, uint64_t start,
+        int depth, int jobs, size_t run_size, list stats=None,
+        on_stats=None) except *:
+    """Expand depth layers like _search_layers, but keep them in files.
+
+    Layer i is written to _layer_path(directory, i) as sorted keys. New
+    states are collected to sorted runs of about run_size keys, which are
+    merged at the end of the layer. States can't be found again in later
+    layers, so duplicates are removed only within the layer and earlier
+    layers are never read again.
+    """
+    cdef vector[uint64_t] border, run, pruned
+    cdef vector[vector[uint64_t]] buckets
+    cdef vector[string] runs
+    cdef KeyReader reader
+    cdef size_t n, i, batch = BATCH * jobs, generated, visited = 0
+    cdef bytes path
+    buckets.resize(4 * jobs * SHARDS)
+    pruned.resize(4 * jobs * PRUNE_STRIDE)
+
+    run.push_back(start)
+    path = _layer_path(directory, 0)
+    if not write_run(run, path):
+        raise OSError('Can not write %s.' % path.decode())
+    for layer in range(1, depth + 1):
+        if not reader.open(path):
+            raise OSError('Can not read %s.' % path.decode())
+        run.clear()
+        runs.clear()
+        generated = 0
+        while True:
+            border.clear()
+            n = reader.read(border, batch)
+            if n == 0:
+                break
+            _expand_batch(e, expand, border.data(), n, jobs, buckets, pruned)
+            for i in range(buckets.size()):
+                generated += buckets[i].size()
+                run.insert(run.end(), buckets[i].begin(), buckets[i].end())
+                buckets[i].clear()
+            if run.size() >= run_size:
+                runs.push_back(os.path.join(
+                    directory, 'run-%03d-%05d.keys' % (layer, runs.size())).encode())
+                if not write_run(run, runs.back().c_str()):
+                    raise OSError('Can not write %s.' % runs.back().decode())
+                run.clear()
+        reader.close()
+        path = _layer_path(directory, layer)
+        if runs.empty():
+            if not write_run(run, path):
+                raise OSError('Can not write %s.' % path.decode())
+        else:
+            if not run.empty():
+                runs.push_back(os.path.join(
+                    directory, 'run-%03d-%05d.keys' % (layer, runs.size())).encode())
+                if not write_run(run, runs.back().c_str()):
+                    raise OSError('Can not write %s.' % runs.back().decode())
+            if merge_runs(runs, path) < 0:
+                raise OSError('Can not write %s.' % path.decode())
+            for run_path in runs:
+                os.remove(run_path)
+        if stats is None and on_stats is None:
+            continue
+        n = os.path.getsize(path) // sizeof(uint64_t)
+        visited += n
+        layer_stats = LayerStats(
+            'forward', layer, n, visited, generated,
+            _pruned_counts(pruned), None, None)
+        if stats is not None:
+            stats.append(layer_stats)
+        if on_stats is not None:
+            on_stats(layer_stats)
+
+
+cdef void _forward_search(ShardedStateSet* visited, StatePacker* packer, Tables* t,
+                          const int* limits, int pillars, int depth, int jobs,
+                          list layers=None, on_layer=None, str directory=None,
+                          size_t run_size=RUN_SIZE, list stats=None,
+                          on_stats=None, bint half=False) except *:
+    # Expands at most depth layers, negative depth means all of them. With
+    # half only half of the pieces of every counter, rounded down, are used.
+    cdef Expansion e
+    cdef int[8 * STRIDE] neighbours_map
+    cdef uint64_t start
+    cdef ReachTable reach
+    cdef int i
+    cdef expand_t expand = _expand_forward_basic if t.basic else _expand_forward
+    _fill_neighbours_map(t, neighbours_map, False)
     # State is composed of:
-    # ax, bx, ay, by, angle, level, straight, turns, ups, downs, pillars
+    # ax, bx, ay, by, angle, level, the counters of the catalog, pillars, up
 
     # Because sqrt(2) is irational number we have to track numbers in
     # the following base.
     # ax, ay is position in the grid in multiples of sqrt(2)/2 ~ 0.71
     # bx, by is position in the grid in multiples of 1-sqrt(2)/2 ~ 0.29
 
-    border.push_back(State(0, 0, 0, 0, 0, 0, m.straight, m.turns, m.ups, m.downs, m.pillars))
-    for _ in range(m.straight + m.turns + m.ups + m.downs):
-        new_border.clear()
-        for a in border:
-            for segment in range(5):
-                bi = a.angle*50 + segment*10
-                level = a.level
-                pillars = a.pillars + PILLARS[2*segment] * level + PILLARS[2*segment + 1]
-                ax = a.ax + neighbours_map[bi+0]
-                bx = a.bx + neighbours_map[bi+1]
-                ay = a.ay + neighbours_map[bi+2]
-                by = a.by + neighbours_map[bi+3]
-                angle = (a.angle + neighbours_map[bi+4]) % 8
-                level += neighbours_map[bi+5]
-                straight = a.straight + neighbours_map[bi+6]
-                turns = a.turns + neighbours_map[bi+7]
-                ups = a.ups + neighbours_map[bi+8]
-                downs = a.downs + neighbours_map[bi+9]
-                if turns < angle < 8 - turns:
-                    # It's not possible to turn back
-                    # with the current number of turns.
+    e.packer = packer
+    e.tables = t
+    e.neighbours_map = neighbours_map
+    _build_reach(&reach, t, neighbours_map, limits)
+    e.reach = &reach
+    for i in range(MAX_COUNTERS):
+        e.material[i] = limits[i]
+        e.floors[i] = limits[i] - limits[i] // 2 if half else 0
+    e.pillars = pillars
+    if depth < 0:
+        depth = _total(t, limits)
+    start = packer.pack(_start_state(t, limits, pillars))
+    if directory is not None:
+        _search_layers_external(
+            directory, &e, expand, start, depth, jobs, run_size,
+            stats, on_stats)
+    else:
+        _search_layers(
+            visited, &e, expand, start, depth, jobs, layers, on_layer,
+            stats, on_stats)
+
+
+# A path is yielded in the canonical mode only if it is the least among
+# its rotations starting on the ground and their mirror images. Those are
+# closed paths built from the same material as well, so every track is
+# still found. The path is compared as it is built by the backward search,
+# i.e. from its end. Candidates are encoded as 2*start + mirrored.
+
+cdef bint _keep_candidates(vector[int]& alive, vector[int]& out,
+                           const char* p, int k, const char* mirrors) noexcept nogil:
+    """Compare the candidates with the path extended by p[k].
+
+    Return False if one of them is already less than the path.
+    """
+    cdef int cand
+    cdef char c
+    out.clear()
+    for cand in alive:
+        c = p[k]
+        if cand & 1:
+            c = mirrors[<unsigned char>c]
+        if c < p[k - (cand >> 1)]:
+            return False
+        if c == p[k - (cand >> 1)]:
+            out.push_back(cand)
+    return True
+
+
+cdef bint _closes_least(vector[int]& alive, const char* p, int n,
+                        const char* mirrors) noexcept nogil:
+    # Candidates equal to the path so far are compared after wrapping around.
+    cdef int cand, start, t
+    cdef char c
+    for cand in alive:
+        start = cand >> 1
+        for t in range(start):
+            c = p[t]
+            if cand & 1:
+                c = mirrors[<unsigned char>c]
+            if c < p[n - start + t]:
+                return False
+            if c > p[n - start + t]:
+                break
+    return True
+
+
+def _least_in_orbit(str path, catalog=None):
+    cdef _Compiled compiled = _compile(catalog)
+    cdef Tables* t = &compiled.t
+    cdef bytes encoded = path[::-1].encode('ascii')
+    cdef const char* p = encoded
+    cdef int n = len(encoded)
+    cdef int k
+    cdef vector[int] alive, out
+    cdef vector[int] levels
+    levels.resize(n + 1)
+    for k in range(n):
+        # level of the path after its first n - k - 1 pieces
+        levels[k + 1] = levels[k] - t.climbs[t.index[<unsigned char>p[k]]]
+    alive.push_back(1)
+    for k in range(n):
+        if not _keep_candidates(alive, out, p, k, t.mirrors):
+            return False
+        alive.swap(out)
+        if k + 1 < n and levels[k + 1] == 0:
+            alive.push_back(2 * (k + 1))
+            alive.push_back(2 * (k + 1) + 1)
+    return _closes_least(alive, p, n, t.mirrors)
+
+
+# Exact segment intersections of collision.py for the backward search.
+# Numbers u + v*sqrt(2) are stored as pairs and points as
+# (xu, xv, yu, yv), scaled by 10 so the U/D split points stay integral.
+
+cdef struct Line:
+    int id
+    int height
+    long long start[4]
+    long long end[4]
+    # float bounds with a margin
+    double x0, x1, y0, y1
+    # 4*segment + direction modulo 4 of a crossing or -1 and its middle
+    # doubled, two perpendicular ways through the same middle are one piece
+    int crossing
+    long long middle[4]
+
+
+cdef double SQRT2 = sqrt(2.0)
+cdef double LINE_MARGIN = 1e-5
+
+
+cdef inline int _sign(long long u, long long v) noexcept nogil:
+    cdef long long d
+    if u >= 0 and v >= 0:
+        return u > 0 or v > 0
+    if u <= 0 and v <= 0:
+        return -1
+    # u and v have opposite signs, compare u^2 with 2*v^2
+    d = u*u - 2*v*v
+    if u < 0:
+        d = -d
+    return (d > 0) - (d < 0)
+
+
+cdef inline void _cross(long long* v1, long long* v2, long long* out) noexcept nogil:
+    out[0] = v1[0]*v2[2] + 2*v1[1]*v2[3] - v1[2]*v2[0] - 2*v1[3]*v2[1]
+    out[1] = v1[0]*v2[3] + v1[1]*v2[2] - v1[2]*v2[1] - v1[3]*v2[0]
+
+
+cdef inline bint _within(long long* n, long long* d, int direction) noexcept nogil:
+    # n / d lies between 0 and 1, direction is the sign of d
+    return (_sign(n[0], n[1]) * direction >= 0 and
+            _sign(d[0] - n[0], d[1] - n[1]) * direction >= 0)
+
+
+cdef bint _lines_intersect(Line* l1, Line* l2) noexcept nogil:
+    cdef long long a[4]
+    cdef long long b[4]
+    cdef long long cd[4]
+    cdef long long cab[2]
+    cdef long long n[2]
+    cdef int i, direction
+    for i in range(4):
+        a[i] = l1.end[i] - l1.start[i]
+        b[i] = l2.end[i] - l2.start[i]
+        cd[i] = l2.start[i] - l1.start[i]
+    _cross(a, b, cab)
+    if cab[0] == 0 and cab[1] == 0:
+        # coincident lines
+        return cd[0] == 0 and cd[1] == 0 and cd[2] == 0 and cd[3] == 0
+    direction = _sign(cab[0], cab[1])
+    _cross(cd, b, n)
+    if not _within(n, cab, direction):
+        return False
+    _cross(cd, a, n)
+    return _within(n, cab, direction)
+
+
+cdef void _set_line(Line* line, int id, int height, long long* start,
+                    long long* end, int start_fifths, int end_fifths) noexcept nogil:
+    cdef int i
+    cdef double x0, x1, y0, y1
+    line.id = id
+    line.height = height
+    for i in range(4):
+        # lattice points are divisible by 5
+        line.start[i] = (start[i]*(5 - start_fifths) + end[i]*start_fifths) // 5
+        line.end[i] = (start[i]*(5 - end_fifths) + end[i]*end_fifths) // 5
+    x0 = line.start[0] + line.start[1]*SQRT2
+    x1 = line.end[0] + line.end[1]*SQRT2
+    y0 = line.start[2] + line.start[3]*SQRT2
+    y1 = line.end[2] + line.end[3]*SQRT2
+    line.x0 = min(x0, x1) - LINE_MARGIN
+    line.x1 = max(x0, x1) + LINE_MARGIN
+    line.y0 = min(y0, y1) - LINE_MARGIN
+    line.y1 = max(y0, y1) + LINE_MARGIN
+
+
+cdef inline void _lattice_point(State* s, long long* p) noexcept nogil:
+    p[0] = 10*s.bx
+    p[1] = 5*(s.ax - s.bx)
+    p[2] = 10*s.by
+    p[3] = 5*(s.ay - s.by)
+
+
+cdef int _segment_lines(Tables* t, State* start, State* end, int segment, int id,
+                        Line* out) noexcept nogil:
+    """Fill parts of the segment like collision.py does, return their count."""
+    cdef long long s[4]
+    cdef long long e[4]
+    cdef int i
+    _lattice_point(start, s)
+    _lattice_point(end, e)
+    if t.climbs[segment] != 0:
+        _set_line(&out[0], id, start.level, s, e, 0, 4)
+        _set_line(&out[1], id, end.level, s, e, 1, 5)
+        out[0].crossing = out[1].crossing = -1
+        return 2
+    _set_line(&out[0], id, start.level, s, e, 0, 5)
+    out[0].crossing = 4*segment + start.angle % 4 if t.crossings[segment] else -1
+    for i in range(4):
+        out[0].middle[i] = s[i] + e[i]
+    return 1
+
+
+cdef inline bint _crossed(Line* l1, Line* l2) noexcept nogil:
+    # The lines are the two ways through one crossing.
+    return (l1.crossing >= 0 and l2.crossing >= 0 and
+            l1.crossing ^ l2.crossing == 2 and
+            memcmp(l1.middle, l2.middle, sizeof(l1.middle)) == 0)
+
+
+cdef bint _collides(vector[Line]& lines, Line* new_lines, int count,
+                    bint closing) noexcept nogil:
+    # Lines are numbered by the depth of the backward search. The segment
+    # closing the path is adjacent to the first one found, i.e. the last
+    # one of the path.
+    cdef Line* line
+    cdef Line* other
+    cdef int k
+    cdef size_t i
+    for k in range(count):
+        line = &new_lines[k]
+        for i in range(lines.size()):
+            other = &lines[i]
+            if other.height != line.height:
+                continue
+            if other.id >= line.id - 1 or (closing and other.id == 1):
+                continue
+            if (line.x1 < other.x0 or other.x1 < line.x0 or
+                    line.y1 < other.y0 or other.y1 < line.y0):
+                continue
+            if _lines_intersect(line, other) and not _crossed(line, other):
+                return True
+    return False
+
+
+cdef bint _path_collides(Tables* t, str path, int* neighbours_map) except -1:
+    # Same test as the backward search does, on a whole closed path.
+    cdef vector[Line] lines
+    cdef Line new_lines[2]
+    cdef int i, segment, bi, line_count
+    cdef int n = len(path)
+    cdef State a, ns
+    for i in range(n):
+        segment = t.index[<unsigned char>ord(path[i])]
+        bi = a.angle*STRIDE + segment*ROW
+        ns = State(
+            a.ax + neighbours_map[bi+0],
+            a.bx + neighbours_map[bi+1],
+            a.ay + neighbours_map[bi+2],
+            a.by + neighbours_map[bi+3],
+            (a.angle + neighbours_map[bi+4]) % 8,
+            a.level + neighbours_map[bi+5])
+        line_count = _segment_lines(t, &a, &ns, segment, i + 1, new_lines)
+        if _collides(lines, new_lines, line_count, i == n - 1):
+            return True
+        lines.insert(lines.end(), new_lines, new_lines + line_count)
+        a = ns
+    return False
+
+
+cdef class Search:
+    """All states reachable from the start with the given material.
+
+    The material has the counters of the catalog of segments, by default
+    segments.BASIC, and pillars. Crossings are counted by the drives
+    through them, see segments.search_limits.
+
+    The search can continue after layers of keys found earlier, given in
+    buffers which are dropped from the list once they are read, on_layer
+    is called with the keys of every new layer. Keys are 64-bit integers
+    in the native byte order.
+
+    Counters of the search are kept in layer_stats and walk_stats, if
+    on_stats is given, it is called with LayerStats of every new layer
+    and with WalkStats after the paths to every key are walked.
+
+    If directory is given, the states are kept in files in it instead of
+    memory, see _search_layers_external. If half is set, the paths use at
+    most half of the pieces of every counter, rounded down, they are the
+    heads of iter_paths_mitm.
+    """
+    cdef ShardedStateSet visited
+    # layers of the states if they are kept in files, layer i contains
+    # states which used i pieces
+    cdef vector[LayerFile*] layer_files
+    cdef StatePacker packer
+    cdef _Compiled compiled
+    cdef Tables* t
+    cdef int[8 * STRIDE] backward_map
+    cdef int[MAX_COUNTERS] limits
+    cdef int total
+    cdef readonly object material
+    cdef State start
+    # keys of the states at the start, filled when the paths are needed
+    cdef vector[uint64_t] closed
+    # number of paths from the start to the states in the slots of the
+    # visited set or UNCOUNTED, filled when they are needed
+    cdef vector[vector[uint64_t]] counts
+    cdef readonly list layer_stats
+    cdef object on_stats
+    # counters of the walk back, see WalkStats
+    cdef size_t walked_keys, walked_paths
+    cdef vector[uint64_t] prefixes
+    cdef uint64_t[3] walk_pruned
+
+    def __cinit__(self, m, int jobs=1, int depth=-1, list layers=None,
+                  on_layer=None, str directory=None, size_t run_size=RUN_SIZE,
+                  on_stats=None, catalog=None, bint half=False):
+        cdef LayerFile* layer_file
+        cdef int pillars, i
+        self.compiled = _compile(catalog)
+        self.t = &self.compiled.t
+        self.material = m
+        self.layer_stats = []
+        self.on_stats = on_stats
+        self.walked_keys = self.walked_paths = 0
+        self.walk_pruned[:] = [0, 0, 0]
+        _read_material(self.t, self.compiled.catalog, m, self.limits, &pillars)
+        self.packer = _make_packer(self.t, self.limits, pillars, m)
+        self.total = _total(self.t, self.limits)
+        self.prefixes.resize(self.total)
+        self.start = _start_state(self.t, self.limits, pillars)
+        if depth < 0:
+            depth = self.total
+        if half:
+            depth = min(depth, sum(
+                self.limits[i] // 2 for i in range(self.t.counters)))
+        if directory is not None and (layers or on_layer is not None):
+            raise ValueError('States kept in files can not be checkpointed.')
+        _fill_neighbours_map(self.t, self.backward_map, True)
+        _forward_search(&self.visited, &self.packer, self.t, self.limits,
+                        pillars, depth, jobs, layers, on_layer, directory,
+                        run_size, self.layer_stats, on_stats, half)
+        if directory is None:
+            return
+        for layer in range(depth + 1):
+            layer_file = new LayerFile()
+            self.layer_files.push_back(layer_file)
+            if not layer_file.open(_layer_path(directory, layer)):
+                raise OSError('Can not read layer %d.' % layer)
+
+    def __dealloc__(self):
+        for layer_file in self.layer_files:
+            del layer_file
+
+    def __len__(self):
+        cdef size_t count = self.visited.size()
+        # the first layer contains only the start
+        for layer in range(1, self.layer_files.size()):
+            count += self.layer_files[layer].size()
+        return count
+
+    @property
+    def catalog(self):
+        """Catalog of the segments of the search."""
+        return self.compiled.catalog
+
+    # States are read in groups, shards of the visited set or layers kept
+    # in files. A slot of a group is either a key or EMPTY.
+
+    cdef size_t _groups(self) noexcept:
+        if self.layer_files.empty():
+            return SHARDS
+        return self.layer_files.size()
+
+    cdef size_t _slots(self, size_t group) noexcept:
+        if self.layer_files.empty():
+            return self.visited.shard(group).capacity()
+        # the first layer contains only the start
+        return self.layer_files[group].size() if group > 0 else 0
+
+    cdef uint64_t _slot(self, size_t group, size_t i) noexcept:
+        if self.layer_files.empty():
+            return self.visited.shard(group).slot(i)
+        return self.layer_files[group].at(i)
+
+    cdef bint _contains(self, State& s) noexcept:
+        cdef int used
+        if not self.packer.contains(s):
+            return False
+        if self.layer_files.empty():
+            return self.visited.contains(self.packer.pack(s))
+        used = self.total - _total(self.t, s.counts)
+        return (0 < used < <int>self.layer_files.size() and
+                self.layer_files[used].contains(self.packer.pack(s)))
+
+    def states(self):
+        """Return the set of visited states as tuples.
+
+        A state is the position, angle, level, the remaining pieces of
+        every counter of the catalog, pillars and whether the last segment
+        was uphill.
+        """
+        cdef State s
+        cdef size_t group, i
+        py_visited = set()
+        for group in range(self._groups()):
+            for i in range(self._slots(group)):
+                if self._slot(group, i) == EMPTY:
+                    continue
+                s = self.packer.unpack(self._slot(group, i))
+                py_visited.add(_state_tuple(self.t, s))
+        return py_visited
+
+    @property
+    def walk_stats(self):
+        """WalkStats of all paths walked back so far."""
+        return WalkStats(
+            self.walked_keys, self.walked_paths, list(self.prefixes),
+            {rule: self.walk_pruned[i] for i, rule in enumerate(WALK_RULES)})
+
+    def closed_keys(self, material=None):
+        """Return sorted keys of the states which close a path.
+
+        If material is given, only paths which can be built from it end
+        in the states, it can't have more pieces of any kind than the
+        searched material.
+        """
+        cdef State a, least
+        cdef size_t group, i
+        cdef uint64_t key
+        cdef int[MAX_COUNTERS] limits
+        cdef int pillars, j
+        cdef bint enough
+        m = self.material
+        if material is None:
+            material = m
+        if any(x > y for x, y in zip(material, m)):
+            raise ValueError('Material %r is larger than %r.' % (material, m))
+        # remaining pieces of the closed paths built from the material
+        _read_material(self.t, self.compiled.catalog, material, limits, &pillars)
+        least = State(0, 0, 0, 0, 0, 0, self.start.pillars - pillars)
+        for j in range(self.t.counters):
+            least.counts[j] = self.limits[j] - limits[j]
+        if self.closed.empty():
+            for group in range(self._groups()):
+                for i in range(self._slots(group)):
+                    key = self._slot(group, i)
+                    if key == EMPTY:
+                        continue
+                    a = self.packer.unpack(key)
+                    if (a.ax == 0 and a.bx == 0 and a.ay == 0 and a.by == 0 and a.angle == 0
+                        and a.level == 0):
+                        self.closed.push_back(key)
+            # the order of the table depends on the order of insertions
+            sort(self.closed.begin(), self.closed.end())
+        keys = []
+        for key in self.closed:
+            a = self.packer.unpack(key)
+            enough = a.pillars >= least.pillars
+            for j in range(self.t.counters):
+                enough &= a.counts[j] >= least.counts[j]
+            if enough:
+                keys.append(key)
+        return keys
+
+    def iter_paths(self, bint canonical=False, bint prune_collisions=False,
+                   material=None, keys=None):
+        """Yield all closed paths as they are found.
+
+        If canonical is set, rotations and mirror images of a yielded path
+        are skipped. If prune_collisions is set, paths which intersect
+        themselves at the same height are skipped, except for the two ways
+        through a crossing. Paths end in the states with keys, by default
+        in closed_keys(material).
+        """
+        if keys is None:
+            keys = self.closed_keys(material)
+        return self._walk_back(keys, canonical, prune_collisions)
+
+    cdef bint _previous(self, State* a, int edge, State* ps) noexcept:
+        # Previous state of a by the edge, which is 2*segment + 1 if the
+        # previous state was reached by an uphill. Return False if the
+        # edge doesn't agree with a.
+        cdef int segment = edge >> 1
+        cdef int bi = a.angle*STRIDE + segment*ROW
+        cdef int* neighbours_map = self.backward_map
+        cdef int i
+        if a.up != (self.t.climbs[segment] > 0):
+            return False
+        ps.ax = a.ax - neighbours_map[bi+0]
+        ps.bx = a.bx - neighbours_map[bi+1]
+        ps.ay = a.ay - neighbours_map[bi+2]
+        ps.by = a.by - neighbours_map[bi+3]
+        ps.angle = (a.angle - neighbours_map[bi+4]) % 8
+        ps.level = a.level - neighbours_map[bi+5]
+        for i in range(self.t.counters):
+            ps.counts[i] = a.counts[i] - neighbours_map[bi+6+i]
+        ps.up = edge & 1
+        # pillars have to be counted from the previous level
+        ps.pillars = a.pillars - _pillars_change(self.t, segment, ps.level, ps.up)
+        return True
+
+    cdef bint _paths_to(self, State& s, uint64_t* count) noexcept:
+        # Set count to the number of paths from the start to s, return
+        # False if s wasn't visited.
+        cdef uint64_t key
+        cdef size_t i
+        cdef int shard
+        if s == self.start:
+            count[0] = 1
+            return True
+        if not self.packer.contains(s):
+            return False
+        key = self.packer.pack(s)
+        shard = ShardedStateSet.shard_of(key)
+        i = self.visited.shard(shard).find(key)
+        if i == self.counts[shard].size():
+            return False
+        count[0] = self.counts[shard][i]
+        return True
+
+    cdef uint64_t _closed_count(self, uint64_t key) noexcept:
+        cdef State a = self.packer.unpack(key)
+        cdef uint64_t count = 0
+        self._paths_to(a, &count)
+        return count
+
+    cdef void _count_paths(self, keys) except *:
+        # Count paths to the states with keys. Previous states are counted
+        # depth first and their counts are kept, so only states on the
+        # paths to the keys are counted, each of them once.
+        cdef vector[State] stack
+        cdef vector[int] edges
+        cdef vector[uint64_t] sums
+        cdef State a, ps
+        cdef uint64_t key, n
+        cdef int edge, shard
+        if not self.layer_files.empty():
+            raise ValueError('Paths can be counted only for states in memory.')
+        if self.counts.empty():
+            self.counts.resize(SHARDS)
+            for shard in range(SHARDS):
+                self.counts[shard].resize(
+                    self.visited.shard(shard).capacity(), UNCOUNTED)
+        for key in keys:
+            a = self.packer.unpack(key)
+            if self._paths_to(a, &n) and n != UNCOUNTED:
+                continue
+            stack.push_back(a)
+            edges.push_back(0)
+            sums.push_back(0)
+            while not stack.empty():
+                edge = edges.back()
+                if edge == 2 * self.t.segments:
+                    n = sums.back()
+                    key = self.packer.pack(stack.back())
+                    shard = ShardedStateSet.shard_of(key)
+                    self.counts[shard][self.visited.shard(shard).find(key)] = n
+                    stack.pop_back()
+                    edges.pop_back()
+                    sums.pop_back()
+                    if stack.empty():
+                        continue
+                else:
+                    edges[edges.size() - 1] += 1
+                    a = stack.back()
+                    if not (self._previous(&a, edge, &ps) and
+                            self._paths_to(ps, &n)):
+                        continue
+                    if n == UNCOUNTED:
+                        stack.push_back(ps)
+                        edges.push_back(0)
+                        sums.push_back(0)
+                        continue
+                if sums.back() + n < n or sums.back() + n == UNCOUNTED:
+                    self.counts.clear()
+                    raise OverflowError('Too many paths to count.')
+                sums[sums.size() - 1] += n
+
+    def count_paths(self, material=None):
+        """Return the number of closed paths without building them.
+
+        The paths are those yielded by iter_paths(material=material).
+        """
+        keys = self.closed_keys(material)
+        self._count_paths(keys)
+        return sum(self._closed_count(key) for key in keys)
+
+    def sample_paths(self, int k, seed=None, material=None,
+                     bint canonical=False, bint prune_collisions=False):
+        """Return k closed paths chosen uniformly at random.
+
+        The paths are those yielded by iter_paths(canonical,
+        prune_collisions, material), a path can be chosen more than once.
+        Every path is walked back from its end, previous states are chosen
+        by the number of paths leading to them. Closed paths which
+        iter_paths would skip are rejected and drawn again, ValueError is
+        raised if SAMPLE_ATTEMPTS of them in a row are rejected.
+        """
+        keys = self.closed_keys(material)
+        self._count_paths(keys)
+        ends = list(itertools.accumulate(
+            self._closed_count(key) for key in keys))
+        if k > 0 and (not ends or ends[-1] == 0):
+            raise ValueError('No closed path can be built from %r.' % (
+                material or self.material,))
+        rng = random.Random(seed)
+        paths = []
+        rejected = 0
+        while len(paths) < k:
+            path = self._sample_path(keys, ends, rng)
+            if ((canonical and not _least_in_orbit(path, self.catalog)) or
+                    (prune_collisions and
+                     _path_collides(self.t, path, self.t.forward))):
+                rejected += 1
+                if rejected == SAMPLE_ATTEMPTS:
+                    raise ValueError(
+                        'No path of %d closed paths of %r is valid.' % (
+                            rejected, material or self.material))
+                continue
+            rejected = 0
+            paths.append(path)
+        return paths
+
+    def _sample_path(self, keys, ends, rng):
+        # closed path of the index drawn from the counts of paths ending
+        # in the keys, ends are their cumulative sums
+        cdef State a, ps
+        cdef uint64_t r, n
+        cdef int edge
+        index = rng.randrange(ends[-1])
+        i = bisect.bisect_right(ends, index)
+        r = index - (ends[i - 1] if i else 0)
+        a = self.packer.unpack(keys[i])
+        path = []
+        while not a == self.start:
+            for edge in range(2 * self.t.segments):
+                if not (self._previous(&a, edge, &ps) and
+                        self._paths_to(ps, &n)):
                     continue
-                if not (0 <= level <= downs):
+                if r < n:
+                    break
+                r -= n
+            path.append(self.compiled.names[edge >> 1])
+            a = ps
+        return ''.join(reversed(path))
+
+    def _walk_back(self, keys, bint canonical=False, bint prune_collisions=False,
+                   bint closed=True):
+        """Yield paths leading from the start to the states with keys.
+
+        The states are searched depth first, so only the path to the
+        current state is kept in memory. The keys are the ends of closed
+        paths unless closed is False.
+        """
+        cdef vector[State] stack
+        cdef vector[int] segments
+        cdef vector[char] path, reversed_path
+        cdef vector[vector[int]] alive
+        cdef vector[int] next_alive
+        # parts of the segments on the stack, marks[k] is the number of
+        # them before the segment leading to stack[k]
+        cdef vector[Line] lines
+        cdef vector[size_t] marks
+        cdef Line new_lines[2]
+        cdef int line_count
+        cdef bint closing
+        cdef State a, ps, end_state
+        cdef int segment, edge, depth, total
+        cdef Tables* t = self.t
+        total = self.total
+        # path is filled from the end
+        path.resize(total)
+        reversed_path.resize(total)
+        alive.resize(total + 1)
+        end_state = self.start
+        for key in keys:
+            stack.push_back(self.packer.unpack(key))
+            segments.push_back(0)
+            marks.push_back(0)
+            alive[0].clear()
+            if canonical:
+                alive[0].push_back(1)
+            while not stack.empty():
+                # the previous state can be reached by an uphill or not,
+                # both variants are tried for every segment
+                edge = segments.back()
+                if edge == 2 * t.segments:
+                    stack.pop_back()
+                    segments.pop_back()
+                    lines.resize(marks.back())
+                    marks.pop_back()
                     continue
-                if straight < 0 or turns < 0 or ups < 0 or downs < 0 or pillars < 0:
+                segments[segments.size() - 1] += 1
+                segment = edge >> 1
+                a = stack.back()
+                if not self._previous(&a, edge, &ps):
                     continue
-                if max(abs(ax), abs(bx), abs(ay), abs(by)) > abs(straight + turns + ups + downs):
-                    # It's not possible to return back
-                    # with the current number of segments.
+                depth = stack.size()
+                path[total - depth] = t.names[segment]
+                reversed_path[depth - 1] = t.names[segment]
+                if canonical and not _keep_candidates(
+                        alive[depth - 1], next_alive, reversed_path.data(), depth - 1,
+                        t.mirrors):
+                    self.walk_pruned[WALK_SYMMETRY] += 1
                     continue
-                ns = State(
-                    ax, bx, ay, by, angle, level,
-                    straight, turns, ups, downs, pillars)
-                if visited.find(ns) == visited.end():
-                    new_border.push_back(ns)
-                    visited.insert(ns)
-        border = new_border
-
-
-cdef backward_search(unordered_set[State]* visited, m):
-    cdef int level, segment, bi, angle
-    cdef int[400] neighbours_map
-    cdef unsigned int j
-    cdef State ps, a, end_state
-    cdef vector[State] states, new_states;
-    forward = {}
-    for angle in range(8):
-        forward[angle] = _neighbours(angle)
-    # turn right, turn left has to be changed differently
-    for angle in range(8):
-        backward = forward[angle][:3] + [
-            forward[(angle-1)%8][3], forward[(angle+1)%8][4]]
-        for segment, vect in enumerate(backward):
-            for i, n in enumerate(vect):
-                neighbours_map[angle*50+segment*10+i] = n
-
-    paths = []
-    final = []
-    segment_names = 'SUDRL'
-    for a in dereference(visited):
-        if (a.ax == 0 and a.bx == 0 and a.ay == 0 and a.by == 0 and a.angle == 0
-            and a.level == 0):
-            paths.append('')
-            states.push_back(a)
-    end_state = State(
-        0, 0, 0, 0, 0, 0, m.straight, m.turns, m.ups, m.downs, m.pillars)
-    while paths:
-        new_paths = []
-        new_states.clear()
-        for j in range(states.size()):
-            a = states[j]
-            for segment in range(5):
-                bi = a.angle*50 + segment*10
-                level = a.level - neighbours_map[bi+5]
-                # pillars have to be counted from the previous level
-                ps = State(
-                    a.ax - neighbours_map[bi+0],
-                    a.bx - neighbours_map[bi+1],
-                    a.ay - neighbours_map[bi+2],
-                    a.by - neighbours_map[bi+3],
-                    (a.angle - neighbours_map[bi+4]) % 8,
-                    level,
-                    a.straight - neighbours_map[bi+6],
-                    a.turns - neighbours_map[bi+7],
-                    a.ups - neighbours_map[bi+8],
-                    a.downs - neighbours_map[bi+9],
-                    a.pillars - PILLARS[2*segment]*level - PILLARS[2*segment+1]
-                )
-                if ps == end_state:
-                    final.append(paths[j] + segment_names[segment])
+                closing = ps == end_state
+                if not closing and not self._contains(ps):
+                    self.walk_pruned[WALK_UNVISITED] += 1
                     continue
-                if visited.find(ps) != visited.end():
-                    new_paths.append(paths[j] + segment_names[segment])
-                    new_states.push_back(ps)
-        paths = new_paths
-        states = new_states
-    return final
+                if prune_collisions:
+                    line_count = _segment_lines(t, &ps, &a, segment, depth, new_lines)
+                    if _collides(lines, new_lines, line_count, closed and closing):
+                        self.walk_pruned[WALK_COLLISION] += 1
+                        continue
+                if closing:
+                    if canonical and not _closes_least(
+                            next_alive, reversed_path.data(), depth, t.mirrors):
+                        self.walk_pruned[WALK_SYMMETRY] += 1
+                        continue
+                    self.prefixes[depth - 1] += 1
+                    self.walked_paths += 1
+                    yield path.data()[total - depth:total].decode('ascii')
+                else:
+                    self.prefixes[depth - 1] += 1
+                    stack.push_back(ps)
+                    segments.push_back(0)
+                    marks.push_back(lines.size())
+                    if prune_collisions:
+                        lines.insert(lines.end(), new_lines, new_lines + line_count)
+                    if canonical:
+                        alive[depth].swap(next_alive)
+                        if ps.level == 0:
+                            alive[depth].push_back(2 * depth)
+                            alive[depth].push_back(2 * depth + 1)
+            self.walked_keys += 1
+            if self.on_stats is not None:
+                self.on_stats(self.walk_stats)
+
+
+def forward_search(m, jobs=1, catalog=None):
+    return Search(m, jobs, catalog=catalog).states()
+
+
+def iter_paths(m, jobs=1, canonical=False, prune_collisions=False,
+               on_stats=None, catalog=None):
+    """Yield all closed paths which can be built from the material.
+
+    Paths are written in the order of driving from the start. If canonical
+    is set, only one path of those which are rotations or mirror images of
+    each other is yielded. If prune_collisions is set, paths intersecting
+    themselves are cut off as soon as the intersection is found. on_stats
+    gets counters of the search, see Search. Paths may drive through more
+    crossings than the material has, track.valid_tracks counts their pieces.
+    """
+    return Search(m, jobs, on_stats=on_stats, catalog=catalog).iter_paths(
+        canonical, prune_collisions)
+
+
+def find_all_paths(m, jobs=1, catalog=None):
+    return list(iter_paths(m, jobs, catalog=catalog))
+
+
+def iter_paths_external(m, jobs=1, canonical=False, prune_collisions=False,
+                        directory=None, run_size=RUN_SIZE, on_stats=None,
+                        catalog=None):
+    """Yield the same paths as iter_paths, but keep the states on disk.
+
+    Layers of the search are stored in a temporary directory created in
+    directory, by default in the system temporary directory. Only about
+    run_size states are kept in memory at once.
+    """
+    with tempfile.TemporaryDirectory(prefix='lillabo-', dir=directory) as d:
+        search = Search(m, jobs, directory=d, run_size=run_size,
+                        on_stats=on_stats, catalog=catalog)
+        yield from search.iter_paths(canonical, prune_collisions)
+        del search
+
+
+def count_paths(m, jobs=1, catalog=None):
+    """Return the number of paths find_all_paths would return."""
+    return Search(m, jobs, catalog=catalog).count_paths()
+
+
+def sample_paths(m, k, seed=None, jobs=1, catalog=None, canonical=False,
+                 prune_collisions=False):
+    """Return k paths of iter_paths chosen uniformly at random.
+
+    With canonical and prune_collisions the paths are valid tracks, see
+    Search.sample_paths.
+    """
+    return Search(m, jobs, catalog=catalog).sample_paths(
+        k, seed, canonical=canonical, prune_collisions=prune_collisions)
+
+
+def find_all_paths_many(materials, jobs=1, catalog=None):
+    """Return a dict of paths for every material.
+
+    Only one forward search is done for the least material containing all
+    of them. States keep the remaining pieces, so paths of a smaller
+    material are those ending with enough of them left.
+    """
+    materials = list(materials)
+    if not materials:
+        return {}
+    largest = type(materials[0])(*map(max, zip(*materials)))
+    search = Search(largest, jobs, catalog=catalog)
+    return {m: list(search.iter_paths(material=m)) for m in materials}
+
+
+cdef bint _tail_pruned(Tables* t, ReachTable* reach, State& b,
+                       const int* limits, uint64_t* pruned) noexcept:
+    # Whether no prefix can lead from the origin to the start of the tail
+    # b, which counts the pieces used by the tail.
+    cdef int n = t.counters
+    cdef int i, prefix_turns
+    cdef bint joins = False
+    # pieces left for the prefix of the path
+    cdef int[MAX_COUNTERS] prefix
+    cdef int[4] sums
+    if b.level < 0:
+        pruned[PRUNE_LEVEL] += 1
+        return True
+    for i in range(n):
+        prefix[i] = limits[i] - b.counts[i]
+        if prefix[i] < 0:
+            pruned[PRUNE_MATERIAL] += 1
+            return True
+        # the head before the tail uses up the half of the counter of
+        # the first piece of the tail, the rest is left for the tail
+        joins |= limits[i] > 0 and prefix[i] >= limits[i] // 2
+    if not joins:
+        pruned[PRUNE_MATERIAL] += 1
+        return True
+    prefix_turns = _bound(t.turn, prefix, n)
+    if prefix_turns < b.angle < 8 - prefix_turns:
+        # The prefix of the path can't turn to this angle.
+        pruned[PRUNE_TURNS] += 1
+        return True
+    if b.level > _bound(t.ascent, prefix, n):
+        pruned[PRUNE_LEVEL] += 1
+        return True
+    if max(abs(b.ax), abs(b.bx), abs(b.ay), abs(b.by)) > _bound(t.step, prefix, n):
+        # The prefix of the path can't get that far.
+        pruned[PRUNE_DISTANCE] += 1
+        return True
+    # The prefix reversed and turned around returns from the opposite
+    # position to the origin, its uphill pieces become downhill ones.
+    if t.reach:
+        _kind_sums(t, prefix, sums)
+        if not (reach.straight_counts(
+                    -b.ax, -b.bx, -b.ay, -b.by, b.angle, sums[KIND_TURN],
+                    sums[KIND_FLAT] + sums[KIND_UP] + sums[KIND_DOWN]) &
+                _straight_counts(sums[KIND_FLAT], sums[KIND_DOWN],
+                                 sums[KIND_UP], b.level)):
+            pruned[PRUNE_REACH] += 1
+            return True
+    return False
+
+
+cdef void _index_head(Search head, State a, const int* floors,
+                      vector[pair[uint64_t, uint64_t]]& index) noexcept:
+    # Adds the head if it has used up the half of some counter. The
+    # position is the key of the position, angle and level alone.
+    cdef int j
+    cdef bint ends = False
+    for j in range(head.t.counters):
+        ends |= head.limits[j] > 0 and a.counts[j] == floors[j]
+    if ends:
+        index.push_back(pair[uint64_t, uint64_t](
+            head.packer.pack(State(a.ax, a.bx, a.ay, a.by, a.angle, a.level)),
+            head.packer.pack(a)))
+
+
+cdef void _head_index(Search head, const int* floors,
+                      vector[pair[uint64_t, uint64_t]]& index) noexcept:
+    # (position, key) of the heads which can continue by a tail, sorted
+    cdef StateSet* table
+    cdef size_t i
+    cdef int shard
+    # the empty head is the start, which isn't among the visited states
+    _index_head(head, head.start, floors, index)
+    for shard in range(SHARDS):
+        table = &head.visited.shard(shard)
+        for i in range(table.capacity()):
+            if table.slot(i) != EMPTY:
+                _index_head(head, head.packer.unpack(table.slot(i)), floors, index)
+    sort(index.begin(), index.end())
+
+
+def iter_paths_mitm(m, jobs=1, canonical=False, prune_collisions=False,
+                    on_stats=None, catalog=None):
+    """Yield the same paths as iter_paths by meeting in the middle.
+
+    The head of a path is its longest prefix which uses at most half of
+    the pieces of every counter, rounded down. The heads are searched
+    forward by Search(half=True), which keeps only a part of the states of
+    the whole search. The tails are searched depth first backward from the
+    closing point without keeping their states. A tail meets the heads in
+    the same position, angle and level which have used up the half of the
+    counter of the first piece of the tail, the whole tail has to fit into
+    the pieces and pillars left by the head. on_stats gets LayerStats of
+    the search of the heads and WalkStats of their walks back.
+    """
+    cdef Search head
+    cdef Tables* t
+    cdef vector[pair[uint64_t, uint64_t]] index
+    cdef vector[pair[uint64_t, uint64_t]].iterator it
+    cdef ReachTable reach
+    cdef int[8 * STRIDE] forward_map
+    cdef int[MAX_COUNTERS] floors
+    cdef State a, b, ps
+    cdef uint64_t position, start_key
+    cdef uint64_t[PRUNE_STRIDE] pruned
+    cdef int j, c, segment, depth, bi, total
+    cdef bint joins
+    cdef int* backward
+    # Tails are searched like Search._walk_back searches paths, they are
+    # states at the start of the tail, which count the pieces used by it
+    # and in pillars those needed by its segments after the first one
+    cdef vector[State] stack
+    # the next segment to put before every tail and its first segment
+    cdef vector[int] segments, firsts
+    # the tail is filled from the end
+    cdef vector[char] path, reversed_path
+    cdef vector[vector[int]] alive
+    cdef vector[int] next_alive
+    cdef vector[Line] lines
+    cdef vector[size_t] marks
+    cdef Line new_lines[2]
+    cdef int line_count
+
+    head = Search(m, jobs, on_stats=on_stats, catalog=catalog, half=True)
+    t = head.t
+    backward = t.backward
+    total = head.total
+    yield from head.iter_paths(canonical, prune_collisions)
+
+    for j in range(t.counters):
+        floors[j] = head.limits[j] - head.limits[j] // 2
+    _head_index(head, floors, index)
+    start_key = head.packer.pack(head.start)
+    _fill_neighbours_map(t, forward_map, False)
+    _build_reach(&reach, t, forward_map, head.limits)
+    pruned[:] = [0, 0, 0, 0, 0, 0, 0, 0]
+    path.resize(total)
+    reversed_path.resize(total)
+    alive.resize(total + 1)
+    if canonical:
+        alive[0].push_back(1)
+    stack.push_back(State())
+    segments.push_back(0)
+    firsts.push_back(-1)
+    marks.push_back(0)
+    while not stack.empty():
+        segment = segments.back()
+        if segment == t.segments:
+            stack.pop_back()
+            segments.pop_back()
+            firsts.pop_back()
+            lines.resize(marks.back())
+            marks.pop_back()
+            continue
+        segments[segments.size() - 1] += 1
+        b = stack.back()
+        depth = stack.size()
+        # the segment is put before the tail b
+        bi = b.angle*STRIDE + segment*ROW
+        ps = State(
+            b.ax - backward[bi+0],
+            b.bx - backward[bi+1],
+            b.ay - backward[bi+2],
+            b.by - backward[bi+3],
+            (b.angle - backward[bi+4]) % 8,
+            b.level - backward[bi+5],
+            b.pillars)
+        for j in range(t.counters):
+            ps.counts[j] = b.counts[j] - backward[bi+6+j]
+        if depth > 1:
+            # the former first segment follows this one
+            ps.pillars -= _pillars_change(
+                t, firsts.back(), b.level, t.climbs[segment] > 0)
+        if ps.pillars - max(_pillars_change(t, segment, ps.level, 0),
+                            _pillars_change(t, segment, ps.level, 1)) > head.start.pillars:
+            pruned[PRUNE_MATERIAL] += 1
+            continue
+        if _tail_pruned(t, &reach, ps, head.limits, pruned):
+            continue
+        path[total - depth] = t.names[segment]
+        reversed_path[depth - 1] = t.names[segment]
+        if canonical and not _keep_candidates(
+                alive[depth - 1], next_alive, reversed_path.data(), depth - 1,
+                t.mirrors):
+            continue
+        if prune_collisions:
+            line_count = _segment_lines(t, &ps, &b, segment, depth, new_lines)
+            # the tail may be the whole path, the joined path is checked
+            # again
+            if _collides(lines, new_lines, line_count,
+                         ps.ax == 0 and ps.bx == 0 and ps.ay == 0 and
+                         ps.by == 0 and ps.angle == 0 and ps.level == 0):
+                continue
+        stack.push_back(ps)
+        segments.push_back(0)
+        firsts.push_back(segment)
+        marks.push_back(lines.size())
+        if prune_collisions:
+            lines.insert(lines.end(), new_lines, new_lines + line_count)
+        if canonical:
+            alive[depth].swap(next_alive)
+            if ps.level == 0:
+                alive[depth].push_back(2 * depth)
+                alive[depth].push_back(2 * depth + 1)
+
+        # heads ending where the tail starts
+        a = State(ps.ax, ps.bx, ps.ay, ps.by, ps.angle, ps.level)
+        if not head.packer.contains(a):
+            continue
+        position = head.packer.pack(a)
+        it = lower_bound(index.begin(), index.end(),
+                         pair[uint64_t, uint64_t](position, 0))
+        c = t.counter[segment]
+        tail = None
+        while it != index.end() and dereference(it).first == position:
+            a = head.packer.unpack(dereference(it).second)
+            joins = (
+                a.counts[c] == floors[c] and
+                a.pillars + _pillars_change(t, segment, ps.level, a.up) >= ps.pillars)
+            for j in range(t.counters):
+                joins &= a.counts[j] >= ps.counts[j]
+            if joins:
+                if tail is None:
+                    tail = path.data()[total - depth:total].decode('ascii')
+                if dereference(it).second == start_key:
+                    heads = ['']
+                else:
+                    heads = head._walk_back(
+                        [dereference(it).second], False, prune_collisions, False)
+                for h in heads:
+                    if canonical and not _least_in_orbit(h + tail, catalog):
+                        continue
+                    if prune_collisions and _path_collides(t, h + tail, t.forward):
+                        continue
+                    yield h + tail
+            it += 1
+
+
+def find_all_paths_mitm(m, jobs=1, catalog=None):
+    return list(iter_paths_mitm(m, jobs, catalog=catalog))
+
+
+cdef int _least_rotation(const char* doubled, int n) noexcept nogil:
+    # Duval's Lyndon factorization, doubled contains the path twice.
+    cdef int i = 0, j, k, start = 0
+    while i < n:
+        start = i
+        j = i + 1
+        k = i
+        while j < 2 * n and doubled[k] <= doubled[j]:
+            if doubled[k] < doubled[j]:
+                k = i
+            else:
+                k += 1
+            j += 1
+        while i <= k:
+            i += j - k
+    return start
 
 
-def find_all_paths(m):
-    cdef unordered_set[State] visited
-    _forward_search(&visited, m)
-    return backward_search(&visited, m)
+def canonical_paths(paths, catalog=None):
+    """Return track.canonical_path of every path.
 
+    The path, its mirror image and both of them reversed are rotated to
+    their least rotation and the least of them is taken.
+    """
+    cdef _Compiled compiled = _compile(catalog)
+    cdef const char* mirrors = compiled.t.mirrors
+    cdef vector[char] variant, best
+    cdef bytes encoded
+    cdef const char* p
+    cdef int n, i, v, start
+    result = []
+    for path in paths:
+        encoded = path.encode('ascii')
+        p = encoded
+        n = len(encoded)
+        if n == 0:
+            result.append(path)
+            continue
+        variant.resize(2 * n)
+        best.resize(n)
+        for v in range(4):
+            for i in range(n):
+                # bit 0 mirrors, bit 1 reverses the path
+                variant[i] = p[n - 1 - i if v & 2 else i]
+                if v & 1:
+                    variant[i] = mirrors[<unsigned char>variant[i]]
+                variant[n + i] = variant[i]
+            start = _least_rotation(variant.data(), n)
+            if v == 0 or memcmp(variant.data() + start, best.data(), n) < 0:
+                memcpy(best.data(), variant.data() + start, n)
+        result.append(best.data()[:n].decode('ascii'))
+    return result
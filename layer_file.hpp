@@ -0,0 +1,166 @@
+/** Layers of the search stored on disk as sorted arrays of packed states.
+    Keys are written in the native byte order. **/
+#include <stdint.h>
+#include <stddef.h>
+#include <stdio.h>
+#include <algorithm>
+#include <queue>
+#include <string>
+#include <utility>
+#include <vector>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+/** Sorts the keys, removes duplicates and writes them to the file. **/
+inline bool write_run(std::vector<uint64_t>& keys, const char* path) {
+    std::sort(keys.begin(), keys.end());
+    keys.erase(std::unique(keys.begin(), keys.end()), keys.end());
+    FILE* f = fopen(path, "wb");
+    if (!f) {
+        return false;
+    }
+    size_t written = fwrite(keys.data(), sizeof(uint64_t), keys.size(), f);
+    return fclose(f) == 0 && written == keys.size();
+}
+
+/** Reads keys of a file in large blocks. **/
+class KeyReader {
+    public:
+        KeyReader(): f(NULL), pos(0), end(0) {};
+        ~KeyReader() { close(); };
+        bool open(const char* path) {
+            close();
+            f = fopen(path, "rb");
+            return f != NULL;
+        };
+        void close() {
+            if (f) {
+                fclose(f);
+                f = NULL;
+            }
+            pos = end = 0;
+        };
+        /** Appends at most n keys to out, returns the number of them. **/
+        size_t read(std::vector<uint64_t>& out, size_t n) {
+            size_t start = out.size();
+            out.resize(start + n);
+            size_t count = f ? fread(out.data() + start, sizeof(uint64_t), n, f) : 0;
+            out.resize(start + count);
+            return count;
+        };
+        bool next(uint64_t& key) {
+            if (pos == end) {
+                buffer.clear();
+                end = read(buffer, BLOCK);
+                pos = 0;
+                if (end == 0) {
+                    return false;
+                }
+            }
+            key = buffer[pos++];
+            return true;
+        };
+
+    private:
+        static const size_t BLOCK = 1 << 16;
+        FILE* f;
+        std::vector<uint64_t> buffer;
+        size_t pos, end;
+};
+
+/** Merges sorted files into one without duplicates.
+    Returns the number of keys written or -1 on error. **/
+inline long long merge_runs(const std::vector<std::string>& runs, const char* path) {
+    typedef std::pair<uint64_t, size_t> Head;
+    std::vector<KeyReader> readers(runs.size());
+    std::priority_queue<Head, std::vector<Head>, std::greater<Head> > heads;
+    uint64_t key;
+    for (size_t i = 0; i < runs.size(); i++) {
+        if (!readers[i].open(runs[i].c_str())) {
+            return -1;
+        }
+        if (readers[i].next(key)) {
+            heads.push(Head(key, i));
+        }
+    }
+    FILE* f = fopen(path, "wb");
+    if (!f) {
+        return -1;
+    }
+    std::vector<uint64_t> out;
+    long long count = 0;
+    bool ok = true;
+    while (!heads.empty()) {
+        Head head = heads.top();
+        heads.pop();
+        if (count == 0 || head.first != out.back()) {
+            if (out.size() == (1 << 16)) {
+                ok = ok && fwrite(out.data(), sizeof(uint64_t), out.size(), f) == out.size();
+                out.clear();
+            }
+            out.push_back(head.first);
+            count++;
+        }
+        if (readers[head.second].next(key)) {
+            heads.push(Head(key, head.second));
+        }
+    }
+    ok = ok && fwrite(out.data(), sizeof(uint64_t), out.size(), f) == out.size();
+    ok = fclose(f) == 0 && ok;
+    return ok ? count : -1;
+}
+
+/** Sorted keys of a file mapped to memory. **/
+class LayerFile {
+    public:
+        LayerFile(): keys(NULL), count(0) {};
+        ~LayerFile() { close(); };
+        bool open(const char* path);
+        void close();
+        size_t size() const { return count; };
+        uint64_t at(size_t i) const { return keys[i]; };
+        bool contains(uint64_t key) const {
+            return std::binary_search(keys, keys + count, key);
+        };
+
+    private:
+        uint64_t* keys;
+        size_t count;
+        LayerFile(const LayerFile&);
+        LayerFile& operator=(const LayerFile&);
+};
+
+inline bool LayerFile::open(const char* path) {
+    close();
+    int fd = ::open(path, O_RDONLY);
+    if (fd < 0) {
+        return false;
+    }
+    struct stat st;
+    if (fstat(fd, &st) != 0) {
+        ::close(fd);
+        return false;
+    }
+    count = st.st_size / sizeof(uint64_t);
+    if (count > 0) {
+        void* data = mmap(NULL, count * sizeof(uint64_t), PROT_READ, MAP_SHARED, fd, 0);
+        if (data == MAP_FAILED) {
+            count = 0;
+            ::close(fd);
+            return false;
+        }
+        keys = (uint64_t*)data;
+    }
+    ::close(fd);
+    return true;
+}
+
+inline void LayerFile::close() {
+    if (keys) {
+        munmap(keys, count * sizeof(uint64_t));
+    }
+    keys = NULL;
+    count = 0;
+}
@@ -0,0 +1,174 @@
+/** Numbers of pieces which can bring a position and angle back to the
+    origin at angle 0. Collisions, levels and pillars are ignored, uphill
+    and downhill pieces count as straight ones. **/
+#include <stdint.h>
+#include <stddef.h>
+#include <stdlib.h>
+#include <algorithm>
+#include <unordered_map>
+#include <vector>
+
+class ReachTable {
+    public:
+        ReachTable(): turns(0), straight(0), pieces(-1) {};
+
+        /** Fills the table for paths of at most turns turns and straight
+            straight pieces, moves of the segments are given as the
+            neighbours map of the search with stride numbers for an angle
+            and row numbers for a segment. A piece moves every coordinate
+            by max_step at most. Paths are added by the number of their
+            pieces until the table has max_size entries. Returns the number
+            of pieces of the longest paths in the table. **/
+        int build(const int* neighbours_map, int stride, int row,
+                  int segments, int turns, int straight, int max_step,
+                  size_t max_size);
+
+        /** Bit n is set if the origin can be reached with n straight pieces
+            and at most turns turns. Paths longer than the table are not
+            known, all bits are set if turns and straight pieces could
+            make one. **/
+        uint64_t straight_counts(int ax, int bx, int ay, int by, int angle,
+                                 int turns, int straight) const {
+            if (turns + straight > pieces) {
+                return ~(uint64_t)0;
+            }
+            if (turns < 0) {
+                return 0;
+            }
+            std::unordered_map<uint64_t, size_t>::const_iterator it =
+                index.find(position(ax, bx, ay, by, angle));
+            if (it == index.end()) {
+                return 0;
+            }
+            return masks[it->second + (turns < this->turns ? turns : this->turns)];
+        };
+
+        size_t size() const { return masks.size(); };
+
+    private:
+        static const int COORD_BITS = 12;
+        int turns, straight, pieces;
+        // positions to the first of turns + 1 masks, the mask t is for
+        // paths with at most t turns
+        std::unordered_map<uint64_t, size_t> index;
+        std::vector<uint64_t> masks;
+
+        static uint64_t position(int ax, int bx, int ay, int by, int angle) {
+            const int offset = 1 << (COORD_BITS - 1);
+            return ((((((uint64_t)(ax + offset) << COORD_BITS |
+                        (uint64_t)(bx + offset)) << COORD_BITS |
+                       (uint64_t)(ay + offset)) << COORD_BITS |
+                      (uint64_t)(by + offset)) << 3) | angle);
+        };
+        static void add(std::unordered_map<uint64_t, uint64_t>& layer,
+                        int ax, int bx, int ay, int by, int angle,
+                        uint64_t turns, int distance) {
+            if (abs(ax) <= distance && abs(bx) <= distance &&
+                    abs(ay) <= distance && abs(by) <= distance) {
+                layer[position(ax, bx, ay, by, angle)] |= turns;
+            }
+        };
+        static void unpack(uint64_t p, int& ax, int& bx, int& ay, int& by,
+                           int& angle) {
+            const int offset = 1 << (COORD_BITS - 1);
+            const uint64_t mask = (1 << COORD_BITS) - 1;
+            angle = p & 7;
+            by = (int)(p >> 3 & mask) - offset;
+            ay = (int)(p >> (3 + COORD_BITS) & mask) - offset;
+            bx = (int)(p >> (3 + 2 * COORD_BITS) & mask) - offset;
+            ax = (int)(p >> (3 + 3 * COORD_BITS) & mask) - offset;
+        };
+};
+
+inline int ReachTable::build(const int* neighbours_map, int stride,
+                             int row, int segments, int turns, int straight,
+                             int max_step, size_t max_size) {
+    typedef std::unordered_map<uint64_t, uint64_t> Layer;
+    index.clear();
+    masks.clear();
+    pieces = -1;
+    if (straight > 63 || turns > 63 ||
+            (turns + straight) * max_step >= 1 << (COORD_BITS - 1)) {
+        return pieces;
+    }
+    this->turns = turns;
+    this->straight = straight;
+    int ax, bx, ay, by, angle;
+    // Rows of the moves which end at every angle and the angles they start
+    // at. Segments moving the same way, e.g. straight, uphill and downhill
+    // ones, are kept once.
+    std::vector<std::pair<const int*, int> > moves[8];
+    for (angle = 0; angle < 8; angle++) {
+        for (int segment = 0; segment < segments; segment++) {
+            int turn = neighbours_map[angle * stride + segment * row + 4];
+            int start = (angle - turn + 8) % 8;
+            const int* shift = neighbours_map + start * stride + segment * row;
+            bool seen = false;
+            for (size_t i = 0; i < moves[angle].size() && !seen; i++) {
+                seen = std::equal(shift, shift + 5, moves[angle][i].first);
+            }
+            if (!seen) {
+                moves[angle].push_back(std::make_pair(shift, start));
+            }
+        }
+    }
+    // positions reachable with exactly k pieces, bit t is set for paths
+    // with t turns and k - t straight pieces
+    Layer layer, previous;
+    layer[position(0, 0, 0, 0, 0)] = 1;
+    for (int k = 0; k <= turns + straight && !layer.empty(); k++) {
+        size_t added = 0;
+        for (Layer::iterator it = layer.begin(); it != layer.end(); ++it) {
+            added += !index.count(it->first);
+        }
+        if (masks.size() + added * (turns + 1) > max_size) {
+            break;
+        }
+        for (Layer::iterator it = layer.begin(); it != layer.end(); ++it) {
+            std::pair<std::unordered_map<uint64_t, size_t>::iterator, bool> found =
+                index.insert(std::make_pair(it->first, masks.size()));
+            if (found.second) {
+                masks.resize(masks.size() + turns + 1);
+            }
+            uint64_t* block = &masks[found.first->second];
+            for (int t = 0; t <= turns && t <= k; t++) {
+                if (it->second >> t & 1) {
+                    block[t] |= (uint64_t)1 << (k - t);
+                }
+            }
+        }
+        pieces = k;
+        // one piece more is one step back, a turn comes from the angle
+        // before it
+        int fewest_turns = k + 1 - straight;
+        uint64_t straight_turns = fewest_turns <= 0 ? ~(uint64_t)0 :
+            fewest_turns < 64 ? ~(uint64_t)0 << fewest_turns : 0;
+        uint64_t all_turns = turns == 63 ? ~(uint64_t)0 : ((uint64_t)1 << (turns + 1)) - 1;
+        // Searched paths start at the origin and every piece moves every
+        // coordinate at most by max_step, so they get only so far from it
+        // with the rest of the pieces.
+        int distance = (turns + straight - k - 1) * max_step;
+        previous.clear();
+        for (Layer::iterator it = layer.begin(); it != layer.end(); ++it) {
+            unpack(it->first, ax, bx, ay, by, angle);
+            uint64_t straight_t = it->second & straight_turns;
+            uint64_t turn_t = (it->second << 1) & all_turns;
+            for (size_t i = 0; i < moves[angle].size(); i++) {
+                const int* shift = moves[angle][i].first;
+                uint64_t t = shift[4] ? turn_t : straight_t;
+                if (t) {
+                    add(previous, ax - shift[0], bx - shift[1], ay - shift[2],
+                        by - shift[3], moves[angle][i].second, t, distance);
+                }
+            }
+        }
+        layer.swap(previous);
+    }
+    // paths with fewer turns are valid for more of them too
+    for (size_t i = 0; i < masks.size(); i += turns + 1) {
+        for (int t = 1; t <= turns; t++) {
+            masks[i + t] |= masks[i + t - 1];
+        }
+    }
+    return pieces;
+}
@@ -0,0 +1,210 @@
+#!/usr/local/bin/python3
+"""
+Find closed tracks by local search, for sets too large for solver.py.
+
+A random path is changed by small moves until it closes without
+collisions. Every found track is printed and the search jumps away from
+it to find another one.
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+
+import collision
+import solver
+import track
+
+
+# cost of one unit of the distance between the ends of the path
+CLOSURE_WEIGHT = 4
+# cost of a piece left out of the track, higher values find longer
+# tracks but less of them
+UNUSED_WEIGHT = 0.25
+# steps of one cooling of the temperature
+COOLING = 2000
+# number of random moves after a track is found
+KICK = 10
+
+
+def random_path(material, rng):
+    """Random path with all pieces, turning around once if possible."""
+    rights = min(material.turns, (material.turns + 8) // 2)
+    pieces = (
+        'S' * material.straight + 'R' * rights +
+        'L' * (material.turns - rights) +
+        'U' * min(material.ups, material.downs) +
+        'D' * min(material.ups, material.downs))
+    pieces = list(pieces)
+    rng.shuffle(pieces)
+    return ''.join(pieces)
+
+
+def closure_distance(t):
+    """Distance of the end of the path from its start in the lattice."""
+    angle = t.angle[-1] % 8
+    return sum(map(abs, t.lattice[-1])) + min(angle, 8 - angle)
+
+
+def defects(path, material):
+    """Return how far the path is from a valid track, 0 if it is valid."""
+    t = track.Track(path)
+    excess_pillars = max(t.count_pillars() - material.pillars, 0)
+    return (CLOSURE_WEIGHT * closure_distance(t) + excess_pillars +
+            collision.count_intersections(t))
+
+
+def cost(path, material, unused_weight=UNUSED_WEIGHT):
+    """Return defects of the path and the cost minimized by the search."""
+    d = defects(path, material)
+    unused = sum(material) - material.pillars - len(path)
+    return d, d + unused_weight * unused
+
+
+def _swap(path, i, j):
+    p = list(path)
+    p[i], p[j] = p[j], p[i]
+    return ''.join(p)
+
+
+def neighbour(path, material, rng):
+    """Return the path changed by one random move.
+
+    Moves are those of Track.simplify and the opposite ones: neighbouring
+    segments are swapped, pairs of straight segments or of opposite turns
+    are removed or inserted. An empty path is returned unchanged.
+    """
+    n = len(path)
+    if not n:
+        return path
+    move = rng.randrange(5)
+    if move == 0:
+        i = rng.randrange(n)
+        return _swap(path, i, (i + 1) % n)
+    if move == 1:
+        return _swap(path, rng.randrange(n), rng.randrange(n))
+    if move == 2 and path.count('S') >= 2 and n > 8:
+        i, j = sorted(rng.sample(
+            [k for k, s in enumerate(path) if s == 'S'], 2))
+        return path[:i] + path[i+1:j] + path[j+1:]
+    if move == 3 and n > 8:
+        pairs = [k for k in range(n - 1) if path[k:k+2] in ('RL', 'LR')]
+        if pairs:
+            i = rng.choice(pairs)
+            return path[:i] + path[i+2:]
+    if move == 4:
+        i, j = sorted((rng.randrange(n + 1), rng.randrange(n + 1)))
+        if path.count('S') + 2 <= material.straight:
+            return path[:i] + 'S' + path[i:j] + 'S' + path[j:]
+        if path.count('R') + path.count('L') + 2 <= material.turns:
+            return path[:i] + rng.choice(('RL', 'LR')) + path[i:]
+    i = rng.randrange(n)
+    return _swap(path, i, (i + 1) % n)
+
+
+def iter_tracks(material, seconds=None, steps=None, seed=None,
+                temperature=2.0, unused_weight=UNUSED_WEIGHT):
+    """Yield valid tracks found by simulated annealing.
+
+    The search stops after seconds or steps. The temperature is cooled down
+    every COOLING steps and heated again. Every piece left out of the path
+    costs unused_weight. Rotations, mirror images and reversed tracks of
+    found tracks are skipped. A material without pieces yields no tracks.
+    """
+    rng = random.Random(seed)
+    deadline = None if seconds is None else time.monotonic() + seconds
+    found = set()
+    path = random_path(material, rng)
+    if not path:
+        return
+    current_defects, current = cost(path, material, unused_weight)
+    step = 0
+    while steps is None or step < steps:
+        if deadline is not None and step % 100 == 0 and time.monotonic() > deadline:
+            break
+        t = temperature * (1 - (step % COOLING) / COOLING)
+        step += 1
+        new_path = neighbour(path, material, rng)
+        new_defects, new_cost = cost(new_path, material, unused_weight)
+        if new_cost <= current or rng.random() < math.exp((current - new_cost) / t):
+            path, current, current_defects = new_path, new_cost, new_defects
+        if current_defects:
+            continue
+        candidate = track.Track(path)
+        key = track.canonical_path(path)
+        if key not in found and candidate.is_valid(material):
+            found.add(key)
+            yield candidate
+        for _ in range(KICK):
+            path = neighbour(path, material, rng)
+        current_defects, current = cost(path, material, unused_weight)
+
+
+DESCRIPTION = """\
+Write out enclosed paths found by local search, it can use many more
+pieces than solver.py but it doesn't find all tracks. Paths are written
+as in solver.py, statistics to the standard error.\
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '--turns',
+        dest='turns', type=int, default=48, help='number of turn segments')
+    parser.add_argument(
+        '--straight',
+        dest='straight', type=int, default=40,
+        help='number of straight segments')
+    parser.add_argument(
+        '--ups',
+        dest='ups', type=int, default=8, help='number of uphill segments')
+    parser.add_argument(
+        '--downs',
+        dest='downs', type=int, default=8, help='number of downhill segments')
+    parser.add_argument(
+        '--pillars',
+        dest='pillars', type=int, default=16, help='number of pillars')
+    parser.add_argument(
+        '--time',
+        dest='seconds', type=float, default=60,
+        help='seconds to search for')
+    parser.add_argument(
+        '--steps',
+        dest='steps', type=int, default=None,
+        help='stop after the number of moves, the output is the same for '
+             'the same seed')
+    parser.add_argument(
+        '--seed',
+        dest='seed', type=int, default=None, help='seed of the random moves')
+    parser.add_argument(
+        '--unused-cost',
+        dest='unused_weight', type=float, default=UNUSED_WEIGHT,
+        help='cost of a piece left out, higher values find longer tracks '
+             'but less of them')
+    args = parser.parse_args()
+    material = solver.Material(
+        turns=args.turns,
+        straight=args.straight,
+        ups=args.ups,
+        downs=args.downs,
+        pillars=args.pillars)
+
+    start = time.monotonic()
+    count = 0
+    seconds = None if args.steps is not None else args.seconds
+    tracks = iter_tracks(
+        material, seconds, args.steps, args.seed,
+        unused_weight=args.unused_weight)
+    for t in tracks:
+        print(t.path, flush=True)
+        count += 1
+    elapsed = time.monotonic() - start
+    print('%d tracks in %.1f s, %.2f tracks/s' % (
+        count, elapsed, count / elapsed if elapsed else 0.0), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Catalog of track pieces.
+
+Every piece is described by its shift at angle 0 in the basis of
+dynamic.pyx, the point lies at
+x = (ax*sqrt(2)/2 + bx*(1 - sqrt(2)/2)) / scale,
+y = (ay*sqrt(2)/2 + by*(1 - sqrt(2)/2)) / scale,
+where scale is given by the catalog, pieces of half the length of the
+straight one need a catalog of scale 2. Shifts at other angles are
+computed by turning it. A piece turns by a multiple of 45 degrees, climbs
+by one level at most and takes one piece of a material counter of the
+catalog. A turning piece is an arc, its shift points halfway between the
+directions at its ends.
+
+A crossing piece is a straight piece which the track can drive through
+twice, the two parts cross each other in their middles. The search counts
+every drive through it, so it can use twice the pieces of its counter,
+and valid tracks use at most the pieces of the material.
+
+The catalog is compiled to flat tables used by the search, it can be read
+from a JSON file with an object with the fields of Catalog, its segments
+are objects with the fields of Segment.
+"""
+import collections
+import itertools
+import json
+import math
+
+
+# material counters of the basic pieces, in the order of the fields of
+# solver.Material
+COUNTERS = ('straight', 'turns', 'ups', 'downs')
+
+# segments are stored in 4 bits in the cache, one code pads paths
+MAX_SEGMENTS = 15
+# material counters of State
+MAX_COUNTERS = 8
+# turns of a segment in steps of 45 degrees
+MAX_TURN = 3
+
+# Pillars under a segment at level are pillars[0]*level + pillars[1],
+# after an uphill segment they are after_up if it is given.
+Segment = collections.namedtuple(
+    'Segment', 'name counter shift turn climb pillars after_up mirror crossing')
+Segment.__new__.__defaults__ = (None, None, False)
+
+Catalog = collections.namedtuple('Catalog', 'segments counters scale')
+Catalog.__new__.__defaults__ = (COUNTERS, 1)
+
+
+BASIC = Catalog((
+    Segment('S', 'straight', (1, 1, 0, 0), 0, 0, (1, 0)),
+    Segment('U', 'ups', (1, 1, 0, 0), 0, 1, (2, 0)),
+    # a downhill after an uphill shares a pillar with it
+    Segment('D', 'downs', (1, 1, 0, 0), 0, -1, (2, -2), after_up=(1, -1)),
+    Segment('R', 'turns', (1, 0, 0, -1), 1, 0, (1, 0), mirror='L'),
+    Segment('L', 'turns', (1, 0, 0, 1), -1, 0, (1, 0), mirror='R'),
+))
+
+# The basic pieces in half units with short straight pieces (H), short
+# turns of half the radius (r, l) and crossings (X).
+EXTENDED = Catalog(
+    tuple(s._replace(shift=tuple(2 * x for x in s.shift))
+          for s in BASIC.segments) + (
+        Segment('H', 'short', (1, 1, 0, 0), 0, 0, (1, 0)),
+        Segment('r', 'short_turns', (1, 0, 0, -1), 1, 0, (1, 0), mirror='l'),
+        Segment('l', 'short_turns', (1, 0, 0, 1), -1, 0, (1, 0), mirror='r'),
+        Segment('X', 'crossings', (2, 2, 0, 0), 0, 0, (1, 0), crossing=True),
+    ),
+    COUNTERS + ('short', 'short_turns', 'crossings'), 2)
+
+
+def _half(value):
+    if value % 2:
+        raise ValueError('Shift can not be turned in the lattice.')
+    return value // 2
+
+
+def turn_right(shift):
+    """Shift turned by one angle, i.e. 45 degrees to the right."""
+    ax, bx, ay, by = shift
+    return (
+        _half(ax + ay + bx + by), _half(ax + ay - bx - by),
+        _half(ay - ax + by - bx), _half(ay - ax - by + bx))
+
+
+def shifts(segment):
+    """Shifts of the segment for every angle."""
+    result = [tuple(segment.shift)]
+    for _ in range(7):
+        result.append(turn_right(result[-1]))
+    return result
+
+
+def _check_segment(s, catalog):
+    if len(s.name) != 1 or s.name == '-' or ord(s.name) > 127:
+        raise ValueError('Segment name %r is not one letter.' % s.name)
+    if s.counter not in catalog.counters:
+        raise ValueError('Unknown material %r of segment %s.' % (
+            s.counter, s.name))
+    try:
+        valid = len(s.shift) == 4 and turn_right(shifts(s)[-1]) == tuple(s.shift)
+    except ValueError:
+        valid = False
+    if not valid:
+        raise ValueError('Shift of segment %s is not in the lattice.' % s.name)
+    if not any(s.shift):
+        raise ValueError('Segment %s doesn\'t move.' % s.name)
+    if abs(s.turn) > MAX_TURN:
+        raise ValueError('Segment %s turns by %d.' % (s.name, s.turn))
+    ax, bx, ay, by = s.shift
+    half = math.sqrt(2) / 2
+    direction = math.atan2(ay*half + by*(1 - half), ax*half + bx*(1 - half))
+    # right turns are positive and go to negative y
+    if abs(direction + s.turn * math.pi / 8) > 1e-9:
+        raise ValueError(
+            'Shift of segment %s doesn\'t follow its turn.' % s.name)
+    if s.climb not in (-1, 0, 1):
+        raise ValueError('Segment %s climbs by %d.' % (s.name, s.climb))
+    if s.after_up is not None and (
+            s.after_up[0] > s.pillars[0] or
+            sum(s.after_up) > sum(s.pillars)):
+        # the search counts the least pillars when it doesn't know
+        # the previous segment
+        raise ValueError(
+            'Segment %s needs more pillars after an uphill.' % s.name)
+    if s.crossing and (s.turn or s.climb):
+        raise ValueError('Crossing %s is not straight.' % s.name)
+
+
+def check(catalog):
+    """Raise ValueError if the catalog can't be used by the search."""
+    names = [s.name for s in catalog.segments]
+    if not 0 < len(names) <= MAX_SEGMENTS:
+        raise ValueError('Catalog needs 1 to %d segments.' % MAX_SEGMENTS)
+    if len(set(names)) != len(names):
+        raise ValueError('Segment names are not unique.')
+    counters = catalog.counters
+    if not 0 < len(counters) <= MAX_COUNTERS:
+        raise ValueError('Catalog needs 1 to %d counters.' % MAX_COUNTERS)
+    if len(set(counters)) != len(counters) or any(
+            not c.isidentifier() or c.startswith('_') or c == 'pillars'
+            for c in counters):
+        raise ValueError('Counters %r are not unique names.' % (counters,))
+    if not (isinstance(catalog.scale, int) and catalog.scale > 0):
+        raise ValueError('Scale %r is not a positive integer.' % (
+            catalog.scale,))
+    for s in catalog.segments:
+        _check_segment(s, catalog)
+        if s.mirror is not None and s.mirror not in names:
+            raise ValueError('Unknown mirror of segment %s.' % s.name)
+    for counter in counters:
+        kinds = {s.crossing for s in catalog.segments if s.counter == counter}
+        if len(kinds) > 1:
+            raise ValueError(
+                'Material %r is shared by crossings and other pieces.' % (
+                    counter,))
+
+
+def _segment_from_json(fields):
+    segment = Segment(**fields)
+    return segment._replace(
+        shift=tuple(segment.shift), pillars=tuple(segment.pillars),
+        after_up=segment.after_up and tuple(segment.after_up))
+
+
+def to_json(catalog):
+    """Return the catalog as an object which load reads."""
+    return dict(catalog._replace(
+        segments=[s._asdict() for s in catalog.segments],
+        counters=list(catalog.counters))._asdict())
+
+
+def load(filename):
+    """Read a catalog from a JSON object with the fields of Catalog."""
+    with open(filename) as f:
+        fields = json.load(f)
+    catalog = Catalog(**fields)
+    catalog = catalog._replace(
+        segments=tuple(_segment_from_json(s) for s in catalog.segments),
+        counters=tuple(catalog.counters))
+    check(catalog)
+    return catalog
+
+
+def material_type(catalog):
+    """Namedtuple of a material of the catalog, its counters and pillars.
+
+    The basic catalog has the fields of solver.Material.
+    """
+    return collections.namedtuple('Material', catalog.counters + ('pillars',))
+
+
+def search_limits(catalog, material):
+    """Pieces of every counter the search may use, crossings count twice."""
+    crossings = {s.counter for s in catalog.segments if s.crossing}
+    return [
+        getattr(material, c) * (2 if c in crossings else 1)
+        for c in catalog.counters]
+
+
+def counter_bounds(catalog):
+    """Return the most one piece of every counter moves a coordinate,
+    turns and climbs up and down, the search prunes by them."""
+    bounds = []
+    for counter in catalog.counters:
+        used = [s for s in catalog.segments if s.counter == counter]
+        bounds.append((
+            max((abs(x) for s in used for x in itertools.chain(*shifts(s))),
+                default=0),
+            max((abs(s.turn) for s in used), default=0),
+            max([s.climb for s in used] + [0]),
+            max([-s.climb for s in used] + [0]),
+        ))
+    return bounds
+
+
+# kinds of counters by their pieces for the table of positions which can
+# return to the origin
+KIND_TURN, KIND_FLAT, KIND_UP, KIND_DOWN = range(4)
+
+
+def counter_kinds(catalog):
+    """Return kinds of the counters, or None if a counter mixes turning,
+    flat, uphill and downhill pieces or a turning piece climbs."""
+    kinds = []
+    for counter in catalog.counters:
+        used = {
+            (KIND_TURN if s.turn else
+             KIND_UP if s.climb > 0 else
+             KIND_DOWN if s.climb < 0 else KIND_FLAT, s.climb)
+            for s in catalog.segments if s.counter == counter}
+        if len(used) > 1 or any(k == KIND_TURN and c for k, c in used):
+            return None
+        kinds.append(used.pop()[0] if used else KIND_FLAT)
+    return kinds
+
+
+def transitions(catalog, backward=False):
+    """Flat table of changes of states indexed by angle and segment.
+
+    Rows have 6 + MAX_COUNTERS numbers: shift, change of angle, change of
+    level and changes of the material counters. The backward table is
+    indexed by the angle after the segment.
+    """
+    rows = [shifts(s) for s in catalog.segments]
+    padding = (MAX_COUNTERS - len(catalog.counters)) * (0,)
+    table = []
+    for angle in range(8):
+        for i, s in enumerate(catalog.segments):
+            start = (angle - s.turn) % 8 if backward else angle
+            table.extend(rows[i][start])
+            table.extend((s.turn, s.climb))
+            table.extend(-(s.counter == c) for c in catalog.counters)
+            table.extend(padding)
+    return table
+
+
+def pillar_changes(catalog):
+    """Changes of remaining pillars a*level + b, (a, b) for every segment
+    after another segment and after an uphill one."""
+    table = []
+    for s in catalog.segments:
+        for pillars in (s.pillars, s.after_up or s.pillars):
+            table.extend(-p for p in pillars)
+    return table
@@ -1,17 +1,30 @@
+import sys
 from distutils.core import setup, Extension
 from Cython.Build import cythonize
 
+if sys.platform == "darwin":
+    # OpenMP runtime for Apple clang has to be installed separately
+    # e.g. brew install libomp
+    compile_args = ["-std=c++11", "-stdlib=libc++", "-mmacosx-version-min=10.9",
+                    "-Xpreprocessor", "-fopenmp"]
+    link_args = ["-std=c++11", "-mmacosx-version-min=10.9", "-lomp"]
+else:
+    compile_args = ["-std=c++11", "-fopenmp"]
+    link_args = ["-fopenmp"]
+
 ext_module = Extension(
     "dynamic",
     ["dynamic.pyx"],
+    depends=["state.hpp", "state_set.hpp", "layer_file.hpp", "reach_table.hpp"],
     language="c++",
-    extra_compile_args=["-std=c++11", "-stdlib=libc++", "-mmacosx-version-min=10.9"],
-    extra_link_args=["-std=c++11", "-mmacosx-version-min=10.9"]
+    extra_compile_args=compile_args,
+    extra_link_args=link_args,
 ) 
 
 setup(
   name = 'Lillabo track solver',
-  scripts = ['solver.py', 'track.py', 'collision.py'],
+  scripts = ['solver.py', 'track.py', 'collision.py', 'cache.py',
+             'checkpoint.py', 'search_local.py', 'segments.py'],
   ext_modules = cythonize(ext_module),
   data_files = ('data', ['data/*']),
 )
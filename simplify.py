@@ -6,6 +6,9 @@ e.g. RRRRSRRRRS, RRRRRRRR -> RRRRRRRR
 """
 
 import argparse
+import collections
+import itertools
+import multiprocessing
 import sys
 
 import track
@@ -22,23 +25,117 @@ Extend round track in the opposite direction with S, RL, LR.
 Prolong bridges. Replace uphill, downhill with straight segments.
 """
 
+# number of tracks sent to a worker at once
+CHUNK_SIZE = 1 << 10
 
-def can_be_simplified(t, set_of_tracks):
-    return any(st in set_of_tracks for st in t.simplify())
+# Canonical paths are kept as integers, segments are octal digits.
+_TO_DIGITS = str.maketrans('SUDRL', '12345')
+_TO_SEGMENTS = str.maketrans('12345', 'SUDRL')
+
+
+def encode(path):
+    return int(path.translate(_TO_DIGITS), 8)
+
+
+def decode(code):
+    return format(code, 'o').translate(_TO_SEGMENTS)
+
+
+def _canonical(paths):
+    if track.canonical_paths is None:
+        return [track.canonical_path(p) for p in paths]
+    return track.canonical_paths(paths)
+
+
+def _normalize_chunk(lines):
+    paths = [line.strip() for line in lines]
+    return [encode(p) for p in _canonical([p for p in paths if p])]
+
+
+def _simplify_chunk(codes):
+    # Codes of the tracks one simplification shorter than the tracks.
+    paths = [decode(code) for code in codes]
+    geometry = track.batch_geometry(paths)
+    children = []
+    for i, path in enumerate(paths):
+        t = track.Track.from_geometry(path, geometry, i)
+        children.append(list(dict.fromkeys(t._simplify())))
+    canonical = iter(_canonical([p for c in children for p in c]))
+    result = []
+    for code, c in zip(codes, children):
+        shorter = {encode(p) for p in itertools.islice(canonical, len(c))}
+        shorter.discard(code)
+        result.append((code, sorted(shorter)))
+    return result
+
+
+def _chunks(items):
+    items = iter(items)
+    return iter(lambda: list(itertools.islice(items, CHUNK_SIZE)), [])
+
+
+def simplify_index(codes, map_chunks=map):
+    """Return shorter tracks of every track and of all their descendants.
+
+    Only descendants which are not among codes are simplified further,
+    the others are known to be present.
+    """
+    index = {}
+    frontier = list(codes)
+    while frontier:
+        new = {}
+        for chunk in map_chunks(_simplify_chunk, _chunks(frontier)):
+            for code, children in chunk:
+                index[code] = children
+                for child in children:
+                    if child not in codes and child not in index:
+                        new[child] = None
+        frontier = list(new)
+    return index
+
+
+def reduce_tracks(codes, index):
+    """Return codes which can't be built by extending another one.
+
+    A track can be built from a present track if it is reachable by a chain
+    of simplifications, the tracks in between don't have to be present.
+    """
+    parents = collections.defaultdict(list)
+    for code, children in index.items():
+        for child in children:
+            parents[child].append(code)
+    # tracks which are present or can be simplified to a present one
+    reaches = set(codes)
+    stack = list(codes)
+    while stack:
+        for parent in parents[stack.pop()]:
+            if parent not in reaches:
+                reaches.add(parent)
+                stack.append(parent)
+    return [c for c in codes if not any(ch in reaches for ch in index[c])]
+
+
+def _simplify(map_chunks):
+    codes = {}
+    for chunk in map_chunks(_normalize_chunk, _chunks(sys.stdin)):
+        codes.update(dict.fromkeys(chunk))
+    index = simplify_index(codes, map_chunks)
+    for code in reduce_tracks(codes, index):
+        print(decode(code))
 
 
 def main():
-    # TODO: algorithm expects that the shorten piece is also present in the set.
-    # remove this condition.
     parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '--jobs',
+        dest='jobs', type=int, default=1,
+        help='number of processes simplifying the tracks')
     args = parser.parse_args()
-    tracks = set()
-    for line in sys.stdin:
-        path = line.strip()
-        tracks.add(track.Track(path).normalize())
-    tracks = [t for t in tracks if not can_be_simplified(t, tracks)]
-    for t in tracks:
-        print(t.path)
+    if args.jobs > 1:
+        with multiprocessing.Pool(args.jobs) as pool:
+            _simplify(pool.imap)
+    else:
+        _simplify(map)
 
 
 if __name__ == '__main__':
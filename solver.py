@@ -2,8 +2,17 @@
 
 import argparse
 import collections
+import concurrent.futures
+import csv
+import itertools
+import os
+import sys
+import time
 
+import cache
+import checkpoint
 import dynamic
+import segments
 import track
 
 
@@ -11,33 +20,421 @@ Material = collections.namedtuple(
     'Material', 'straight turns ups, downs pillars')
 
 
-def normalize_paths(paths):
-    filtered = []
-    paths = set(paths)
-    while paths:
-        path = paths.pop()
-        min_path = path
-        for symetric_path in track.all_symetries(path):
-            paths.discard(symetric_path)
-            if symetric_path < min_path:
-                min_path = symetric_path
-        filtered.append(min_path)
-    return filtered
+def normalize_paths(paths, catalog=None):
+    return list(dict.fromkeys(dynamic.canonical_paths(paths, catalog)))
 
 
-def compute_tracks(material):
-    paths = dynamic.find_all_paths(material)
-    paths = normalize_paths(paths)
-    tracks = [track.Track(p) for p in paths]
-    tracks = [t for t in tracks if t.is_valid(material)]
-    return tracks
+_digits = {}
+
+
+def _path_keys(paths, catalog=None):
+    """Return integers which tell the paths apart exactly.
+
+    A path is read as a number with a digit of every segment, the integers
+    take about half the memory of the strings.
+    """
+    names = ''.join(s.name for s in (catalog or segments.BASIC).segments)
+    if names not in _digits:
+        # no segment is 0, so that leading segments aren't lost, the empty
+        # path is 0
+        _digits[names] = (
+            8 if len(names) < 8 else 16,
+            str.maketrans(names, '123456789abcdef'[:len(names)]))
+    base, table = _digits[names]
+    return [int(p.translate(table) or '0', base) for p in paths]
+
+
+SEARCH_MODES = {
+    'bfs': dynamic.iter_paths,
+    'mitm': dynamic.iter_paths_mitm,
+    'external': dynamic.iter_paths_external,
+}
+
+
+# number of paths normalized at once, symmetric paths are often found
+# close to each other
+CHUNK_SIZE = 1 << 16
+
+# counters of the walk back are printed at most once in this many seconds
+PROGRESS_INTERVAL = 1.0
+
+
+def _format_counts(counts):
+    return ' '.join('%s=%d' % item for item in counts.items())
+
+
+def format_stats(stats):
+    """Return a line describing LayerStats or WalkStats of the search."""
+    if isinstance(stats, dynamic.LayerStats):
+        line = '%s layer %d: frontier %d, visited %d, generated %d, pruned %s' % (
+            stats.search, stats.layer, stats.frontier, stats.visited,
+            stats.generated, _format_counts(stats.pruned))
+        if stats.load_factor is not None:
+            line += ', load %.2f, probes %.2f' % (
+                stats.load_factor, stats.probe_length)
+        return line
+    return 'walk: %d keys, %d paths, pruned %s, prefixes %s' % (
+        stats.keys, stats.paths, _format_counts(stats.pruned),
+        ' '.join(map(str, stats.prefixes)))
+
+
+class Progress:
+    """Print counters of the search as they come.
+
+    Every layer is printed, the walk back at most once in interval seconds
+    and at close.
+    """
+
+    def __init__(self, file=sys.stderr, interval=PROGRESS_INTERVAL):
+        self.file = file
+        self.interval = interval
+        self.start = time.monotonic()
+        self.printed = None
+        self.walk = None
+
+    def __call__(self, stats):
+        now = time.monotonic()
+        if isinstance(stats, dynamic.WalkStats):
+            self.walk = stats
+            if self.printed is not None and now - self.printed < self.interval:
+                return
+            self.walk = None
+        self.printed = now
+        self._print(stats, now)
+
+    def close(self):
+        if self.walk is not None:
+            self._print(self.walk, time.monotonic())
+            self.walk = None
+
+    def _print(self, stats, now):
+        print('%8.1fs %s' % (now - self.start, format_stats(stats)),
+              file=self.file, flush=True)
+
+
+def iter_tracks(material, mode='bfs', jobs=1, checkpoint=None, on_stats=None,
+                catalog=None):
+    """Yield valid tracks as soon as the search finds them.
+
+    Only integer keys of the tracks found so far are kept in memory.
+    If checkpoint is given, the search continues from it and appends its
+    progress to it. on_stats gets counters of the search, see
+    dynamic.Search. The tracks are built from the segments of the catalog,
+    by default segments.BASIC, the material has its counters.
+    """
+    if checkpoint is not None:
+        if mode != 'bfs':
+            raise ValueError('Only bfs search can be resumed.')
+        return _iter_checkpointed_tracks(
+            material, jobs, checkpoint, on_stats, catalog)
+    return _iter_tracks(material, mode, jobs, on_stats, catalog)
+
+
+def _iter_tracks(material, mode, jobs, on_stats=None, catalog=None):
+    # keys of the valid paths yielded so far, a path which isn't valid is
+    # checked again if it's found again
+    seen = set()
+    # the search skips rotations and mirror images of found paths,
+    # reversed paths still have to be deduplicated here
+    paths = SEARCH_MODES[mode](
+        material, jobs=jobs, canonical=True, prune_collisions=True,
+        on_stats=on_stats, catalog=catalog)
+    while True:
+        chunk = list(itertools.islice(paths, CHUNK_SIZE))
+        if not chunk:
+            break
+        normalized = normalize_paths(chunk, catalog)
+        new_paths = [
+            p for p, k in zip(normalized, _path_keys(normalized, catalog))
+            if k not in seen]
+        # Collisions don't depend on the symmetry, the search pruned them.
+        # Pillars were counted by the search too, but the normalized path
+        # is reversed without swapping ups and downs, so it needs its own.
+        tracks = track.valid_tracks(
+            new_paths, material, check_collisions=False, catalog=catalog)
+        seen.update(_path_keys([t.path for t in tracks], catalog))
+        yield from tracks
+
+
+def _iter_checkpointed_tracks(material, jobs, checkpoint, on_stats=None,
+                              catalog=None):
+    # Yields the same tracks in the same order as _iter_tracks, the paths
+    # found from every closed state are written at once.
+    search = dynamic.Search(
+        material, jobs, layers=checkpoint.layers, on_layer=checkpoint.add_layer,
+        on_stats=on_stats, catalog=catalog)
+    checkpoint.release_layers()
+    seen = set()
+    for paths in checkpoint.paths:
+        seen.update(_path_keys(paths, catalog))
+        for path in paths:
+            yield track.Track(path, catalog)
+    for key in search.closed_keys()[len(checkpoint.paths):]:
+        paths = search.iter_paths(
+            canonical=True, prune_collisions=True, keys=[key])
+        normalized = normalize_paths(paths, catalog)
+        new_paths = [
+            p for p, k in zip(normalized, _path_keys(normalized, catalog))
+            if k not in seen]
+        tracks = track.valid_tracks(
+            new_paths, material, check_collisions=False, catalog=catalog)
+        checkpoint.add_paths([t.path for t in tracks])
+        seen.update(_path_keys([t.path for t in tracks], catalog))
+        yield from tracks
+
+
+def compute_tracks(material, mode='bfs', jobs=1, catalog=None):
+    return list(iter_tracks(material, mode, jobs, catalog=catalog))
+
+
+# rough bytes of memory per state of the search kept in memory, in the
+# visited set and with its count of paths, and of the tracks validated at
+# once, which grow with the states
+STATE_BYTES = 48
+TRACK_BYTES = 352
+# buffers of the expansion of every job
+JOB_BYTES = 8 << 20
+BASE_MEMORY = 64 << 20
+
+# Result of a material of the batch, paths are None if they were written
+# to a file, error is the message if the material couldn't be searched.
+BatchResult = collections.namedtuple(
+    'BatchResult', 'material paths count seconds cached error')
+
+
+def material_name(material):
+    return 's%d-t%d-u%d-d%d-p%d' % material
+
+
+def estimate_memory(material, mode='bfs', jobs=1):
+    """Return a rough estimate of the memory of the search in bytes.
+
+    The number of states grows about 1.6 times with every piece and with
+    the number of combinations of uphill and downhill pieces. The external
+    mode keeps only runs of dynamic.RUN_SIZE new keys in memory, but the
+    tracks take the same memory in every mode.
+    """
+    pieces = material.straight + material.turns + material.ups + material.downs
+    states = 2 * 1.6 ** pieces * (material.ups + 1) * (material.downs + 1)
+    keys = STATE_BYTES * states
+    if mode == 'external':
+        # a run and the vector it grows from
+        keys = min(keys, 16 * dynamic.RUN_SIZE)
+    return int(BASE_MEMORY + JOB_BYTES * jobs + keys + TRACK_BYTES * states)
+
+
+def read_materials(lines, default):
+    """Return materials from CSV lines with a header of Material fields.
+
+    Columns which are missing or empty are taken from default.
+    """
+    reader = csv.DictReader(lines)
+    fields = [f.strip() for f in reader.fieldnames or ()]
+    unknown = [f for f in fields if f not in Material._fields]
+    if unknown:
+        raise ValueError('Unknown columns %s.' % ', '.join(unknown))
+    materials = []
+    for row in reader:
+        values = {}
+        for field, value in zip(fields, row.values()):
+            if value is not None and value.strip():
+                try:
+                    values[field] = int(value)
+                except ValueError:
+                    raise ValueError('Invalid %s on line %d.' % (
+                        field, reader.line_num))
+        materials.append(default._replace(**values))
+    return materials
+
+
+def _message(error):
+    return str(error) or type(error).__name__
+
+
+def _solve(material, mode, jobs, use_cache, cache_size, filename):
+    # Runs in a worker of the batch. Tracks are written to filename as
+    # they are found, it appears when it is complete.
+    start = time.monotonic()
+    try:
+        paths = cache.load(material) if use_cache else None
+        cached = paths is not None
+        if not cached:
+            paths = [t.path for t in iter_tracks(material, mode, jobs)]
+            if use_cache:
+                cache.store(material, paths, max_size=cache_size)
+    except Exception as e:
+        return BatchResult(
+            material, None, 0, time.monotonic() - start, False, _message(e))
+    count = len(paths)
+    if filename is not None:
+        with open(filename + '.tmp', 'w') as f:
+            for path in paths:
+                f.write(path + '\n')
+        os.replace(filename + '.tmp', filename)
+        paths = None
+    return BatchResult(
+        material, paths, count, time.monotonic() - start, cached, None)
+
+
+def iter_batch(materials, processes=1, memory=None, mode='bfs', jobs=1,
+               use_cache=True, directory=None, cache_size=cache.MAX_SIZE):
+    """Yield BatchResult of every material as its search finishes.
+
+    Materials are started in processes from the largest one by
+    estimate_memory of the mode and jobs, the smaller ones fill the rest
+    of the memory. A material starts only if the estimates of the running
+    ones fit into memory bytes, one larger than memory runs alone. If directory is
+    given, tracks of a material are written to a file named by
+    material_name in it. Found tracks are cached in at most cache_size
+    bytes.
+
+    A search which fails or whose worker crashes gives a result with an
+    error, the others go on. Materials running when a worker crashed are
+    searched again one by one, as the crashed one is not known.
+    """
+    estimates = {m: estimate_memory(m, mode, jobs) for m in materials}
+    pending = sorted(estimates, key=estimates.get, reverse=True)
+    # materials whose worker crashed while others ran, they are tried
+    # once more alone
+    alone = set()
+    # future: material, estimate, start
+    running = {}
+    executor = concurrent.futures.ProcessPoolExecutor(processes)
+    try:
+        while pending or running:
+            used = sum(needed for _, needed, _ in running.values())
+            for material in list(pending):
+                if len(running) >= processes or any(
+                        m in alone for m, _, _ in running.values()):
+                    break
+                needed = estimates[material]
+                if running and (material in alone or (
+                        memory is not None and used + needed > memory)):
+                    continue
+                filename = None
+                if directory is not None:
+                    filename = os.path.join(
+                        directory, material_name(material) + '.txt')
+                future = executor.submit(
+                    _solve, material, mode, jobs, use_cache, cache_size,
+                    filename)
+                running[future] = material, needed, time.monotonic()
+                used += needed
+                pending.remove(material)
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            if any(_crashed(future) for future in done):
+                # a dead worker breaks the pool and all running searches,
+                # it is replaced by a new one
+                done, _ = concurrent.futures.wait(running)
+                executor.shutdown()
+                executor = concurrent.futures.ProcessPoolExecutor(processes)
+            for future in done:
+                material, _, start = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if _crashed(future) and material not in alone:
+                        alone.add(material)
+                        pending.append(material)
+                        continue
+                    if _crashed(future):
+                        message = 'The worker searching it crashed.'
+                    else:
+                        message = _message(e)
+                    result = BatchResult(
+                        material, None, 0, time.monotonic() - start, False,
+                        message)
+                yield result
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _crashed(future):
+    return isinstance(
+        future.exception(), concurrent.futures.BrokenExecutor)
+
+
+def _physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def run_batch(args, default):
+    try:
+        with open(args.batch, newline='') as f:
+            materials = read_materials(f, default)
+    except ValueError as e:
+        sys.exit('%s: %s' % (args.batch, e))
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    memory = args.memory << 20 if args.memory else None
+    start = time.monotonic()
+    failed = 0
+    for result in iter_batch(
+            materials, args.processes, memory, args.mode, args.jobs,
+            args.cache, args.output_dir, args.cache_size << 20):
+        name = material_name(result.material)
+        for path in result.paths or ():
+            print('%s\t%s' % (name, path))
+        sys.stdout.flush()
+        if result.error is not None:
+            failed += 1
+            print('%s failed in %.1f s: %s' % (
+                name, result.seconds, result.error), file=sys.stderr)
+        else:
+            print('%s %d tracks in %.1f s%s' % (
+                name, result.count, result.seconds,
+                ' (cached)' if result.cached else ''), file=sys.stderr)
+    print('%d materials in %.1f s' % (
+        len(set(materials)), time.monotonic() - start), file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def catalog_material(catalog, default, counts=()):
+    """Return the material of the catalog.
+
+    Counters are given by counts, strings NAME=N, or taken from default
+    if it has a field of the same name.
+    """
+    values = {'pillars': default.pillars}
+    for counter in catalog.counters:
+        if counter in default._fields:
+            values[counter] = getattr(default, counter)
+    for item in counts:
+        name, _, value = item.partition('=')
+        if name not in catalog.counters:
+            raise ValueError('Unknown material %r.' % name)
+        try:
+            values[name] = int(value)
+        except ValueError:
+            raise ValueError('Invalid number of %s.' % name)
+    missing = [c for c in catalog.counters if c not in values]
+    if missing:
+        raise ValueError('Missing number of %s.' % ', '.join(missing))
+    return segments.material_type(catalog)(**values)
 
 
 DESCRIPTION = """\
 Write out all enclosed path with given set of elements.
 Each path is written on a new line.
 Elements: S - straight segment, U - uphill segment, D - downhill segment,
-R - turn right, L - turn left\
+R - turn right, L - turn left
+
+With --catalog, pieces are read from a JSON file, see segments.py, the
+options give pieces of its materials of the same names and --count the
+others, e.g. --count short_turns=4.
+
+With --batch, tracks of every material of a CSV file are searched, e.g.
+  turns,straight,ups,downs,pillars
+  12,4,2,2,4
+  14,4,0,0,0
+Missing columns are taken from the options. Every track is written with
+the name of its material, s4-t12-u2-d2-p4, and a tab before it, or to
+a file of the material with --output-dir.\
 """
 
 
@@ -59,17 +456,135 @@ def main():
     parser.add_argument(
         '--pillars',
         dest='pillars', type=int, default=4, help='number of pillars')
+    parser.add_argument(
+        '--catalog',
+        dest='catalog', metavar='FILE',
+        help='read the pieces from a JSON file instead of the basic ones')
+    parser.add_argument(
+        '--count',
+        dest='counts', metavar='NAME=N', action='append', default=[],
+        help='number of pieces of a material of the catalog')
+    parser.add_argument(
+        '--mode',
+        dest='mode', choices=sorted(SEARCH_MODES), default='bfs',
+        help='search all states at once (bfs), meet in the middle (mitm) '
+             'or keep the states on disk (external)')
+    parser.add_argument(
+        '--jobs',
+        dest='jobs', type=int, default=1,
+        help='number of threads expanding the search')
+    parser.add_argument(
+        '--checkpoint',
+        dest='checkpoint', metavar='FILE',
+        help='write progress of the bfs search to the file')
+    parser.add_argument(
+        '--resume',
+        dest='resume', action='store_true',
+        help='continue the search from the checkpoint')
+    parser.add_argument(
+        '--force',
+        dest='force', action='store_true',
+        help='overwrite an existing checkpoint instead of resuming it')
+    parser.add_argument(
+        '--no-cache',
+        dest='cache', action='store_false',
+        help='search again even if the tracks are cached, the search '
+             'runs always with --checkpoint or --progress')
+    parser.add_argument(
+        '--cache-size',
+        dest='cache_size', type=int, metavar='MB',
+        default=cache.MAX_SIZE >> 20,
+        help='size of the cache of found tracks, tracks which don\'t fit '
+             'into it are not cached')
+    parser.add_argument(
+        '--progress',
+        dest='progress', action='store_true',
+        help='print counters of the search to standard error')
+    parser.add_argument(
+        '--batch',
+        dest='batch', metavar='FILE',
+        help='search all materials of the CSV file')
+    parser.add_argument(
+        '--processes',
+        dest='processes', type=int, default=os.cpu_count() or 1,
+        help='number of materials of the batch searched at once')
+    parser.add_argument(
+        '--memory',
+        dest='memory', type=int, metavar='MB',
+        default=(_physical_memory() or 0) * 3 // 4 >> 20,
+        help='memory for the searches of the batch running at once, '
+             'by default 3/4 of the physical memory, 0 is unlimited')
+    parser.add_argument(
+        '--output-dir',
+        dest='output_dir', metavar='DIR',
+        help='write tracks of every material of the batch to a file in DIR')
     args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+    if args.force and not args.checkpoint:
+        parser.error('--force requires --checkpoint')
+    if args.checkpoint and args.mode != 'bfs':
+        parser.error('--checkpoint works only with --mode=bfs')
+    if args.batch and (args.checkpoint or args.progress):
+        parser.error('--batch works without --checkpoint and --progress')
+    if args.processes < 1:
+        parser.error('--processes must be positive')
+    if args.cache_size < 0:
+        parser.error('--cache-size must not be negative')
+    if args.batch and args.catalog:
+        parser.error('--batch works only with the basic pieces')
+    catalog = None
     material = Material(
         turns=args.turns,
         straight=args.straight,
         ups=args.ups,
         downs=args.downs,
         pillars=args.pillars)
+    if args.catalog:
+        try:
+            catalog = segments.load(args.catalog)
+            material = catalog_material(catalog, material, args.counts)
+        except (OSError, TypeError, ValueError) as e:
+            parser.error('%s: %s' % (args.catalog, e))
+    elif args.counts:
+        parser.error('--count requires --catalog')
+    if args.batch:
+        run_batch(args, material)
+        return
 
-    tracks = compute_tracks(material)
-    for t in tracks:
-        print(t.path)
+    # the cached tracks are printed without a search, which couldn't
+    # write a checkpoint or counters
+    searched = args.checkpoint or args.progress
+    paths = None
+    if args.cache and not searched:
+        paths = cache.load(material, catalog=catalog)
+    if paths is not None:
+        for path in paths:
+            print(path)
+        return
+    ckpt = None
+    if args.checkpoint:
+        try:
+            ckpt = checkpoint.Checkpoint(
+                args.checkpoint, material, args.resume, catalog, args.force)
+        except (OSError, ValueError) as e:
+            sys.exit(str(e))
+    writer = None
+    if args.cache:
+        writer = cache.Writer(
+            material, max_size=args.cache_size << 20, catalog=catalog)
+    progress = Progress() if args.progress else None
+    for t in iter_tracks(
+            material, args.mode, args.jobs, ckpt, progress, catalog):
+        print(t.path, flush=True)
+        if writer is not None:
+            writer.add(t.path)
+    if ckpt is not None:
+        ckpt.close()
+    if progress is not None:
+        progress.close()
+    if writer is not None:
+        writer.close()
 
 
 if __name__ == '__main__':
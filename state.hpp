@@ -1,63 +1,150 @@
 /** One point in the state space **/
 #include <stdlib.h>
-#include <functional>
+#include <stdint.h>
+
+// material counters of a catalog, the same as segments.MAX_COUNTERS
+#define MAX_COUNTERS 8
 
 struct State {
     int ax, bx, ay, by, angle, level;
-    int straight, turns, ups, downs, pillars;
-    int distance_from_origin() const;
-    int available_distance() const;
+    // remaining pieces of the material counters of the catalog, the
+    // counters after those of the catalog stay 0
+    int counts[MAX_COUNTERS];
+    int pillars;
+    // 1 if the last segment was uphill, the next downhill needs less pillars
+    int up;
     bool operator==(const State &o) const;
     State(): ax(0), bx(0), ay(0), by(0), angle(0), level(0),
-          straight(0), turns(0), ups(0), downs(0), pillars(0) {};
+          pillars(0), up(0) {
+        for (int i = 0; i < MAX_COUNTERS; i++) counts[i] = 0;
+    };
     State(int ax, int bx, int ay, int by, int angle, int level,
-          int straight, int turns, int ups, int downs, int pillars) :
+          int pillars = 0, int up = 0) :
           ax(ax), bx(bx), ay(ay), by(by), angle(angle), level(level),
-          straight(straight), turns(turns), ups(ups), downs(downs),
-          pillars(pillars) {};
+          pillars(pillars), up(up) {
+        for (int i = 0; i < MAX_COUNTERS; i++) counts[i] = 0;
+    };
 };
 
-namespace std {
-    template <>
-    struct hash<State> {
-        std::size_t operator()(const State& k) const {
-            using std::size_t;
-            using std::hash;
-
-            int pos = \
-                k.ax ^ (k.bx << 4) ^ (k.ay << 8) ^ (k.by << 12) ^
-                (k.angle << 16) ^ (k.level << 20);
-            int mat = k.straight ^ (k.turns << 6) ^ (k.ups << 12) ^
-                (k.downs << 16) ^ (k.pillars << 20);
-
-            // taken from
-            // http://www.boost.org/doc/libs/1_35_0/doc/html/boost/hash_combine_id241013.html 
-            int seed = pos;
-            seed ^= mat + 0x9e3779b9 + (seed << 6) + (seed >> 2);
-            return seed;
-        };
+/** Packs State into one 64-bit key. Every field is offset by its lower
+    bound and stored in as many bits as its range requires. Fields are
+    the coordinates, angle, level, the MAX_COUNTERS counters, pillars and
+    up. Counters after those of the catalog are always 0 and take no
+    bits, so that all states are packed by the same loops. **/
+struct StatePacker {
+    static const int FIELDS = 8 + MAX_COUNTERS;
+    int low[FIELDS], high[FIELDS], shift[FIELDS];
+    uint64_t mask[FIELDS];
+    int counters, bits;
+    StatePacker(): counters(0), bits(0) {};
+    /** distance bounds the coordinates, level the height and counts the
+        counters of the catalog. **/
+    StatePacker(int distance, int level, int counters, const int *counts,
+                int pillars, int up);
+    bool contains(const State &s) const;
+    /** Packs a state whose counters after the first COUNTERS ones are 0,
+        the loops of a fixed length are unrolled by the compiler. **/
+    template <int COUNTERS> uint64_t pack_first(const State &s) const;
+    template <int COUNTERS> State unpack_first(uint64_t key) const;
+    uint64_t pack(const State &s) const {
+        return pack_first<MAX_COUNTERS>(s);
     };
+    State unpack(uint64_t key) const {
+        return unpack_first<MAX_COUNTERS>(key);
+    };
+    // the four counters of the basic pieces
+    uint64_t pack_basic(const State &s) const { return pack_first<4>(s); };
+    State unpack_basic(uint64_t key) const { return unpack_first<4>(key); };
+};
+
+inline void state_fields(const State &s, int *f) {
+    f[0] = s.ax; f[1] = s.bx; f[2] = s.ay; f[3] = s.by;
+    f[4] = s.angle; f[5] = s.level;
+    for (int i = 0; i < MAX_COUNTERS; i++) {
+        f[6 + i] = s.counts[i];
+    }
+    f[6 + MAX_COUNTERS] = s.pillars;
+    f[7 + MAX_COUNTERS] = s.up;
+}
+
+StatePacker::StatePacker(int distance, int level, int counters,
+                         const int *counts, int pillars, int up) {
+    int highs[FIELDS] = {distance, distance, distance, distance, 7, level};
+    for (int i = 0; i < counters; i++) {
+        highs[6 + i] = counts[i];
+    }
+    highs[6 + MAX_COUNTERS] = pillars;
+    highs[7 + MAX_COUNTERS] = up;
+    this->counters = counters;
+    bits = 0;
+    for (int i = 0; i < FIELDS; i++) {
+        low[i] = i < 4 ? -distance : 0;
+        high[i] = highs[i];
+        shift[i] = bits;
+        while (((high[i] - low[i]) >> (bits - shift[i])) > 0) {
+            bits++;
+        }
+        mask[i] = (((uint64_t)1) << (bits - shift[i])) - 1;
+    }
+}
+
+inline bool StatePacker::contains(const State &s) const {
+    int f[FIELDS];
+    state_fields(s, f);
+    for (int i = 0; i < FIELDS; i++) {
+        if (f[i] < low[i] || f[i] > high[i]) {
+            return false;
+        }
+    }
+    return true;
 }
 
-int State::distance_from_origin() const {
-    int astraight = abs(straight);
-    int aturns = abs(turns);
-    int aups = abs(ups);
-    int adowns = abs(downs);
-    int apillars = abs(pillars);
-    int a1 = astraight > aturns ? astraight: aturns;
-    int a2 = aups > adowns ? aups: adowns;
-    int a3 = a1 > a2 ? a1: a2;
-    return apillars > a3 ? apillars: a3;
+template <int COUNTERS>
+inline uint64_t StatePacker::pack_first(const State &s) const {
+    const int P = 6 + MAX_COUNTERS;
+    uint64_t key =
+        (uint64_t)(s.ax - low[0]) << shift[0] |
+        (uint64_t)(s.bx - low[1]) << shift[1] |
+        (uint64_t)(s.ay - low[2]) << shift[2] |
+        (uint64_t)(s.by - low[3]) << shift[3] |
+        (uint64_t)s.angle << shift[4] |
+        (uint64_t)s.level << shift[5] |
+        (uint64_t)s.pillars << shift[P] |
+        (uint64_t)s.up << shift[P + 1];
+    for (int i = 0; i < COUNTERS; i++) {
+        key |= (uint64_t)s.counts[i] << shift[6 + i];
+    }
+    return key;
 }
 
-int State::available_distance() const {
-    return straight + turns + ups + downs;
+template <int COUNTERS>
+inline State StatePacker::unpack_first(uint64_t key) const {
+    const int P = 6 + MAX_COUNTERS;
+    State s(
+        (int)((key >> shift[0]) & mask[0]) + low[0],
+        (int)((key >> shift[1]) & mask[1]) + low[1],
+        (int)((key >> shift[2]) & mask[2]) + low[2],
+        (int)((key >> shift[3]) & mask[3]) + low[3],
+        (int)((key >> shift[4]) & mask[4]),
+        (int)((key >> shift[5]) & mask[5]),
+        (int)((key >> shift[P]) & mask[P]),
+        (int)((key >> shift[P + 1]) & mask[P + 1]));
+    for (int i = 0; i < COUNTERS; i++) {
+        s.counts[i] = (int)((key >> shift[6 + i]) & mask[6 + i]);
+    }
+    return s;
 }
 
 bool State::operator==(const State& o) const {
-    return ax == o.ax && bx == o.bx && ay == o.ay && by == o.by &&
-        angle == o.angle && level == o.level && straight == o.straight &&
-        turns == o.turns && ups == o.ups && downs == o.downs &&
-        pillars == o.pillars;
+    if (!(ax == o.ax && bx == o.bx && ay == o.ay && by == o.by &&
+          angle == o.angle && level == o.level && pillars == o.pillars &&
+          up == o.up)) {
+        return false;
+    }
+    for (int i = 0; i < MAX_COUNTERS; i++) {
+        if (counts[i] != o.counts[i]) {
+            return false;
+        }
+    }
+    return true;
 }
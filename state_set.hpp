@@ -0,0 +1,138 @@
+/** Set of packed states stored in a flat open addressing table **/
+#include <stdint.h>
+#include <stddef.h>
+#include <vector>
+
+class StateSet {
+    public:
+        static const uint64_t EMPTY = ~(uint64_t)0;
+
+        StateSet(): keys(16, EMPTY), count(0), steps(0) {};
+        bool insert(uint64_t key);
+        bool contains(uint64_t key) const { return find(key) != keys.size(); };
+        size_t find(uint64_t key) const;
+        size_t size() const { return count; };
+        size_t capacity() const { return keys.size(); };
+        uint64_t slot(size_t i) const { return keys[i]; };
+        /** Number of occupied slots passed by all inserts so far. **/
+        size_t probes() const { return steps; };
+        void clear();
+        static uint64_t mix(uint64_t key);
+
+    private:
+        std::vector<uint64_t> keys;
+        size_t count;
+        size_t steps;
+
+        void grow();
+};
+
+// finalizer of splitmix64, it spreads nearby keys over the whole table
+inline uint64_t StateSet::mix(uint64_t key) {
+    key ^= key >> 30;
+    key *= 0xbf58476d1ce4e5b9ULL;
+    key ^= key >> 27;
+    key *= 0x94d049bb133111ebULL;
+    key ^= key >> 31;
+    return key;
+}
+
+/** Inserts the key, returns false if the key was already present. **/
+inline bool StateSet::insert(uint64_t key) {
+    if (2 * (count + 1) > keys.size()) {
+        grow();
+    }
+    size_t mask = keys.size() - 1;
+    size_t i = mix(key) & mask;
+    while (keys[i] != EMPTY) {
+        if (keys[i] == key) {
+            return false;
+        }
+        i = (i + 1) & mask;
+        steps++;
+    }
+    keys[i] = key;
+    count++;
+    return true;
+}
+
+/** Returns the slot of the key or capacity() if it's missing. **/
+inline size_t StateSet::find(uint64_t key) const {
+    size_t mask = keys.size() - 1;
+    size_t i = mix(key) & mask;
+    while (keys[i] != EMPTY) {
+        if (keys[i] == key) {
+            return i;
+        }
+        i = (i + 1) & mask;
+    }
+    return keys.size();
+}
+
+inline void StateSet::clear() {
+    std::vector<uint64_t>(16, EMPTY).swap(keys);
+    count = 0;
+    steps = 0;
+}
+
+inline void StateSet::grow() {
+    // moved keys don't count as probes
+    size_t probes = steps;
+    std::vector<uint64_t> old(2 * keys.size(), EMPTY);
+    old.swap(keys);
+    count = 0;
+    for (size_t i = 0; i < old.size(); i++) {
+        if (old[i] != EMPTY) {
+            insert(old[i]);
+        }
+    }
+    steps = probes;
+}
+
+
+/** StateSet split into shards by the top bits of the key hash. Every shard
+    can be filled by a different thread without locking. **/
+class ShardedStateSet {
+    public:
+        static const int SHARD_BITS = 6;
+        static const int SHARDS = 1 << SHARD_BITS;
+
+        static int shard_of(uint64_t key) {
+            return (int)(StateSet::mix(key) >> (64 - SHARD_BITS));
+        };
+        StateSet& shard(int i) { return shards[i]; };
+        bool insert(uint64_t key) { return shards[shard_of(key)].insert(key); };
+        bool contains(uint64_t key) const {
+            return shards[shard_of(key)].contains(key);
+        };
+        size_t size() const;
+        size_t capacity() const;
+        size_t probes() const;
+
+    private:
+        StateSet shards[SHARDS];
+};
+
+inline size_t ShardedStateSet::size() const {
+    size_t count = 0;
+    for (int i = 0; i < SHARDS; i++) {
+        count += shards[i].size();
+    }
+    return count;
+}
+
+inline size_t ShardedStateSet::capacity() const {
+    size_t slots = 0;
+    for (int i = 0; i < SHARDS; i++) {
+        slots += shards[i].capacity();
+    }
+    return slots;
+}
+
+inline size_t ShardedStateSet::probes() const {
+    size_t steps = 0;
+    for (int i = 0; i < SHARDS; i++) {
+        steps += shards[i].probes();
+    }
+    return steps;
+}
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import cache
+import segments
+import solver
+
+
+MATERIAL = solver.Material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+
+
+class TestEncoding(unittest.TestCase):
+    def test_round_trip(self):
+        paths = ['RRRRRRRR', 'LLSLLLLSLL', 'SUSDRRRRRRRR', '']
+        data = cache.encode_paths(paths)
+        self.assertEqual(cache.decode_paths(data), paths)
+        # 3 bits per segment
+        self.assertEqual(len(data), cache.HEADER.size + 4 * 5)
+
+    def test_empty(self):
+        self.assertEqual(cache.decode_paths(cache.encode_paths([])), [])
+
+    def test_unknown_segment(self):
+        with self.assertRaises(ValueError):
+            cache.encode_paths(['RRRRTRRRR'])
+
+    def test_catalog(self):
+        catalog = segments.Catalog(segments.BASIC.segments + (
+            segments.Segment('T', 'straight', (1, 1, 0, 0), 0, 0, (1, 0)),))
+        paths = ['RRRRTRRRRT', 'LLSLLLLSLL']
+        self.assertEqual(
+            cache.decode_paths(cache.encode_paths(paths, catalog), catalog),
+            paths)
+        self.assertNotEqual(
+            cache.cache_file(MATERIAL), cache.cache_file(MATERIAL, catalog=catalog))
+
+    def test_large_catalog(self):
+        # more than 7 segments take 4 bits
+        paths = ['RRRRHHRRRRHH', 'rrrrrrrr', 'SXLLLLLLXSRR']
+        data = cache.encode_paths(paths, segments.EXTENDED)
+        self.assertEqual(len(data), cache.HEADER.size + 3 * 6)
+        self.assertEqual(
+            cache.decode_paths(data, segments.EXTENDED), paths)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_store(self):
+        d = self.directory.name
+        self.assertIsNone(cache.load(MATERIAL, d))
+        cache.store(MATERIAL, ['RRRRRRRR'], d)
+        self.assertEqual(cache.load(MATERIAL, d), ['RRRRRRRR'])
+        self.assertIsNone(cache.load(MATERIAL._replace(pillars=4), d))
+
+    def test_writer(self):
+        d = self.directory.name
+        paths = ['RRRRRRRR', 'LLSLLLLSLL', 'SUSDRRRRRRRR', '', 'RRRRRRRR']
+        with mock.patch('cache.BLOCK_SIZE', 2):
+            writer = cache.Writer(MATERIAL, d)
+            for path in paths:
+                writer.add(path)
+            writer.close()
+        self.assertEqual(cache.load(MATERIAL, d), paths)
+        with open(cache.cache_file(MATERIAL, d), 'rb') as f:
+            self.assertEqual(f.read(), cache.encode_paths(paths))
+
+    def test_too_large(self):
+        d = self.directory.name
+        cache.store(MATERIAL, ['RRRRRRRR'], d)
+        with self.assertWarns(UserWarning):
+            stored = cache.store(MATERIAL._replace(pillars=4),
+                                 ['RRRRRRRR'] * 100, d, max_size=100)
+        self.assertFalse(stored)
+        self.assertEqual(len(os.listdir(d)), 1)
+        self.assertEqual(cache.load(MATERIAL, d), ['RRRRRRRR'])
+
+    def test_writer_unknown_segment(self):
+        d = self.directory.name
+        writer = cache.Writer(MATERIAL, d)
+        writer.add('RRRRTRRRR')
+        with self.assertRaises(ValueError):
+            writer.close()
+        self.assertEqual(os.listdir(d), [])
+
+    def test_evict_least_recently_used(self):
+        d = self.directory.name
+        materials = [MATERIAL._replace(pillars=i) for i in range(3)]
+        for i, m in enumerate(materials):
+            cache.store(m, ['RRRRRRRR'] * 100, d)
+            os.utime(cache.cache_file(m, d), (i, i))
+        cache.load(materials[0], d)
+        size = os.path.getsize(cache.cache_file(materials[0], d))
+        cache.evict(d, 2 * size)
+        self.assertIsNotNone(cache.load(materials[0], d))
+        self.assertIsNone(cache.load(materials[1], d))
+        self.assertIsNotNone(cache.load(materials[2], d))
+
+    def test_evict_removed_file(self):
+        d = self.directory.name
+        cache.store(MATERIAL, ['RRRRRRRR'], d)
+        gone = mock.Mock()
+        gone.name = 'gone.tracks'
+        gone.stat.side_effect = FileNotFoundError
+        entries = [gone] + list(os.scandir(d))
+        with mock.patch('os.scandir', return_value=entries):
+            cache.evict(d, 0)
+        self.assertIsNone(cache.load(MATERIAL, d))
+
+
+class TestVersion(unittest.TestCase):
+    def tearDown(self):
+        cache._version = None
+
+    def test_missing_source(self):
+        cache._version = None
+        with mock.patch.object(cache, 'SOURCES', ('missing.py',)):
+            with self.assertRaises(FileNotFoundError):
+                cache.solver_version()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import itertools
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import checkpoint
+import dynamic
+import solver
+
+
+MATERIAL = solver.Material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+
+
+def paths(tracks):
+    return [t.path for t in tracks]
+
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'checkpoint')
+        self.expected = paths(solver.iter_tracks(MATERIAL))
+
+    def resume(self):
+        with checkpoint.Checkpoint(self.filename, MATERIAL, resume=True) as c:
+            return paths(solver.iter_tracks(MATERIAL, checkpoint=c))
+
+    def test_forward(self):
+        with checkpoint.Checkpoint(self.filename, MATERIAL) as c:
+            dynamic.Search(MATERIAL, depth=5, on_layer=c.add_layer)
+        # the last record was written only partially
+        with open(self.filename, 'ab') as f:
+            f.write(checkpoint.RECORD.pack(b'L', 80) + bytes(16))
+        self.assertEqual(self.resume(), self.expected)
+
+    def test_backward(self):
+        with checkpoint.Checkpoint(self.filename, MATERIAL) as c:
+            tracks = solver.iter_tracks(MATERIAL, checkpoint=c)
+            self.assertEqual(
+                paths(itertools.islice(tracks, 20)), self.expected[:20])
+            tracks.close()
+        self.assertEqual(self.resume(), self.expected)
+
+    def test_layers_released(self):
+        with checkpoint.Checkpoint(self.filename, MATERIAL) as c:
+            dynamic.Search(MATERIAL, depth=5, on_layer=c.add_layer)
+        with checkpoint.Checkpoint(self.filename, MATERIAL, resume=True) as c:
+            self.assertEqual(
+                [type(layer) for layer in c.layers], [memoryview] * 5)
+            search = dynamic.Search(MATERIAL, depth=6, layers=c.layers)
+            self.assertEqual(c.layers, [None] * 5)
+            # fails if a view of the map is still exported
+            c.release_layers()
+        self.assertEqual(
+            len(search), len(dynamic.Search(MATERIAL, depth=6)))
+
+    def test_existing_file(self):
+        checkpoint.Checkpoint(self.filename, MATERIAL).close()
+        size = os.path.getsize(self.filename)
+        with checkpoint.Checkpoint(self.filename, MATERIAL, resume=True) as c:
+            c.add_layer(bytes(8))
+        with self.assertRaises(FileExistsError):
+            checkpoint.Checkpoint(self.filename, MATERIAL)
+        self.assertGreater(os.path.getsize(self.filename), size)
+        checkpoint.Checkpoint(self.filename, MATERIAL, force=True).close()
+        self.assertEqual(os.path.getsize(self.filename), size)
+
+    def test_other_material(self):
+        checkpoint.Checkpoint(self.filename, MATERIAL).close()
+        with self.assertRaises(ValueError):
+            checkpoint.Checkpoint(
+                self.filename, MATERIAL._replace(turns=12), resume=True)
+
+    def test_other_version(self):
+        checkpoint.Checkpoint(self.filename, MATERIAL).close()
+        with mock.patch('cache.solver_version', return_value='0' * 40):
+            with self.assertRaises(ValueError):
+                checkpoint.Checkpoint(self.filename, MATERIAL, resume=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,13 @@
+import collections
+import random
+import tempfile
 import unittest
 
+import collision
 import dynamic
+import segments
 import solver
+import track
 
 def material(straight=0, turns=0, ups=0, downs=0, pillars=0):
     return solver.Material(
@@ -39,6 +45,23 @@ class TestPosition(unittest.TestCase):
         self.assertIn((-1, 0, 0, 1, 1, 1), res)
         self.assertIn((0, 0, 0, 0, 0, 0), res)
 
+    def test_same_basis_as_track(self):
+        # the search and Track step by the shifts of the catalog
+        path = 'SRRSRRRRRR'
+        by_name = {s.name: s for s in segments.BASIC.segments}
+        position, angle = (0, 0, 0, 0), 0
+        expected = [(position, angle)]
+        for name in path:
+            shift = segments.shifts(by_name[name])[angle]
+            position = tuple(p + s for p, s in zip(position, shift))
+            angle = (angle + by_name[name].turn) % 8
+            expected.append((position, angle))
+        t = track.Track(path)
+        self.assertEqual(list(zip(t.lattice, t.angle)), expected)
+        res = dynamic.forward_search(material(straight=2, turns=8))
+        res = {(s[:4], s[4]) for s in res}
+        self.assertTrue(set(expected[:3]) <= res)
+
     def test_find_simple(self):
         mat = material(turns=8)
         res = dynamic.find_all_paths(mat)
@@ -50,6 +73,352 @@ class TestPosition(unittest.TestCase):
         res = dynamic.find_all_paths(mat)
         self.assertIn('LLRRRRRRRRLLLLLL', res)
 
+    def test_iter_paths_driving_order(self):
+        mat = material(straight=2, turns=8, ups=1, downs=1, pillars=2)
+        res = [p for p in dynamic.iter_paths(mat) if 'U' in p]
+        self.assertTrue(res)
+        for path in res:
+            # the track can't go under the ground
+            self.assertLess(path.index('U'), path.index('D'))
+
+
+class TestMeetInTheMiddle(unittest.TestCase):
+    def assertSamePaths(self, mat):
+        self.assertEqual(
+            sorted(dynamic.find_all_paths_mitm(mat)),
+            sorted(dynamic.find_all_paths(mat)))
+
+    def test_simple(self):
+        self.assertSamePaths(material(turns=8))
+
+    def test_loop(self):
+        self.assertSamePaths(material(turns=16))
+
+    def test_bridge(self):
+        self.assertSamePaths(
+            material(straight=2, turns=10, ups=2, downs=2, pillars=3))
+
+
+class TestExternal(unittest.TestCase):
+    def test_same_states(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        with tempfile.TemporaryDirectory() as directory:
+            search = dynamic.Search(mat, directory=directory, run_size=1000)
+            self.assertEqual(search.states(), dynamic.forward_search(mat))
+
+    def test_same_paths(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        self.assertEqual(
+            list(dynamic.iter_paths_external(mat, run_size=1000)),
+            list(dynamic.iter_paths(mat)))
+
+
+class TestReachTable(unittest.TestCase):
+    def setUp(self):
+        self.size = dynamic.REACH_TABLE_SIZE
+
+    def tearDown(self):
+        dynamic.REACH_TABLE_SIZE = self.size
+
+    def test_same_paths(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        expected = sorted(dynamic.iter_paths(mat))
+        pruned = len(dynamic.Search(mat))
+        # the table is partial or missing for the smaller sizes
+        for size in (1 << 10, 0):
+            dynamic.REACH_TABLE_SIZE = size
+            self.assertEqual(sorted(dynamic.iter_paths(mat)), expected)
+            self.assertGreater(len(dynamic.Search(mat)), pruned)
+
+    def test_meet_in_the_middle(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        expected = sorted(dynamic.iter_paths_mitm(mat))
+        dynamic.REACH_TABLE_SIZE = 0
+        self.assertEqual(sorted(dynamic.iter_paths_mitm(mat)), expected)
+
+
+def extended(**counts):
+    fields = segments.material_type(segments.EXTENDED)._fields
+    return segments.material_type(segments.EXTENDED)(
+        **dict(dict.fromkeys(fields, 0), **counts))
+
+# a figure eight through a crossing
+FIGURE_EIGHT = 'XHRRRRRRHXHLLLLLLH'
+
+class TestCatalog(unittest.TestCase):
+    def test_extra_piece(self):
+        # T takes the material of S, every S can be replaced by it
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        expected = sum(2 ** p.count('S') for p in dynamic.iter_paths(mat))
+        catalog = segments.Catalog(segments.BASIC.segments + (
+            segments.Segment('T', 'straight', (1, 1, 0, 0), 0, 0, (1, 0)),))
+        paths = list(dynamic.iter_paths(mat, catalog=catalog))
+        self.assertEqual(len(paths), expected)
+        self.assertEqual(len(set(paths)), expected)
+        self.assertEqual(dynamic.count_paths(mat, catalog=catalog), expected)
+
+    def test_basic_expansion(self):
+        # the basic pieces in another order are searched by the generic loop
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        catalog = segments.Catalog(segments.BASIC.segments[::-1])
+        self.assertNotEqual(catalog, segments.BASIC)
+        basic = dynamic.Search(mat)
+        generic = dynamic.Search(mat, catalog=catalog)
+        self.assertEqual(len(basic), len(generic))
+        self.assertEqual(basic.closed_keys(), generic.closed_keys())
+        self.assertEqual(basic.count_paths(), generic.count_paths())
+
+    def test_invalid_catalog(self):
+        mat = material(turns=8)
+        with self.assertRaises(ValueError):
+            dynamic.Search(mat, catalog=segments.Catalog(
+                segments.BASIC.segments * 2))
+
+    def test_short_pieces(self):
+        paths = dynamic.find_all_paths(
+            extended(short_turns=8), catalog=segments.EXTENDED)
+        self.assertIn('rrrrrrrr', paths)
+        self.assertNotIn('RRRRRRRR', paths)
+        paths = dynamic.find_all_paths(
+            extended(turns=8, short=4), catalog=segments.EXTENDED)
+        self.assertIn('RRRRHHRRRRHH', paths)
+        self.assertNotIn('RRRRSRRRRS', paths)
+
+    def test_crossing(self):
+        mat = extended(turns=12, short=4, crossings=1)
+        paths = set(dynamic.iter_paths(
+            mat, canonical=True, prune_collisions=True,
+            catalog=segments.EXTENDED))
+        self.assertIn(FIGURE_EIGHT, paths)
+        self.assertEqual(
+            [t.path for t in track.valid_tracks(
+                [FIGURE_EIGHT], mat, catalog=segments.EXTENDED)],
+            [FIGURE_EIGHT])
+        self.assertEqual(track.valid_tracks(
+            [FIGURE_EIGHT], mat._replace(crossings=0),
+            catalog=segments.EXTENDED), [])
+
+    def test_mitm(self):
+        mat = extended(turns=8, short_turns=4, short=2)
+        self.assertEqual(
+            sorted(dynamic.iter_paths_mitm(mat, catalog=segments.EXTENDED)),
+            sorted(dynamic.iter_paths(mat, catalog=segments.EXTENDED)))
+
+
+class TestStats(unittest.TestCase):
+    def test_layers(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        reported = []
+        search = dynamic.Search(mat, on_stats=reported.append)
+        self.assertEqual(reported, search.layer_stats)
+        self.assertEqual([s.layer for s in reported], list(range(1, 17)))
+        self.assertEqual(sum(s.frontier for s in reported), len(search))
+        self.assertEqual(reported[-1].visited, len(search))
+        for s in reported:
+            self.assertLessEqual(s.frontier, s.generated)
+            self.assertEqual(set(s.pruned), set(dynamic.PRUNE_RULES))
+            self.assertLess(0, s.load_factor, 1)
+        self.assertTrue(all(sum(s.pruned.values()) for s in reported[1:]))
+
+    def test_external(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        with tempfile.TemporaryDirectory() as directory:
+            search = dynamic.Search(mat, directory=directory, run_size=1000)
+        expected = [
+            s._replace(load_factor=None, probe_length=None)
+            for s in dynamic.Search(mat).layer_stats]
+        self.assertEqual(search.layer_stats, expected)
+
+    def test_walk(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        reported = []
+        search = dynamic.Search(mat, on_stats=reported.append)
+        del reported[:]
+        paths = list(search.iter_paths(canonical=True, prune_collisions=True))
+        keys = search.closed_keys()
+        self.assertEqual(len(reported), len(keys))
+        stats = search.walk_stats
+        self.assertEqual(reported[-1], stats)
+        self.assertEqual(stats.keys, len(keys))
+        self.assertEqual(stats.paths, len(paths))
+        self.assertEqual(len(stats.prefixes), 16)
+        self.assertEqual(
+            stats.prefixes[-1], sum(len(p) == 16 for p in paths))
+        self.assertEqual(set(stats.pruned), set(dynamic.WALK_RULES))
+
+    def test_mitm(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        reported = []
+        list(dynamic.iter_paths_mitm(mat, on_stats=reported.append))
+        layers = [s for s in reported if isinstance(s, dynamic.LayerStats)]
+        self.assertEqual(
+            [(s.search, s.layer) for s in layers],
+            [('forward', i) for i in range(1, 9)])
+
+
+class TestParallel(unittest.TestCase):
+    def test_same_states(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        self.assertEqual(
+            dynamic.forward_search(mat, jobs=4),
+            dynamic.forward_search(mat, jobs=1))
+
+    def test_same_paths(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        self.assertEqual(
+            dynamic.find_all_paths(mat, jobs=4),
+            dynamic.find_all_paths(mat, jobs=1))
+
+
+class TestSmallerMaterial(unittest.TestCase):
+    def test_same_paths(self):
+        materials = [
+            material(straight=2, turns=10, ups=2, downs=2, pillars=3),
+            material(straight=2, turns=10, ups=1, downs=1, pillars=1),
+            material(straight=1, turns=12, ups=0, downs=0, pillars=0),
+            material(turns=8),
+        ]
+        res = dynamic.find_all_paths_many(materials)
+        for mat in materials:
+            self.assertEqual(sorted(res[mat]), sorted(dynamic.find_all_paths(mat)))
+
+    def test_larger_material(self):
+        search = dynamic.Search(material(turns=8))
+        with self.assertRaises(ValueError):
+            list(search.iter_paths(material=material(turns=10)))
+
+
+class TestPacking(unittest.TestCase):
+    # the largest material with keys of 63 bits
+    LARGEST = material(straight=31, turns=31, ups=7, downs=7, pillars=255)
+
+    def test_limits(self):
+        d = 76
+        lows = (-d, -d, -d, -d, 0, 0, 0, 0, 0, 0, 0, 0)
+        highs = (d, d, d, d, 7, 7, 31, 31, 7, 7, 255, 1)
+        for state in (lows, highs, highs[:4] + lows[4:], lows[:4] + highs[4:]):
+            self.assertEqual(
+                dynamic._repack(self.LARGEST, state), (state, 63))
+
+    def test_out_of_bounds(self):
+        with self.assertRaises(ValueError):
+            dynamic._repack(self.LARGEST, (77,) + (0,) * 11)
+
+    def test_too_large(self):
+        with self.assertRaises(ValueError):
+            dynamic._repack(self.LARGEST._replace(pillars=256), (0,) * 12)
+        with self.assertRaises(ValueError):
+            dynamic.Search(self.LARGEST._replace(pillars=256))
+
+
+class TestStateSet(unittest.TestCase):
+    def test_grow(self):
+        rng = random.Random(0)
+        keys = list(dict.fromkeys(rng.getrandbits(63) for _ in range(10000)))
+        inserted, missing = keys[:5000], keys[5000:]
+        new, found, capacity = dynamic._state_set(
+            inserted + inserted[::7], keys)
+        self.assertEqual(
+            new, [True] * len(inserted) + [False] * len(inserted[::7]))
+        self.assertEqual(found, [True] * len(inserted) + [False] * len(missing))
+        # grown from 16 slots and at most half full
+        self.assertGreaterEqual(capacity, 2 * len(inserted))
+
+
+class TestSampling(unittest.TestCase):
+    def test_count(self):
+        for mat in [
+                material(turns=8),
+                material(straight=2, turns=10, ups=2, downs=2, pillars=3)]:
+            self.assertEqual(
+                dynamic.count_paths(mat), len(dynamic.find_all_paths(mat)))
+
+    def test_sample(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        paths = dynamic.sample_paths(mat, 200, seed=1)
+        self.assertEqual(len(paths), 200)
+        self.assertLessEqual(set(paths), set(dynamic.find_all_paths(mat)))
+        self.assertEqual(paths, dynamic.sample_paths(mat, 200, seed=1))
+
+    def test_valid(self):
+        mat = material(straight=4, turns=12, ups=2, downs=2, pillars=4)
+        paths = dynamic.sample_paths(
+            mat, 300, seed=2, canonical=True, prune_collisions=True)
+        self.assertLessEqual(
+            set(paths), set(dynamic.iter_paths(mat, canonical=True)))
+        for path in paths:
+            self.assertTrue(track.Track(path).is_valid(mat), path)
+
+    def test_uniform(self):
+        mat = material(straight=2, turns=10)
+        paths = dynamic.find_all_paths(mat)
+        counts = collections.Counter(
+            dynamic.sample_paths(mat, 100 * len(paths), seed=0))
+        self.assertEqual(set(counts), set(paths))
+        for count in counts.values():
+            self.assertTrue(70 < count < 130)
+
+
+class TestPillars(unittest.TestCase):
+    def test_same_as_track(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        paths = dynamic.find_all_paths(mat)
+        expected = [
+            p for p in dynamic.find_all_paths(mat._replace(pillars=8))
+            if track.Track(p).count_pillars() <= mat.pillars]
+        self.assertEqual(sorted(paths), sorted(expected))
+
+    def test_mitm(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=2)
+        self.assertEqual(
+            sorted(dynamic.find_all_paths_mitm(mat)),
+            sorted(dynamic.find_all_paths(mat)))
+
+
+class TestCanonical(unittest.TestCase):
+    def assertSameTracks(self, mat, paths):
+        self.assertEqual(
+            set(solver.normalize_paths(paths)),
+            set(solver.normalize_paths(dynamic.find_all_paths(mat))))
+
+    def test_circle(self):
+        mat = material(turns=8)
+        self.assertEqual(list(dynamic.iter_paths(mat, canonical=True)), ['LLLLLLLL'])
+
+    def test_bridge(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        paths = list(dynamic.iter_paths(mat, canonical=True))
+        self.assertSameTracks(mat, paths)
+
+    def test_mitm(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        self.assertEqual(
+            sorted(dynamic.iter_paths_mitm(mat, canonical=True)),
+            sorted(dynamic.iter_paths(mat, canonical=True)))
+
+
+class TestPruneCollisions(unittest.TestCase):
+    def assertSameAsFilter(self, paths, mat):
+        expected = [
+            p for p in dynamic.find_all_paths(mat)
+            if not collision.path_intersections(track.Track(p))]
+        self.assertEqual(sorted(paths), sorted(expected))
+
+    def test_loop(self):
+        mat = material(turns=16)
+        self.assertSameAsFilter(
+            dynamic.iter_paths(mat, prune_collisions=True), mat)
+
+    def test_bridge(self):
+        mat = material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+        self.assertSameAsFilter(
+            dynamic.iter_paths(mat, prune_collisions=True), mat)
+
+    def test_mitm(self):
+        mat = material(straight=2, turns=12, ups=1, downs=1, pillars=2)
+        self.assertSameAsFilter(
+            dynamic.iter_paths_mitm(mat, prune_collisions=True), mat)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,46 @@
+import random
+import unittest
+
+import search_local
+import solver
+
+
+MATERIAL = solver.Material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+
+
+class TestLocalSearch(unittest.TestCase):
+    def test_tracks_found_by_solver(self):
+        tracks = list(search_local.iter_tracks(MATERIAL, steps=2000, seed=0))
+        self.assertTrue(tracks)
+        expected = set(solver.normalize_paths(
+            t.path for t in solver.iter_tracks(MATERIAL)))
+        for t in tracks:
+            self.assertIn(solver.normalize_paths([t.path])[0], expected)
+
+    def test_same_seed(self):
+        def paths(seed):
+            return [t.path for t in search_local.iter_tracks(
+                MATERIAL, steps=500, seed=seed)]
+        self.assertEqual(paths(1), paths(1))
+
+    def test_large_material(self):
+        mat = solver.Material(
+            straight=40, turns=48, ups=8, downs=8, pillars=16)
+        rng = random.Random(0)
+        path = search_local.random_path(mat, rng)
+        self.assertEqual(len(path), 104)
+        for _ in range(100):
+            path = search_local.neighbour(path, mat, rng)
+            self.assertLessEqual(path.count('S'), mat.straight)
+            self.assertLessEqual(path.count('R') + path.count('L'), mat.turns)
+            self.assertEqual(path.count('U'), path.count('D'))
+
+    def test_empty_material(self):
+        mat = solver.Material(straight=0, turns=0, ups=0, downs=0, pillars=0)
+        self.assertEqual(list(search_local.iter_tracks(mat, steps=10)), [])
+        self.assertEqual(
+            search_local.neighbour('', mat, random.Random(0)), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
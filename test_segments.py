@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+
+import segments
+
+
+STR_SHIFT = (
+    (1, 1, 0, 0),
+    (1, 0, -1, 0),
+    (0, 0, -1, -1),
+    (-1, 0, -1, 0),
+    (-1, -1, 0, 0),
+    (-1, 0, 1, 0),
+    (0, 0, 1, 1),
+    (1, 0, 1, 0),
+)
+
+R_SHIFT = (
+    ( 1,  0,  0, -1),
+    ( 0,  1, -1,  0),
+    ( 0, -1, -1,  0),
+    (-1,  0,  0, -1),
+    (-1,  0,  0,  1),
+    ( 0, -1,  1,  0),
+    ( 0,  1,  1,  0),
+    ( 1,  0,  0,  1),
+)
+
+
+class TestCatalog(unittest.TestCase):
+    def test_shifts(self):
+        s, u, d, r, l = segments.BASIC.segments
+        self.assertEqual(tuple(segments.shifts(s)), STR_SHIFT)
+        self.assertEqual(tuple(segments.shifts(d)), STR_SHIFT)
+        self.assertEqual(tuple(segments.shifts(r)), R_SHIFT)
+        self.assertEqual(
+            tuple(segments.shifts(l)), R_SHIFT[-1:] + R_SHIFT[:-1])
+
+    def test_backward(self):
+        forward = segments.transitions(segments.BASIC)
+        backward = segments.transitions(segments.BASIC, backward=True)
+        row = 6 + segments.MAX_COUNTERS
+        angle = 5 * row
+        # R at angle 1 comes from the row of R at angle 0
+        self.assertEqual(
+            backward[angle + 3*row:angle + 4*row], forward[3*row:4*row])
+        self.assertEqual(
+            backward[4*row:5*row], forward[angle + 4*row:angle + 5*row])
+
+    def test_check(self):
+        s = segments.BASIC.segments[0]
+        self.assertIsNone(segments.check(segments.BASIC))
+        self.assertIsNone(segments.check(segments.EXTENDED))
+        for pieces in (
+                (s._replace(shift=(1, 0, 0, 0)),),
+                (s._replace(shift=(0, 0, 0, 0)),),
+                (s._replace(counter='crossings'),),
+                (s._replace(turn=1),),
+                (s._replace(climb=2),),
+                (s._replace(crossing=True, climb=1),),
+                (s, s),
+                segments.BASIC.segments * 4):
+            with self.assertRaises(ValueError):
+                segments.check(segments.Catalog(pieces))
+        with self.assertRaises(ValueError):
+            segments.check(segments.BASIC._replace(scale=0))
+        with self.assertRaises(ValueError):
+            segments.check(segments.BASIC._replace(counters=segments.COUNTERS * 3))
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'catalog.json')
+            for catalog in (segments.BASIC, segments.EXTENDED):
+                with open(filename, 'w') as f:
+                    json.dump(segments.to_json(catalog), f)
+                self.assertEqual(segments.load(filename), catalog)
+
+    def test_search_limits(self):
+        material = segments.material_type(segments.EXTENDED)(
+            1, 2, 3, 4, 5, 6, 7, pillars=8)
+        self.assertEqual(
+            segments.search_limits(segments.EXTENDED, material),
+            [1, 2, 3, 4, 5, 6, 14])
+
+    def test_counter_kinds(self):
+        self.assertEqual(
+            segments.counter_kinds(segments.BASIC),
+            [segments.KIND_FLAT, segments.KIND_TURN,
+             segments.KIND_UP, segments.KIND_DOWN])
+        s, u, d, r, l = segments.BASIC.segments
+        self.assertIsNone(segments.counter_kinds(
+            segments.Catalog((s, u._replace(counter='straight'), d, r, l))))
+
+
+if __name__ == '__main__':
+    unittest.main()
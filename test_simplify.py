@@ -0,0 +1,34 @@
+import unittest
+
+import simplify
+import track
+
+
+def reduce_paths(paths):
+    codes = dict.fromkeys(simplify._normalize_chunk(paths))
+    index = simplify.simplify_index(codes)
+    return {simplify.decode(c) for c in simplify.reduce_tracks(codes, index)}
+
+
+class TestSimplify(unittest.TestCase):
+    def test_encode(self):
+        for path in ('S', 'RRRRRRRR', 'RRSUDLLRSS'):
+            self.assertEqual(simplify.decode(simplify.encode(path)), path)
+
+    def test_extended_track(self):
+        self.assertEqual(
+            reduce_paths(['RRRRSRRRRS', 'RRRRRRRR']), {'LLLLLLLL'})
+
+    def test_shorter_track_missing(self):
+        # RRRRSRRRRS is not present
+        self.assertEqual(
+            reduce_paths(['RRRRSSRRRRSS', 'RRRRRRRR']), {'LLLLLLLL'})
+
+    def test_unrelated_tracks(self):
+        self.assertEqual(
+            reduce_paths(['RRRRSRRRRS', 'RRRLLRRRRRRR']),
+            {track.canonical_path(p) for p in ('RRRRSRRRRS', 'RRRLLRRRRRRR')})
+
+
+if __name__ == '__main__':
+    unittest.main()
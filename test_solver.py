@@ -0,0 +1,188 @@
+import io
+import itertools
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import segments
+import solver
+import track
+
+
+MATERIAL = solver.Material(straight=2, turns=10, ups=2, downs=2, pillars=3)
+SMALL = solver.Material(straight=2, turns=8, ups=2, downs=2, pillars=2)
+FLAT = solver.Material(straight=4, turns=12, ups=0, downs=0, pillars=0)
+
+ITER_TRACKS = solver.iter_tracks
+
+
+def crash_small(material, *args):
+    # the worker searching SMALL dies
+    if material == SMALL:
+        os._exit(1)
+    return ITER_TRACKS(material, *args)
+
+
+def paths(material):
+    return [t.path for t in solver.iter_tracks(material)]
+
+
+class TestReadMaterials(unittest.TestCase):
+    def test_defaults(self):
+        lines = io.StringIO(
+            'turns, straight,pillars\n'
+            '10,2,3\n'
+            '8,2,\n')
+        self.assertEqual(
+            solver.read_materials(lines, MATERIAL._replace(pillars=2)),
+            [MATERIAL, SMALL])
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            solver.read_materials(io.StringIO('turns,crossings\n8,1\n'), SMALL)
+
+    def test_invalid_value(self):
+        with self.assertRaises(ValueError):
+            solver.read_materials(io.StringIO('turns\neight\n'), SMALL)
+
+
+class TestBatch(unittest.TestCase):
+    def test_same_paths(self):
+        results = list(solver.iter_batch(
+            [MATERIAL, SMALL, FLAT, SMALL], processes=2, use_cache=False))
+        self.assertCountEqual(
+            [r.material for r in results], [MATERIAL, SMALL, FLAT])
+        for r in results:
+            self.assertIsNone(r.error)
+            self.assertEqual(r.paths, paths(r.material))
+            self.assertEqual(r.count, len(r.paths))
+
+    def test_memory(self):
+        # every search runs alone, the largest first
+        results = list(solver.iter_batch(
+            [SMALL, MATERIAL, FLAT], processes=2, memory=1, use_cache=False))
+        self.assertEqual(
+            [r.material for r in results],
+            sorted([SMALL, MATERIAL, FLAT], key=solver.estimate_memory,
+                   reverse=True))
+
+    def test_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = list(solver.iter_batch(
+                [MATERIAL, SMALL], use_cache=False, directory=directory))
+            self.assertEqual([r.paths for r in results], [None, None])
+            for m in (MATERIAL, SMALL):
+                filename = os.path.join(
+                    directory, solver.material_name(m) + '.txt')
+                with open(filename) as f:
+                    self.assertEqual(f.read().split(), paths(m))
+
+    def test_error(self):
+        large = solver.Material(
+            straight=40, turns=40, ups=8, downs=8, pillars=16)
+        results = list(solver.iter_batch([large, SMALL], use_cache=False))
+        self.assertIsNotNone(results[0].error)
+        self.assertIsNone(results[1].error)
+
+    def test_estimate(self):
+        large = solver.Material(
+            straight=8, turns=24, ups=4, downs=4, pillars=8)
+        self.assertLess(
+            solver.estimate_memory(large, 'external'),
+            solver.estimate_memory(large))
+        self.assertEqual(
+            solver.estimate_memory(SMALL, 'external'),
+            solver.estimate_memory(SMALL))
+        self.assertGreater(
+            solver.estimate_memory(SMALL, jobs=4),
+            solver.estimate_memory(SMALL))
+
+    def test_exception(self):
+        with mock.patch('solver.iter_tracks', side_effect=RuntimeError):
+            results = list(solver.iter_batch([SMALL], use_cache=False))
+        self.assertEqual(results[0].error, 'RuntimeError')
+
+    def test_crash(self):
+        with mock.patch('solver.iter_tracks', crash_small):
+            results = list(solver.iter_batch(
+                [MATERIAL, SMALL, FLAT], processes=2, use_cache=False))
+        errors = {r.material: r.error for r in results}
+        self.assertCountEqual(errors, [MATERIAL, SMALL, FLAT])
+        self.assertIsNotNone(errors.pop(SMALL))
+        self.assertEqual(list(errors.values()), [None, None])
+
+
+class TestMain(unittest.TestCase):
+    def run_main(self, *args):
+        argv = ['solver.py', '--turns=8', '--straight=2', '--ups=2',
+                '--downs=2', '--pillars=2'] + list(args)
+        stdout = io.StringIO()
+        with mock.patch('sys.argv', argv), \
+                mock.patch('sys.stdout', stdout), \
+                mock.patch('solver.Progress') as progress, \
+                mock.patch('cache.load', return_value=['cached']) as load, \
+                mock.patch('cache.Writer'):
+            solver.main()
+        return stdout.getvalue().split(), progress, load
+
+    def test_cached(self):
+        out, _, load = self.run_main()
+        load.assert_called_once_with(SMALL, catalog=None)
+        self.assertEqual(out, ['cached'])
+
+    def test_progress_skips_cache(self):
+        out, progress, load = self.run_main('--progress')
+        load.assert_not_called()
+        self.assertEqual(out, paths(SMALL))
+        self.assertTrue(progress.return_value.called)
+
+    def test_checkpoint_skips_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            out, _, load = self.run_main(
+                '--checkpoint=%s' % os.path.join(directory, 'search.ckpt'))
+        load.assert_not_called()
+        self.assertEqual(out, paths(SMALL))
+
+    def test_catalog(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'catalog.json')
+            with open(filename, 'w') as f:
+                json.dump(segments.to_json(segments.EXTENDED), f)
+            out, _, load = self.run_main(
+                '--no-cache', '--ups=0', '--downs=0', '--catalog=%s' % filename,
+                '--count=short=2', '--count=short_turns=0',
+                '--count=crossings=0')
+        load.assert_not_called()
+        for path in ('RRRRRRRR', 'RRRRSRRRRS', 'RRRRHRRRRH', 'RRRRHHRRRRS'):
+            self.assertIn(track.canonical_path(path, segments.EXTENDED), out)
+
+
+class TestCatalogMaterial(unittest.TestCase):
+    def test_counts(self):
+        material = solver.catalog_material(
+            segments.EXTENDED, SMALL,
+            ['short=1', 'short_turns=2', 'crossings=3'])
+        self.assertEqual(tuple(material), (2, 8, 2, 2, 1, 2, 3, 2))
+
+    def test_errors(self):
+        for counts in (['short=1', 'short_turns=2'],
+                       ['short=1', 'short_turns=2', 'crossings=x'],
+                       ['short=1', 'short_turns=2', 'crossings=3', 'long=1']):
+            with self.assertRaises(ValueError):
+                solver.catalog_material(segments.EXTENDED, SMALL, counts)
+
+
+class TestPathKeys(unittest.TestCase):
+    def test_distinct(self):
+        for catalog, names in ((None, 'SUDRL'),
+                               (segments.EXTENDED, 'SUDRLHrlX')):
+            paths = [''.join(p) for n in range(4)
+                     for p in itertools.product(names, repeat=n)]
+            keys = solver._path_keys(paths, catalog)
+            self.assertEqual(len(set(keys)), len(paths))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import segments
+import tohtml
+import track
+
+
+PATHS = ['RRRRRRRR', 'RRRRSRRRRS', 'LLLLLLLL', 'RRRRSSRRRRSS', 'RRRLLRRRRRRR']
+
+
+class TestReport(unittest.TestCase):
+    def test_pages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tohtml.write_report(
+                (track.Track(p) for p in PATHS), directory, page_size=2)
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ['images', 'index.html', 'page0001.html', 'page0002.html'])
+            # every path has its own image, mirror images too
+            self.assertEqual(len(os.listdir(os.path.join(directory, 'images'))), 5)
+            with open(os.path.join(directory, 'page0002.html')) as f:
+                page = f.read()
+            self.assertIn('page0001.html', page)
+            self.assertNotIn('page0003.html', page)
+
+    def test_sorted_across_pages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tohtml.write_report(
+                (track.Track(p) for p in PATHS), directory, page_size=2,
+                sort='S')
+            with open(os.path.join(directory, 'index.html')) as f:
+                page = f.read()
+            # the tracks without straight pieces come first
+            self.assertIn('<td>LLLLLLLL</td>', page)
+            self.assertIn('<td>RRRLLRRRRRRR</td>', page)
+            with open(os.path.join(directory, 'page0002.html')) as f:
+                self.assertIn('<td>RRRRSSRRRRSS</td>', f.read())
+            with self.assertRaises(ValueError):
+                tohtml.write_report([], directory, sort='X')
+
+    def test_old_pages_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tohtml.write_report(
+                (track.Track(p) for p in PATHS), directory, page_size=2)
+            tohtml.write_report(
+                (track.Track(p) for p in PATHS), directory, page_size=3)
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ['images', 'index.html', 'page0001.html'])
+
+    def test_existing_images_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, 'images'))
+            image = os.path.join(directory, tohtml.image_name('RRRRRRRR'))
+            with open(image, 'w') as f:
+                f.write('old')
+            tohtml.write_report([track.Track('RRRRRRRR')], directory)
+            with open(image) as f:
+                self.assertEqual(f.read(), 'old')
+
+    def test_image_of_row(self):
+        # the canonical path of the row reverses it without swapping U and
+        # D, so it needs 10 pillars instead of 6
+        path = 'RRRLRUDRRURLSRRRDSSS'
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch('tohtml._draw') as draw:
+                tohtml.write_report(
+                    [track.Track(path), track.Track(path)], directory)
+            draw.assert_called_once_with((path, os.path.join(
+                directory, tohtml.image_name(path)), segments.BASIC))
+
+    def test_catalog(self):
+        paths = ['rrrrrrrr', 'RRRRRRRR', 'RRRRHHRRRRHH']
+        with tempfile.TemporaryDirectory() as directory:
+            tohtml.write_report(
+                (track.Track(p, segments.EXTENDED) for p in paths), directory,
+                image_format='svg')
+            self.assertEqual(
+                len({n.lower() for n in os.listdir(
+                    os.path.join(directory, 'images'))}), 3)
+            with open(os.path.join(directory, 'index.html')) as f:
+                page = f.read()
+            self.assertIn('<th>short_turns', page)
+
+
+if __name__ == '__main__':
+    unittest.main()
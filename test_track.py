@@ -1,5 +1,9 @@
 import unittest
+from xml.etree import ElementTree
 
+import collision
+import segments
+import solver
 import track
 
 
@@ -73,12 +77,199 @@ class TestSimplify(unittest.TestCase):
         self.assertEqual(res, ['DLLLRLUDLSLLLSRLUL'])
 
 
+class TestNormalize(unittest.TestCase):
+    def test_same_as_all_symetries(self):
+        paths = [
+            'RRRRRRRR', 'SRRRRSRRRR', 'RLRRRRLRRRRR', 'LLRRRRRRRRLLLLLL',
+            'DLLSLRLUDLSLLLSRSLUL', 'USUDSD', 'S', 'RLRL']
+        for path in paths:
+            self.assertEqual(
+                track.canonical_path(path), min(track.all_symetries(path)))
+
+    def test_normalize(self):
+        res = track.Track('RRRRSRRRRS').normalize()
+        self.assertEqual(res.path, 'LLLLSLLLLS')
+
+
 class TestPosition(unittest.TestCase):
     def test_angle(self):
         path = 'SRRRRSRRRR'
         res = track.Track(path).angle
         self.assertEqual(res, [0, 0, 1, 2, 3, 4, 4, 5, 6, 7, 0])
 
+    def test_lattice(self):
+        res = track.Track('SRRRRSRRRR').lattice
+        self.assertEqual(res[1], (1, 1, 0, 0))
+        self.assertEqual(res[-1], (0, 0, 0, 0))
+        self.assertEqual(res[6], (0, 0, -2, -2))
+
+    def test_level(self):
+        res = track.Track('DSSUSS').level
+        self.assertEqual(res, [1, 0, 0, 0, 1, 1, 1])
+
+
+class TestBatchGeometry(unittest.TestCase):
+    paths = ['SRRRRSRRRR', 'DLLSLRLUDLSLLLSRSLUL', 'USUDSD', 'S', 'LLRRRRRRRRLLLLLL']
+
+    def test_rows(self):
+        geometry = track.batch_geometry(self.paths)
+        for i, path in enumerate(self.paths):
+            n = len(path) + 1
+            t = track.Track(path)
+            self.assertEqual(geometry.angle[i, :n].tolist(), t.angle)
+            self.assertEqual(geometry.level[i, :n].tolist(), t.level)
+            self.assertEqual(
+                [tuple(p) for p in geometry.lattice[i, :n].tolist()], t.lattice)
+            for p, q in zip(geometry.pos[i, :n].tolist(), t.pos):
+                self.assertAlmostEqual(p[0], q[0])
+                self.assertAlmostEqual(p[1], q[1])
+
+    def test_from_geometry(self):
+        geometry = track.batch_geometry(self.paths)
+        for i, path in enumerate(self.paths):
+            t = track.Track.from_geometry(path, geometry, i)
+            expected = track.Track(path)
+            self.assertEqual(t.path, path)
+            self.assertEqual(t.angle, expected.angle)
+            self.assertEqual(t.lattice, expected.lattice)
+            self.assertEqual(t.count_pillars(), expected.count_pillars())
+
+    def test_unknown_segment(self):
+        material = solver.Material(
+            straight=4, turns=12, ups=2, downs=2, pillars=4)
+        paths = ['RRRRRRRR', 'RRRRTRRRR']
+        with self.assertRaises(ValueError):
+            track.Track(paths[1]).lattice
+        with self.assertRaises(ValueError):
+            track.batch_geometry(paths)
+        with self.assertRaises(ValueError):
+            track.valid_tracks(paths, material)
+
+    def test_pillars(self):
+        geometry = track.batch_geometry(self.paths)
+        self.assertEqual(
+            track._batch_pillars(geometry).tolist(),
+            [track.Track(p).count_pillars() for p in self.paths])
+
+    def test_valid_tracks(self):
+        material = solver.Material(
+            straight=4, turns=12, ups=2, downs=2, pillars=4)
+        paths = self.paths + ['RRRRRRRR', 'SRRRRSRRRRSS', 'LLLLSSLLLLSS']
+        res = [t.path for t in track.valid_tracks(paths, material)]
+        self.assertEqual(
+            res, [p for p in paths if track.Track(p).is_valid(material)])
+        self.assertIn('RRRRRRRR', res)
+
+
+def svg_path(t):
+    # commands of all paths of the image of the track without the ticks
+    root = ElementTree.fromstring(t.to_svg())
+    d = ''.join(p.get('d') for p in root.iter('{http://www.w3.org/2000/svg}path'))
+    for tick in track._SVG_TICKS:
+        d = d.replace(tick, '')
+    return d
+
+
+class TestSvg(unittest.TestCase):
+    def test_segments(self):
+        d = svg_path(track.Track('RRRRSSRRUDRRSS'))
+        self.assertEqual(d.count('a'), 8)
+        # arrows of U and D, two sides each
+        self.assertEqual(d.count('z'), 2)
+        self.assertEqual(sum(map(d.count, 'hvl')), 4 + 2 * 2)
+        # relative integer coordinates
+        self.assertEqual(d.count('M'), 1)
+        self.assertNotIn('.', d)
+
+    def test_colors_by_level(self):
+        svg = track.Track('RRRRUSSDRRRRSS').to_svg()
+        self.assertEqual(svg.count('<path'), 2)
+
+    def test_size(self):
+        root = ElementTree.fromstring(track.Track('RRRRRRRR').to_svg())
+        image = track.Track('RRRRRRRR').to_image()
+        self.assertEqual(
+            (int(root.get('width')), int(root.get('height'))), image.size)
+
+
+class TestCollision(unittest.TestCase):
+    material = solver.Material(straight=4, turns=12, ups=2, downs=2, pillars=4)
+
+    def test_bridge(self):
+        self.assertTrue(track.Track('DLLLLLLSSRRRRRRU').is_valid(self.material))
+
+    def test_bridges_touching(self):
+        # both bridges meet above the start
+        self.assertFalse(track.Track('DLLLLLLUDRRRRRRU').is_valid(self.material))
+
+    def test_segment_ending_before_line(self):
+        line1 = collision.LineSegment(0, (-18, 0, 0, 0), (-10, 0, 0, 0))
+        line2 = collision.LineSegment(2, (-10, 0, -2, 0), (-10, 0, -10, 0))
+        self.assertFalse(collision.line_intersection(line1, line2))
+        self.assertFalse(collision.line_intersection(line2, line1))
+
+    def test_crossing(self):
+        line1 = collision.LineSegment(0, (-10, 0, 0, 0), (10, 0, 0, 0))
+        line2 = collision.LineSegment(2, (0, 0, -10, 0), (0, 5, 10, 0))
+        self.assertTrue(collision.line_intersection(line1, line2))
+        self.assertTrue(collision.line_intersection(line2, line1))
+
+
+class TestCatalog(unittest.TestCase):
+    catalog = segments.EXTENDED
+    material = segments.material_type(segments.EXTENDED)(
+        straight=2, turns=12, ups=2, downs=2, short=4, short_turns=8,
+        crossings=1, pillars=4)
+    paths = ['XHRRRRRRHXHLLLLLLH', 'rrrrHHrrrrHH', 'RRRRSrrrrrrrrS',
+             'SRRRRXRRRR', 'URRRRDRRRR']
+
+    def test_batch_geometry(self):
+        geometry = track.batch_geometry(self.paths, self.catalog)
+        for i, path in enumerate(self.paths):
+            n = len(path) + 1
+            t = track.Track(path, self.catalog)
+            self.assertEqual(geometry.angle[i, :n].tolist(), t.angle)
+            self.assertEqual(
+                [tuple(p) for p in geometry.lattice[i, :n].tolist()], t.lattice)
+
+    def test_valid_tracks(self):
+        res = [t.path for t in track.valid_tracks(
+            self.paths, self.material, catalog=self.catalog)]
+        self.assertEqual(res, [
+            p for p in self.paths
+            if track.Track(p, self.catalog).is_valid(self.material)])
+        self.assertIn('rrrrHHrrrrHH', res)
+
+    def test_crossing(self):
+        t = track.Track('XHRRRRRRHXHLLLLLLH', self.catalog)
+        self.assertEqual(t.count_pieces()['crossings'], 1)
+        self.assertTrue(t.is_valid(self.material))
+        self.assertFalse(t.is_valid(self.material._replace(crossings=0)))
+
+    def test_svg(self):
+        d = svg_path(track.Track('rrrrHHrrrrHH', self.catalog))
+        self.assertEqual(d.count('a'), 8)
+        self.assertEqual(sum(map(d.count, 'hvl')), 4)
+
+
+class TestSegmentIndex(unittest.TestCase):
+    def lines(self, path):
+        return list(collision._segment_lines(track.Track(path)))
+
+    def test_incremental(self):
+        # loop closed by the last segment crossing the first one
+        index = collision.SegmentIndex()
+        lines = self.lines('SRRRRRRS')
+        for height, line, bounds in lines[:-1]:
+            self.assertFalse(index.add(line, bounds))
+        height, line, bounds = lines[-1]
+        self.assertTrue(index.intersects(line, bounds))
+
+    def test_closed_path(self):
+        index = collision.SegmentIndex(length=8)
+        for height, line, bounds in self.lines('RRRRRRRR'):
+            self.assertFalse(index.add(line, bounds))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,37 +1,193 @@
 #!/usr/local/bin/python3
 """
 Render all tracks from the input into html page.
+
+The tracks are sorted by a column of the report and split to pages of
+PAGE_SIZE tracks, only the columns of the tracks are kept in memory until
+they are sorted. Images are named by the path of the track and are
+rendered only if they don't exist yet, either as PNG or SVG. Pages of an
+older report beyond the last page are removed.
 """
 
 import argparse
-import sys
+import itertools
+import multiprocessing
 import os
+import re
+import sys
 
+import segments
 import track
 
 
-def write_report(tracks):
-    os.makedirs('report', exist_ok=True)
-    with open('report/index.html', 'w') as report:
+PAGE_SIZE = 500
+
+# short headers of the columns of the basic materials, other materials of
+# a catalog are headed by their names
+COLUMNS = {'straight': 'S', 'turns': 'T', 'ups': 'U', 'downs': 'D'}
+
+IMAGE_FORMATS = ('png', 'svg')
+
+# sorts rows of the table by a clicked column, numbers are compared as
+# numbers, only the page is sorted
+SORT_SCRIPT = '''<script>
+document.querySelectorAll('th').forEach(function(th, column) {
+  th.addEventListener('click', function() {
+    var body = th.closest('table').tBodies[0];
+    var rows = Array.from(body.rows);
+    var asc = th.dataset.order !== 'asc';
+    th.dataset.order = asc ? 'asc' : 'desc';
+    rows.sort(function(a, b) {
+      var x = a.cells[column].textContent, y = b.cells[column].textContent;
+      var d = isNaN(x) ? x.localeCompare(y) : x - y;
+      return asc ? d : -d;
+    });
+    rows.forEach(function(row) { body.appendChild(row); });
+  });
+});
+</script>
+'''
+
+
+def image_name(path, image_format='png'):
+    # names of pieces differing only in case, e.g. short turns, mustn't
+    # share a file on case insensitive file systems
+    name = ''.join('_' + c if c.islower() else c for c in path)
+    return 'images/%s.%s' % (name, image_format)
+
+
+def _draw(args):
+    path, filename, catalog = args
+    # the image appears under its name only when it is complete
+    tmp = filename + '.tmp'
+    t = track.Track(path, catalog)
+    if filename.endswith('.svg'):
+        with open(tmp, 'w') as f:
+            f.write(t.to_svg())
+    else:
+        t.to_image().save(tmp, 'PNG')
+    os.replace(tmp, filename)
+
+
+def page_name(page):
+    return 'index.html' if page == 0 else 'page%04d.html' % page
+
+
+PAGE_PATTERN = re.compile(r'page(\d{4,})\.html$')
+
+
+def columns(catalog=None):
+    """Headers of the columns of the report which it can be sorted by."""
+    if catalog is None:
+        catalog = segments.BASIC
+    return ['descr'] + [COLUMNS.get(c, c) for c in catalog.counters] + ['P']
+
+
+def _write_page(directory, page, rows, headers, last):
+    with open(os.path.join(directory, page_name(page)), 'w') as report:
         report.write('<!doctype html>\n')
         report.write('<body>\n')
+        report.write('<p>')
+        if page > 0:
+            report.write('<a href="%s">previous</a> ' % page_name(page - 1))
+        report.write('page %d' % (page + 1))
+        if not last:
+            report.write(' <a href="%s">next</a>' % page_name(page + 1))
+        report.write('</p>\n')
+        report.write(
+            '<p>Click a column to sort the tracks of this page, the other '
+            'pages are not included.</p>\n')
         report.write('<table>\n')
-        report.write('''<tr>
-<th>descr<th>S<th>T<th>U<th>D<th>P<th>image
-</tr>\n''')
-        for i, t in enumerate(tracks, start=1):
-            report.write('<tr><td>%s</td>' % t.path)
-            report.write('<td>{S}</td><td>{T}</td><td>{U}</td><td>{D}</td><td>{P}</td>'.format(
-                S=t.path.count('S'),
-                T=t.path.count('R') + t.path.count('L'),
-                U=t.path.count('U'),
-                D=t.path.count('D'),
-                P=t.count_pillars(),
-            ))
-            report.write('<td><img src="preview%02d.png"></td>' % i)
+        report.write('''<thead><tr>
+%s<th>image
+</tr></thead><tbody>\n''' % ''.join('<th>%s' % h for h in headers))
+        for row, image in rows:
+            report.write('<tr><td>%s</td>' % row[0])
+            report.write(''.join('<td>%d</td>' % n for n in row[1:]))
+            report.write('<td><img src="%s" loading="lazy"></td>' % image)
             report.write('</tr>\n')
-            t.draw('report/preview%002d.png' % i)
-        report.write('</table></body>\n')
+        report.write('</tbody></table>\n')
+        report.write(SORT_SCRIPT)
+        report.write('</body>\n')
+
+
+def _pages(tracks, page_size):
+    # pages with a flag whether the page is the last one
+    tracks = iter(tracks)
+    page = list(itertools.islice(tracks, page_size))
+    while True:
+        following = list(itertools.islice(tracks, page_size))
+        yield page, not following
+        if not following:
+            break
+        page = following
+
+
+def _row(t):
+    # the columns of the track in the report
+    pieces = t.count_pieces()
+    return (t.path,) + tuple(
+        pieces[c] for c in t.catalog.counters) + (t.count_pillars(),)
+
+
+def _remove_pages(directory, count):
+    # pages of an older report from count on
+    for name in os.listdir(directory):
+        match = PAGE_PATTERN.match(name)
+        if match and int(match.group(1)) >= count:
+            os.remove(os.path.join(directory, name))
+
+
+def write_report(tracks, directory='report', jobs=1, page_size=PAGE_SIZE,
+                 image_format='png', sort='descr'):
+    """Write pages of the report, tracks can be any iterable of tracks of
+    one catalog.
+
+    The rows are sorted by the column sort of columns(catalog), then by the
+    others from the left. Raise ValueError if the report has no such
+    column.
+    """
+    catalog = segments.BASIC
+    rows = []
+    for t in tracks:
+        catalog = t.catalog
+        rows.append(_row(t))
+    headers = columns(catalog)
+    if sort not in headers:
+        raise ValueError('The report has no column %s.' % sort)
+    first = headers.index(sort)
+    rows.sort(key=lambda row: (row[first],) + row)
+    os.makedirs(os.path.join(directory, 'images'), exist_ok=True)
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        count = 0
+        for page, (chunk, last) in enumerate(_pages(rows, page_size)):
+            page_rows = []
+            todo = {}
+            for row in chunk:
+                # the image is drawn from the path of the row, a symmetric
+                # path may differ in pillars as reversing swaps U and D
+                path = row[0]
+                image = image_name(path, image_format)
+                filename = os.path.join(directory, image)
+                if filename not in todo and not os.path.exists(filename):
+                    todo[filename] = path, catalog
+                page_rows.append((row, image))
+            work = [(path, filename, catalog)
+                    for filename, (path, catalog) in todo.items()]
+            if pool is None:
+                for args in work:
+                    _draw(args)
+            else:
+                for _ in pool.imap_unordered(_draw, work):
+                    pass
+            _write_page(directory, page, page_rows, headers, last)
+            count += 1
+        _remove_pages(directory, count)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 DESCRIPTION = """\
@@ -42,12 +198,42 @@ Each track should be provided on a new line.
 
 def main():
     parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '--jobs',
+        dest='jobs', type=int, default=1,
+        help='number of processes rendering the images')
+    parser.add_argument(
+        '--page-size',
+        dest='page_size', type=int, default=PAGE_SIZE,
+        help='number of tracks on a page')
+    parser.add_argument(
+        '--format',
+        dest='image_format', choices=IMAGE_FORMATS, default='png',
+        help='format of the images, svg is smaller and faster to render')
+    parser.add_argument(
+        '--catalog',
+        dest='catalog', metavar='FILE',
+        help='read the pieces of the tracks from a JSON file, see solver.py')
+    parser.add_argument(
+        '--sort',
+        dest='sort', metavar='COLUMN', default='descr',
+        help='column which the tracks are sorted by, descr (the path) by '
+             'default, e.g. T or P')
     args = parser.parse_args()
-    tracks = []
-    for line in sys.stdin:
-        path = line.strip()
-        tracks.append(track.Track(path))
-    write_report(tracks)
+    catalog = None
+    if args.catalog:
+        try:
+            catalog = segments.load(args.catalog)
+        except (OSError, TypeError, ValueError) as e:
+            parser.error('%s: %s' % (args.catalog, e))
+    if args.sort not in columns(catalog):
+        parser.error('--sort must be one of %s' % ', '.join(columns(catalog)))
+    tracks = (
+        track.Track(line.strip(), catalog)
+        for line in sys.stdin if line.strip())
+    write_report(
+        tracks, jobs=args.jobs, page_size=args.page_size,
+        image_format=args.image_format, sort=args.sort)
 
 
 if __name__ == '__main__':
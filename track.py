@@ -8,13 +8,18 @@ import argparse
 import collections
 import math
 import itertools
+
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
 import collision
+import segments
 
-
-STRAIGHT_SIZE = 1.0
-TURN_SIZE = math.sqrt(2.0 - math.sqrt(2.0))
+try:
+    # Linear time normalization, available once the extension is built.
+    from dynamic import canonical_paths
+except ImportError:
+    canonical_paths = None
 
 
 def shifts(path):
@@ -23,14 +28,15 @@ def shifts(path):
 
 
 ROTATE_TRANSFORM = str.maketrans('RL', 'LR')
-def all_symetries(path):
+def all_symetries(path, catalog=None):
     # possible symmetries
     # translational - generate all translations and choose the biggest
     #                 lexicographycally
     # rotational    - change left rotation to right and choose the biggest
     #                 lexicographically
     # reverse path  - change the direction
-    mirror_path = path.translate(ROTATE_TRANSFORM)
+    transform = ROTATE_TRANSFORM if catalog is None else _tables(catalog).mirror
+    mirror_path = path.translate(transform)
     reversed_path = path[::-1]
     reversed_mirror_path = mirror_path[::-1]
     return itertools.chain(
@@ -41,17 +47,210 @@ def all_symetries(path):
     )
 
 
+def canonical_path(path, catalog=None):
+    """Return the least of all symmetric paths."""
+    if canonical_paths is None:
+        return min(all_symetries(path, catalog))
+    return canonical_paths([path], catalog)[0]
+
+
+# SVG images are drawn in hundredths of the unit, all numbers of their
+# paths are integers
+SVG_SCALE = 100
+
+
+def _svg_numbers(*values):
+    # rounded numbers of a path command separated only where they would merge
+    text = ''
+    for value in values:
+        number = str(round(value))
+        if text and not number.startswith('-'):
+            text += ' '
+        text += number
+    return text
+
+
+def _svg_line(dx, dy):
+    if not dy:
+        return 'h%d' % dx
+    if not dx:
+        return 'v%d' % dy
+    return 'l' + _svg_numbers(dx, dy)
+
+
+# Relative paths of ticks across the segments by Track.angle, in the
+# mirrored coordinates of images, the tick returns to its center.
+_SVG_TICKS = []
+for _a in range(8):
+    _tx = round(0.07 * SVG_SCALE * math.sin(_a * math.pi / 4))
+    _ty = round(-0.07 * SVG_SCALE * math.cos(_a * math.pi / 4))
+    _SVG_TICKS.append('m%s%sm%s' % (
+        _svg_numbers(_tx, _ty), _svg_line(-2 * _tx, -2 * _ty),
+        _svg_numbers(_tx, _ty)))
+# sides of the arrows of climbing segments by the sign of the climb, angle
+# and length
+_SVG_ARROWS = {}
+
+
+def _svg_arrow(climb, angle, length):
+    key = climb, angle, length
+    if key not in _SVG_ARROWS:
+        ax, ay, bx, by = (
+            round(climb * length * SVG_SCALE * f(angle * math.pi / 4 + da))
+            for da in (-.1, .1) for f in (math.cos, math.sin))
+        _SVG_ARROWS[key] = 'l%sl%sz' % (
+            _svg_numbers(ax, ay), _svg_numbers(bx - ax, by - ay))
+    return _SVG_ARROWS[key]
+
+
 def _replace_segment(path, i, lm, replace):
     lp = len(path)
     return path[max(i+lm-lp, 0):i] + replace + path[i+lm:]
 
 
+Geometry = collections.namedtuple('Geometry', 'codes angle lattice pos level')
+
+
+# Segments are encoded to their index, shorter paths are padded with PAD.
+SEGMENTS = ''.join(s.name for s in segments.BASIC.segments)
+PAD = segments.MAX_SEGMENTS
+
+
+# [angle][segment] -> shift of the lattice coordinates
+LATTICE_SHIFTS = tuple(
+    tuple(segments.shifts(s)[angle] for s in segments.BASIC.segments)
+    for angle in range(8)
+)
+
+_HALF_SQRT2 = math.sqrt(2.0) / 2.0
+# lattice coordinates -> (x, y)
+_TO_POS = np.array([
+    [_HALF_SQRT2, 0.0],
+    [1.0 - _HALF_SQRT2, 0.0],
+    [0.0, _HALF_SQRT2],
+    [0.0, 1.0 - _HALF_SQRT2],
+])
+
+
+def lattice_to_pos(point, scale=1):
+    ax, bx, ay, by = point
+    return ((ax*_HALF_SQRT2 + bx*(1.0 - _HALF_SQRT2)) / scale,
+            (ay*_HALF_SQRT2 + by*(1.0 - _HALF_SQRT2)) / scale)
+
+
+# Tables of a catalog of segments for the geometry of the tracks. Arrays
+# are indexed by the code of a segment, the last code is PAD.
+CatalogTables = collections.namedtuple(
+    'CatalogTables',
+    'names codes turns climbs lattice_shifts pillars lengths radii mirror '
+    'crossings scale')
+
+_CATALOG_TABLES = {}
+
+
+def _tables(catalog=None):
+    if catalog is None:
+        catalog = segments.BASIC
+    tables = _CATALOG_TABLES.get(catalog)
+    if tables is not None:
+        return tables
+    segments.check(catalog)
+    pieces = catalog.segments
+    names = ''.join(s.name for s in pieces)
+    codes = np.full(256, PAD, dtype=np.uint8)
+    for code, name in enumerate(names):
+        codes[ord(name)] = code
+    padding = PAD + 1 - len(pieces)
+    lattice_shifts = np.zeros((8, PAD + 1, 4), dtype=np.int32)
+    for code, s in enumerate(pieces):
+        lattice_shifts[:, code] = segments.shifts(s)
+    # pillars a*level + b after another segment and after an uphill
+    pillars = np.zeros((PAD + 1, 4), dtype=np.int32)
+    for code, s in enumerate(pieces):
+        pillars[code] = tuple(s.pillars) + tuple(s.after_up or s.pillars)
+    lengths = [math.hypot(*lattice_to_pos(s.shift, catalog.scale))
+               for s in pieces]
+    tables = CatalogTables(
+        names, codes,
+        np.array([s.turn for s in pieces] + [0] * padding, dtype=np.int8),
+        np.array([s.climb for s in pieces] + [0] * padding, dtype=np.int8),
+        lattice_shifts, pillars,
+        # rounded, so that pieces of the same length are drawn the same
+        [round(length, 9) for length in lengths],
+        # radius of the arc through both ends of a turning segment
+        [round(length / (2 * math.sin(abs(s.turn) * math.pi / 8)), 9)
+         if s.turn else None for s, length in zip(pieces, lengths)],
+        str.maketrans(names, ''.join(s.mirror or s.name for s in pieces)),
+        {s.name: s.counter for s in pieces if s.crossing},
+        catalog.scale)
+    _CATALOG_TABLES[catalog] = tables
+    return tables
+
+
+def batch_geometry(paths, catalog=None):
+    """Compute Track.angle, Track.lattice, Track.pos and Track.level of many
+    paths at once.
+
+    Every returned array has a row for each path. Rows of shorter paths are
+    padded with PAD segments which keep the last position. Raise
+    ValueError if a path has a segment which is not in the catalog, as
+    Track does.
+    """
+    tables = _tables(catalog)
+    length = max(1, max((len(p) for p in paths), default=0))
+    raw = np.array([p.encode('ascii') for p in paths], dtype='S%d' % length)
+    raw = raw.view(np.uint8).reshape(len(paths), length)
+    codes = tables.codes[raw]
+    # shorter paths are padded by zero bytes
+    if ((codes == PAD) & (raw != 0)).any():
+        raise ValueError('Paths have segments which are not in the catalog.')
+
+    angle = np.zeros((len(paths), length + 1), dtype=np.int32)
+    np.cumsum(tables.turns[codes], axis=1, out=angle[:, 1:])
+    angle %= 8
+
+    lattice = np.zeros((len(paths), length + 1, 4), dtype=np.int32)
+    np.cumsum(tables.lattice_shifts[angle[:, :-1], codes], axis=1,
+              out=lattice[:, 1:])
+    pos = lattice @ (_TO_POS / tables.scale)
+
+    level = np.zeros((len(paths), length + 1), dtype=np.int16)
+    np.cumsum(tables.climbs[codes], axis=1, out=level[:, 1:])
+    # minimal level should be 0
+    level -= level.min(axis=1, keepdims=True)
+    return Geometry(codes, angle, lattice, pos, level)
+
+
+def _batch_pillars(geometry, catalog=None):
+    # Same as Track.count_pillars.
+    tables = _tables(catalog)
+    codes = geometry.codes
+    level = geometry.level[:, :-1].astype(np.int32)
+    previous = np.roll(codes, 1, axis=1)
+    # the previous segment of the first one is the last one
+    last = np.maximum((codes != PAD).sum(axis=1) - 1, 0)
+    previous[:, 0] = codes[np.arange(len(codes)), last]
+    after_up = tables.climbs[previous] > 0
+    pillars = tables.pillars[codes]
+    pillars = np.where(
+        after_up, pillars[..., 2] * level + pillars[..., 3],
+        pillars[..., 0] * level + pillars[..., 1])
+    pillars[codes == PAD] = 0
+    return pillars.sum(axis=1)
+
+
 class Track:
-    def __init__(self, path):
+    """Closed path of segments of the catalog, by default segments.BASIC."""
+
+    def __init__(self, path, catalog=None):
         self.path = path
+        self.catalog = segments.BASIC if catalog is None else catalog
         self._angles = None
+        self._lattice = None
         self._pos = None
         self._level = None
+        # row of batch_geometry which the geometry is taken from
+        self._row = None
 
     def __hash__(self):
         return hash(self.path)
@@ -63,15 +262,16 @@ class Track:
         return not self == o
 
     def normalize(self):
-        return Track(min(all_symetries(self.path)))
+        return Track(canonical_path(self.path, self.catalog), self.catalog)
 
     def _find_segments(self, match):
-        path = self.path
-        lm = len(match)
+        # the match can wrap around the end of the path
         lp = len(self.path)
-        for i in range(lp):
-           if path[i:min(i+lm, lp)] + path[:max(i+lm-lp, 0)]  == match:
-               yield i
+        path = self.path + self.path[:len(match) - 1]
+        i = path.find(match)
+        while 0 <= i < lp:
+            yield i
+            i = path.find(match, i + 1)
 
     def _all_replacements(self, match, replace):
         lm = len(match)
@@ -79,12 +279,16 @@ class Track:
             yield _replace_segment(self.path, i, lm, replace)
 
     def _shorten_track(self, pair1, pair2):
+        angles = self.angle
         occ1 = [[] for _ in range(8)]
-        occ2 = [[] for _ in range(8)]
         for i in self._find_segments(pair1):
-            occ1[self.angle[i]].append(i)
-        for i in self._find_segments(pair2):
-            occ2[self.angle[i]].append(i)
+            occ1[angles[i]].append(i)
+        if pair1 == pair2:
+            occ2 = occ1
+        else:
+            occ2 = [[] for _ in range(8)]
+            for i in self._find_segments(pair2):
+                occ2[angles[i]].append(i)
         for angle in range(8):
             for a in occ1[angle]:
                 for b in occ2[(angle+4) % 8]:
@@ -115,15 +319,15 @@ class Track:
     @property
     def level(self):
         # Reconstruct height
+        if self._level is None and self._row is not None:
+            self._take_row()
         if self._level is None:
+            tables = _tables(self.catalog)
             level = [0]
             cl = 0
 
             for s in self.path:
-                if s == 'U':
-                    cl += 1
-                elif s == 'D':
-                    cl -= 1
+                cl += int(tables.climbs[tables.codes[ord(s)]])
                 level.append(cl)
             # minimal level should be 0
             ml = min(level)
@@ -142,35 +346,66 @@ class Track:
             self._count_pos()
         return self._angles
 
+    @property
+    def lattice(self):
+        """Exact positions in the basis of dynamic.pyx."""
+        if self._lattice is None:
+            self._count_pos()
+        return self._lattice
+
     def _count_pos(self):
-        x = y = .0
+        if self._row is not None:
+            self._take_row()
+            return
+        tables = _tables(self.catalog)
+        ax = bx = ay = by = 0
         angle = 0
         self._angles = []
-        self._pos = []
+        self._lattice = []
         for s in self.path:
-            self._pos.append((x, y))
-            self._angles.append(angle % 8)
-            if s == 'R':
-                a = (angle + 0.5) * math.pi / 4.0
-                angle += 1
-                r = TURN_SIZE
-            elif s == 'L':
-                a = (angle - 0.5) * math.pi / 4.0
-                angle -= 1
-                r = TURN_SIZE
-            else:
-                r = STRAIGHT_SIZE
-                a = angle * math.pi / 4.0
-            x += math.cos(a) * r
-            y += -math.sin(a) * r
-        self._pos.append((x, y))
-        self._angles.append(angle % 8)
+            self._lattice.append((ax, bx, ay, by))
+            self._angles.append(angle)
+            code = tables.codes[ord(s)]
+            if code == PAD:
+                raise ValueError('Segment %s is not in the catalog.' % s)
+            dax, dbx, day, dby = tables.lattice_shifts[angle, code].tolist()
+            ax += dax
+            bx += dbx
+            ay += day
+            by += dby
+            angle = (angle + int(tables.turns[code])) % 8
+        self._lattice.append((ax, bx, ay, by))
+        self._angles.append(angle)
+        self._pos = [lattice_to_pos(p, tables.scale) for p in self._lattice]
+
+    @classmethod
+    def from_geometry(cls, path, geometry, i, catalog=None):
+        """Track of the path in the row i of batch_geometry.
+
+        The geometry is taken from the row once it is needed, the lists of
+        all rows of a batch take several times its memory.
+        """
+        t = cls(path, catalog)
+        t._row = (geometry, i)
+        return t
+
+    def _take_row(self):
+        geometry, i = self._row
+        self._row = None
+        n = len(self.path) + 1
+        self._angles = geometry.angle[i, :n].tolist()
+        self._lattice = list(map(tuple, geometry.lattice[i, :n].tolist()))
+        self._pos = list(map(tuple, geometry.pos[i, :n].tolist()))
+        self._level = geometry.level[i, :n].tolist()
 
     def count_pillars(self):
+        tables = _tables(self.catalog)
         level = self.level
         path = self.path
         lp = len(path)
         pillars = 0
+        # Pillars of the basic segments are counted as follows, pillars of
+        # the segments of the catalog are given by it the same way.
         # up after a segment
         #   2 times level
         #   1 times level if the following segment is not down and there is no
@@ -184,18 +419,36 @@ class Track:
         #   level - 1
 
         for i in range(lp):
-            if path[i] == 'U':
-                pillars += 2 * level[i]
-            elif path[i] == 'D':
-                pillars += level[i] - 1
-                if path[(i-1) % lp] != 'U':
-                    # we can move one of support pillar backward
-                    # to support both segments
-                    pillars += level[i] - 1
-            else:
-                pillars += level[i]
+            code = tables.codes[ord(path[i])]
+            # we can move one of support pillar backward
+            # to support both segments
+            after_up = tables.climbs[tables.codes[ord(path[(i-1) % lp])]] > 0
+            a, b = tables.pillars[code, 2:] if after_up else tables.pillars[code, :2]
+            pillars += int(a) * level[i] + int(b)
         return pillars
 
+    def count_pieces(self):
+        """Return the pieces of every counter of the catalog in the track.
+
+        Both ways through a crossing take one piece.
+        """
+        pieces = collections.Counter(dict.fromkeys(self.catalog.counters, 0))
+        counters = {s.name: s.counter for s in self.catalog.segments}
+        pieces.update(counters[s] for s in self.path)
+        if _tables(self.catalog).crossings:
+            for name, pairs in collision.crossing_pairs(self).items():
+                pieces[counters[name]] -= pairs
+        return pieces
+
+    def _enough_crossings(self, material):
+        # The search counts the ways through crossings, not the pieces.
+        crossings = _tables(self.catalog).crossings
+        if not crossings:
+            return True
+        pieces = self.count_pieces()
+        return all(pieces[c] <= getattr(material, c)
+                   for c in set(crossings.values()))
+
     def is_valid(self, material):
         """Ensure that the paths do not intersect
         Also enforce more stricter condition on pillars.
@@ -203,7 +456,7 @@ class Track:
         path = self.path
         if not path:
             return False
-        if path.count('U') != path.count('D'):
+        if self.level[-1] != self.level[0]:
             # unbalanced
             return False
 
@@ -211,8 +464,7 @@ class Track:
             # does not return to original direction
             return False
 
-        endx, endy = self.pos[-1]
-        if not collision.almost_zero(endx) or not collision.almost_zero(endy):
+        if self.lattice[-1] != (0, 0, 0, 0):
             # does not return to original point
             return False
 
@@ -220,6 +472,9 @@ class Track:
         if material.pillars < self.count_pillars():
             return False
 
+        if not self._enough_crossings(material):
+            return False
+
         if collision.path_intersections(self):
             return False
 
@@ -253,22 +508,20 @@ class Track:
 
         #font = ImageFont.truetype(font='data/NunitoSans-Regular.ttf', size=FONT_SIZE)
         #draw.text((10, 10), self.path, font=font, fill=(255, 255, 255))
+        tables = _tables(self.catalog)
         sx, sy = transform((.0, .0))
         draw.arc((sx-5, sy-5, sx+5, sy+5), 0, 360, '#FF3333')
         for i, s in enumerate(self.path):
+            code = tables.codes[ord(s)]
+            turn = int(tables.turns[code])
+            climb = int(tables.climbs[code])
             a = self.angle[i] * math.pi / 4.0
-            if s == 'R':
-                r = TURN_SIZE
-            elif s == 'L':
-                r = TURN_SIZE
-            else:
-                r = STRAIGHT_SIZE
             level = self.level[i]
-            if s == 'D':
+            if climb < 0:
                 level -= 1
-            r = round(r * GRID_SIZE)
+            r = round(tables.lengths[code] * GRID_SIZE)
             color = COLORS[level]
-            if s == 'U':
+            if climb > 0:
                 x, y = transform(pos[i])
                 x2 = round(x + math.cos(a - .1) * r)
                 y2 = round(y + math.sin(a - .1) * r)
@@ -277,7 +530,7 @@ class Track:
                 draw.line((x, y, x2, y2), fill=color)
                 draw.line((x, y, x3, y3), fill=color)
                 draw.line((x2, y2, x3, y3), fill=color)
-            elif s == 'D':
+            elif climb < 0:
                 x, y = transform(pos[i+1])
                 x2 = round(x - math.cos(a - .1) * r)
                 y2 = round(y - math.sin(a - .1) * r)
@@ -286,24 +539,23 @@ class Track:
                 draw.line((x, y, x2, y2), fill=color)
                 draw.line((x, y, x3, y3), fill=color)
                 draw.line((x2, y2, x3, y3), fill=color)
-            elif s == 'L':
+            elif turn < 0:
                 x, y = transform(pos[i])
                 sa = (self.angle[i] / 4.0 + 0.5) * math.pi
-                r = GRID_SIZE
+                r = round(tables.radii[code] * GRID_SIZE)
                 sx = round(x - math.cos(sa) * r)
                 sy = round(y - math.sin(sa) * r)
-                d = self.angle[i] * 45 + 45
-                draw.arc((sx-r, sy-r, sx+r, sy+r), d, d + 45, fill=color)
-            elif s == 'R':
+                d = self.angle[i] * 45 + 90
+                draw.arc((sx-r, sy-r, sx+r, sy+r), d + 45 * turn, d, fill=color)
+            elif turn > 0:
                 x, y = transform(pos[i])
                 sa = (self.angle[i] / 4.0 + 1.5) * math.pi
-                r = GRID_SIZE
+                r = round(tables.radii[code] * GRID_SIZE)
                 sx = round(x - math.cos(sa) * r)
                 sy = round(y - math.sin(sa) * r)
                 d = self.angle[i] * 45 - 90
-                draw.arc((sx-r, sy-r, sx+r, sy+r), d, d + 45, fill=color)
+                draw.arc((sx-r, sy-r, sx+r, sy+r), d, d + 45 * turn, fill=color)
             else:
-                assert s == 'S'
                 x, y = transform(pos[i])
                 x2 = round(x + math.cos(a) * r)
                 y2 = round(y + math.sin(a) * r)
@@ -318,16 +570,135 @@ class Track:
 
         return image
 
+    def to_svg(self):
+        """Return an SVG image of the track in the same layout as to_image.
+
+        Segments of the same level are drawn by one path, turns are arcs.
+        Points are rounded to hundredths of the unit, SVG_SCALE, and every
+        command is relative to the previous point, so that the image stays
+        small.
+        """
+        BORDER = 0.25
+        GRID_SIZE = 40
+        COLORS = ['#333', '#818', '#a11']
+
+        # Mirror coordinates by x axis.
+        pos = [(x, -y) for x, y in self.pos]
+        minx = min(x for x, y in pos) - BORDER
+        miny = min(y for x, y in pos) - BORDER
+        w = max(x for x, y in pos) + BORDER - minx
+        h = max(y for x, y in pos) + BORDER - miny
+        # relative commands are differences of the rounded points, so
+        # rounding errors don't add up
+        points = [(round(x * SVG_SCALE), round(y * SVG_SCALE))
+                  for x, y in pos]
+
+        tables = _tables(self.catalog)
+        paths = collections.defaultdict(list)
+        # current points of the paths
+        ends = {}
+        for i, s in enumerate(self.path):
+            code = tables.codes[ord(s)]
+            turn = int(tables.turns[code])
+            climb = int(tables.climbs[code])
+            level = self.level[i]
+            if climb < 0:
+                level -= 1
+            color = COLORS[min(level, len(COLORS) - 1)]
+            d = paths[color]
+            (x, y), (x2, y2) = points[i], points[i+1]
+            if color not in ends:
+                d.append('M' + _svg_numbers(x, y))
+            elif ends[color] != (x, y):
+                ex, ey = ends[color]
+                d.append('m' + _svg_numbers(x - ex, y - ey))
+            # tick at the start of the segment
+            d.append(_SVG_TICKS[self.angle[i]])
+            end = x2, y2
+            if climb:
+                # narrow triangle pointing uphill from the lower end, the
+                # path closes to the point where it moved last
+                if climb < 0:
+                    d.append('m' + _svg_numbers(x2 - x, y2 - y))
+                d.append(_svg_arrow(
+                    climb, self.angle[i], tables.lengths[code]))
+                if climb > 0:
+                    end = x, y
+            elif turn:
+                r = tables.radii[code] * SVG_SCALE
+                d.append('a' + _svg_numbers(
+                    r, r, 0, 0, turn > 0, x2 - x, y2 - y))
+            else:
+                d.append(_svg_line(x2 - x, y2 - y))
+            ends[color] = end
+
+        svg = [
+            '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+            'viewBox="%s" fill="none" stroke-width="%s">' % (
+                round(w * GRID_SIZE), round(h * GRID_SIZE),
+                _svg_numbers(*(v * SVG_SCALE for v in (minx, miny, w, h))),
+                '%g' % (SVG_SCALE / GRID_SIZE)),
+            '<circle r="%g" stroke="#f33"/>' % (5 * SVG_SCALE / GRID_SIZE),
+        ]
+        for color, d in paths.items():
+            svg.append('<path stroke="%s" d="%s"/>' % (color, ''.join(d)))
+        svg.append('</svg>')
+        return '\n'.join(svg) + '\n'
+
     def draw(self, filename):
+        if filename.endswith('.svg'):
+            with open(filename, 'w') as f:
+                f.write(self.to_svg())
+            return
         image = self.to_image()
         image.save(filename)
 
 
+def valid_tracks(paths, material, check_collisions=True, catalog=None):
+    """Return tracks of the paths which are valid for the material.
+
+    Closure and pillars are checked on the whole batch at once, only the
+    remaining tracks are checked for collisions one by one. The check can
+    be skipped for paths which are known not to intersect themselves.
+    Pieces of crossings are always counted, the search counts the ways
+    through them. Raise ValueError if a path has a segment which is not in
+    the catalog.
+    """
+    if not paths:
+        return []
+    tables = _tables(catalog)
+    geometry = batch_geometry(paths, catalog)
+    codes = geometry.codes
+    mask = (
+        (codes[:, 0] != PAD) &
+        (tables.climbs[codes].sum(axis=1) == 0) &
+        (geometry.angle[:, -1] == 0) &
+        (geometry.lattice[:, -1] == 0).all(axis=1) &
+        (_batch_pillars(geometry, catalog) <= material.pillars)
+    )
+    tracks = []
+    for i in np.flatnonzero(mask):
+        t = Track.from_geometry(paths[i], geometry, i, catalog)
+        if not t._enough_crossings(material):
+            continue
+        if not check_collisions or not collision.path_intersections(t):
+            tracks.append(t)
+    return tracks
+
+
 def main():
     parser = argparse.ArgumentParser(description="Display the track.")
     parser.add_argument('track', help='The track which should be displayed.')
+    parser.add_argument(
+        '--output',
+        dest='output', default=None,
+        help='write the image to the file instead, .svg files are vector '
+             'images')
     args = parser.parse_args()
     track = Track(args.track)
+    if args.output:
+        track.draw(args.output)
+        return
     image = track.to_image()
     image.show()
 